@@ -1 +1,2 @@
 from tello_ctrl import tello_ctrl, tello_ctrlException
+from tello_async import tello_async
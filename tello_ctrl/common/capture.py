@@ -0,0 +1,287 @@
+"""Capture of the raw datagrams received from the drone.
+
+File layout (little endian):
+
+    * file header : magic ``b'TELLOCAP'``, version (uint16), wall clock time and monotonic time (double) at the
+      creation of the file (used to convert the receive times into wall clock times)
+    * blocks : block header (magic ``b'BLCK'``, number of records (uint32), size of the records (uint32), receive time
+      of the first and last record (double)) followed by the records. A record is a receive time (double), a
+      channel (uint8, :data:`CHANNEL_CONTROL` or :data:`CHANNEL_VIDEO`), a length (uint16) and the datagram.
+    * block index : one entry per block (offset (uint64), number of records (uint32), first and last receive time
+      (double)) followed by a trailer (magic ``b'TELLOIDX'``, offset of the index (uint64), number of blocks (uint32)).
+
+The index is written when the capture is closed. If it is missing (e.g. the program crashed), the reader finds the
+blocks by walking the block headers.
+"""
+import mmap
+import struct
+import threading
+import time
+
+from . import crc
+from .protocol import FlightData, FLIGHT_DATA_GROUPS, FLIGHT_MSG, LOG_DATA_MSG
+from .history import TelemetryHistory
+
+CHANNEL_CONTROL = 0
+CHANNEL_VIDEO = 1
+
+FILE_MAGIC = b'TELLOCAP'
+FILE_VERSION = 1
+FILE_HEADER_STRUCT = struct.Struct('<8sHdd')
+BLOCK_MAGIC = b'BLCK'
+BLOCK_HEADER_STRUCT = struct.Struct('<4sIIdd')
+RECORD_HEADER_STRUCT = struct.Struct('<dBH')
+INDEX_ENTRY_STRUCT = struct.Struct('<QIdd')
+TRAILER_MAGIC = b'TELLOIDX'
+TRAILER_STRUCT = struct.Struct('<8sQI')
+
+
+class CaptureWriter(object):
+    """Appends datagrams to a capture file. The records are accumulated in memory and written by blocks.
+    :meth:`write` can be called from several threads.
+
+    :param file_name: name of the capture file (overwritten)
+    :type file_name: str
+    :param block_size: size of the blocks in bytes, defaults to 64kB
+    :type block_size: int
+    """
+    def __init__(self, file_name, block_size=65536):
+        self.file_name = file_name
+        self.block_size = block_size
+        self.__lock = threading.Lock()
+        self.__file = open(file_name, 'wb')
+        self.__file.write(FILE_HEADER_STRUCT.pack(FILE_MAGIC, FILE_VERSION, time.time(), time.monotonic()))
+        self.__index = []
+        self.__block = bytearray()
+        self.__block_count = 0
+        self.__block_first = 0.0
+        self.__block_last = 0.0
+        self.count = 0
+
+    def write(self, channel, timestamp, data):
+        """Appends a datagram.
+
+        :param channel: :data:`CHANNEL_CONTROL` or :data:`CHANNEL_VIDEO`
+        :type channel: int
+        :param timestamp: receive time (``time.monotonic()``)
+        :type timestamp: float
+        :param data: the datagram
+        :type data: bytes, bytearray or memoryview
+        """
+        with self.__lock:
+            if self.__file is None:
+                return
+            if self.__block_count == 0:
+                self.__block_first = timestamp
+            self.__block += RECORD_HEADER_STRUCT.pack(timestamp, channel, len(data))
+            self.__block += data
+            self.__block_count += 1
+            self.__block_last = timestamp
+            self.count += 1
+            if len(self.__block) >= self.block_size:
+                self.__flush_block()
+
+    def __flush_block(self):
+        if self.__block_count == 0:
+            return
+        offset = self.__file.tell()
+        self.__file.write(BLOCK_HEADER_STRUCT.pack(BLOCK_MAGIC, self.__block_count, len(self.__block),
+                                                   self.__block_first, self.__block_last))
+        self.__file.write(self.__block)
+        self.__index.append((offset, self.__block_count, self.__block_first, self.__block_last))
+        self.__block = bytearray()
+        self.__block_count = 0
+
+    def close(self):
+        """Writes the pending records and the block index, and closes the file."""
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__flush_block()
+            index_offset = self.__file.tell()
+            for entry in self.__index:
+                self.__file.write(INDEX_ENTRY_STRUCT.pack(*entry))
+            self.__file.write(TRAILER_STRUCT.pack(TRAILER_MAGIC, index_offset, len(self.__index)))
+            self.__file.close()
+            self.__file = None
+
+
+class CaptureReader(object):
+    """Reads a capture file written by :class:`CaptureWriter`. The file is memory mapped and the datagrams are
+    returned as ``memoryview`` objects pointing into the map (valid until :meth:`close`).
+
+    :param file_name: name of the capture file
+    :type file_name: str
+    :raise ValueError: An exception is raised if the file is not a capture file.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.__file = open(file_name, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__map)
+        if len(self.__map) < FILE_HEADER_STRUCT.size:
+            raise ValueError('%s is not a capture file' % file_name)
+        (magic, version, wall_time, monotonic_time) = FILE_HEADER_STRUCT.unpack_from(self.__map, 0)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError('%s is not a capture file' % file_name)
+        # add this offset to the receive times to get wall clock times
+        self.wall_clock_offset = wall_time - monotonic_time
+        self.blocks = self.__read_index()
+
+    def __read_index(self):
+        size = len(self.__map)
+        if size >= FILE_HEADER_STRUCT.size + TRAILER_STRUCT.size:
+            (magic, index_offset, count) = TRAILER_STRUCT.unpack_from(self.__map, size - TRAILER_STRUCT.size)
+            if magic == TRAILER_MAGIC:
+                return [INDEX_ENTRY_STRUCT.unpack_from(self.__map, index_offset + i * INDEX_ENTRY_STRUCT.size)
+                        for i in range(count)]
+        # no index: walk the blocks
+        blocks = []
+        offset = FILE_HEADER_STRUCT.size
+        while offset + BLOCK_HEADER_STRUCT.size <= size:
+            (magic, count, length, first, last) = BLOCK_HEADER_STRUCT.unpack_from(self.__map, offset)
+            if magic != BLOCK_MAGIC or offset + BLOCK_HEADER_STRUCT.size + length > size:
+                break
+            blocks.append((offset, count, first, last))
+            offset += BLOCK_HEADER_STRUCT.size + length
+        return blocks
+
+    def __len__(self):
+        return sum(block[1] for block in self.blocks)
+
+    def count(self, channel):
+        """Returns the number of datagrams of a channel (requires reading the record headers)."""
+        return sum(1 for record in self.packets(channel))
+
+    def packets(self, channel=None, start_time=None, end_time=None):
+        """Iterates over the datagrams. Blocks outside of the requested time range are skipped using the index.
+
+        :param channel: only return the datagrams of this channel, defaults to None (all)
+        :type channel: int, optional
+        :param start_time: only return the datagrams received at or after this time, defaults to None
+        :type start_time: float, optional
+        :param end_time: only return the datagrams received at or before this time, defaults to None
+        :type end_time: float, optional
+        :return: An iterator of ``(timestamp, channel, data)`` tuples.
+        """
+        view = self.__view
+        unpack_record = RECORD_HEADER_STRUCT.unpack_from
+        record_header_size = RECORD_HEADER_STRUCT.size
+        for (offset, count, first, last) in self.blocks:
+            if (start_time is not None and last < start_time) or (end_time is not None and first > end_time):
+                continue
+            pos = offset + BLOCK_HEADER_STRUCT.size
+            for i in range(count):
+                (timestamp, record_channel, length) = unpack_record(view, pos)
+                pos += record_header_size
+                if ((channel is None or record_channel == channel)
+                        and (start_time is None or timestamp >= start_time)
+                        and (end_time is None or timestamp <= end_time)):
+                    yield (timestamp, record_channel, view[pos:pos + length])
+                pos += length
+
+    def close(self):
+        """Closes the file. The datagrams returned by :meth:`packets` must be released (or deleted) before."""
+        self.__view.release()
+        self.__map.close()
+        self.__file.close()
+
+
+def decode_capture(file_name, names=None):
+    """Decodes the telemetry of a capture file with the :class:`~common.protocol.FlightData` decoders.
+
+    :param file_name: name of the capture file
+    :type file_name: str
+    :param names: names of the values to return, defaults to None (all the values of the history groups)
+    :type names: [str], optional
+    :return: A dictionnary giving for each name a tuple ``(t, x)`` of numpy arrays, ``t`` being the receive
+        times (``time.monotonic()`` of the capturing computer, see :attr:`CaptureReader.wall_clock_offset`).
+    :rtype: dict
+    """
+    reader = CaptureReader(file_name)
+    try:
+        control_count = reader.count(CHANNEL_CONTROL)
+        # a control packet updates at most one row of each group (except log packets with several records of the
+        # same type, hence the margin)
+        capacity = 2 * control_count + 1
+        row_size = sum((len(group) + 1) * 8 for group in FLIGHT_DATA_GROUPS.values())
+        history = TelemetryHistory(FLIGHT_DATA_GROUPS, capacity * row_size)
+        flight_data = FlightData()
+        verify = crc.verify
+        for (timestamp, channel, data) in reader.packets(CHANNEL_CONTROL):
+            if len(data) >= 11 and data[0] == 0xcc and verify(data):
+                cmd = data[5] | (data[6] << 8)
+                if cmd == LOG_DATA_MSG:
+                    flight_data.update_log_message(data[10:], None, history, timestamp)
+                elif cmd == FLIGHT_MSG:
+                    flight_data.update_fly_message(data[9:], history, timestamp)
+            # the map can only be closed when no view points into it
+            data.release()
+        if names is None:
+            names = history.get_names()
+        return history.get_history(names)
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    # Benchmark of the batch decoder on a synthesized capture
+    # (run from the tello_ctrl folder with: python -m common.capture [capture file])
+    import sys
+    import os
+    import tempfile
+    from .protocol import MVO_RECORD_STRUCT, IMU_RECORD_STRUCT, IMU_EXT_RECORD_STRUCT, FLIGHT_MSG_STRUCT
+    from .protocol import LOG_RECORD_HEADER_STRUCT, XOR_TABLES
+
+    def make_packet(cmd, payload):
+        size = 9 + len(payload) + 2
+        buf = bytearray(size)
+        buf[0] = 0xcc
+        struct.pack_into('<H', buf, 1, size << 3)
+        buf[3] = crc.crc8(buf[0:3])
+        buf[4] = 0x50
+        struct.pack_into('<H', buf, 5, cmd)
+        buf[9:size - 2] = payload
+        struct.pack_into('<H', buf, size - 2, crc.crc16(buf[:size - 2]))
+        return bytes(buf)
+
+    def log_record(rec_id, payload, tick):
+        header = LOG_RECORD_HEADER_STRUCT.pack(0x55, len(payload) + 12, 0, rec_id, tick)
+        return header + bytes(payload).translate(XOR_TABLES[tick & 0xff]) + b'\x00\x00'
+
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+        remove = False
+    else:
+        # 10 minutes of telemetry at 50 Hz
+        fd, file_name = tempfile.mkstemp(suffix='.cap')
+        os.close(fd)
+        remove = True
+        writer = CaptureWriter(file_name)
+        mvo = bytearray(80)
+        imu = bytearray(120)
+        imu_ext = bytearray(60)
+        for i in range(30000):
+            t = i * 0.02
+            MVO_RECORD_STRUCT.pack_into(mvo, 0, i % 1000, 0, 0, t, 0.0, 0.0, *([0.0] * 14), 0x77)
+            IMU_RECORD_STRUCT.pack_into(imu, 0, *([0.0] * 10), 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            IMU_EXT_RECORD_STRUCT.pack_into(imu_ext, 0, *([0.0] * 11), 0)
+            writer.write(CHANNEL_CONTROL, t, make_packet(LOG_DATA_MSG, b'\x00' + log_record(29, mvo, i)
+                                                         + log_record(2048, imu, i) + log_record(2064, imu_ext, i)))
+            writer.write(CHANNEL_CONTROL, t, make_packet(FLIGHT_MSG, FLIGHT_MSG_STRUCT.pack(
+                i % 100, 0, 0, 0, i, 0, 0, 80, 3800, 400, 0, 6, 0, 0, 0, 0, 0)))
+            writer.write(CHANNEL_VIDEO, t, bytes(1460))
+        writer.close()
+
+    reader = CaptureReader(file_name)
+    packets = len(reader)
+    duration = reader.blocks[-1][3] - reader.blocks[0][2]
+    print('%s: %d datagrams in %d blocks, %.1f s' % (file_name, packets, len(reader.blocks), duration))
+    reader.close()
+    t0 = time.perf_counter()
+    history = decode_capture(file_name)
+    elapsed = time.perf_counter() - t0
+    print('decoded in %.2f s: %.0f datagrams/s, %.0f x real time, %d mvo samples'
+          % (elapsed, packets / elapsed, duration / elapsed, len(history['posX'][0])))
+    if remove:
+        os.remove(file_name)
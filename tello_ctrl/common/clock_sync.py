@@ -0,0 +1,195 @@
+import math
+
+import numpy as np
+
+
+TICK_WRAP = 1 << 32
+
+
+class ClockSync(object):
+    """Online estimation of the host time (``time.monotonic()``) of the drone ticks.
+
+    Each log record of the drone carries a 32 bits tick. The ticks are unwrapped and the host time is modelled as
+    ``arrival = offset + period * tick + latency``:
+
+        * ``period`` (the duration of a tick on the host clock, which includes the drift of the drone clock) is the
+          least squares slope of the arrival times against the ticks, updated at each sample;
+        * ``offset`` is the lower envelope of ``arrival - period * tick`` over the last ``window`` samples, i.e. the
+          sample received with the smallest delay is assumed to have no latency.
+
+    The sensor time of a sample is then ``offset + period * tick`` and its latency is ``arrival - sensor time``. As the
+    constant part of the one-way latency cannot be observed from the ticks, the latency is measured relatively to the
+    fastest sample of the window. Until ``min_samples`` samples spread over ``min_span`` seconds are received, the
+    sensor time is the arrival time.
+
+    A tick going backward (other than the 32 bits wrap) means the drone restarted: the estimation is reset.
+
+    :param window: number of samples used for the offset, defaults to 512
+    :type window: int
+    :param min_samples: number of samples needed before the estimation is used, defaults to 50
+    :type min_samples: int
+    :param min_span: duration in seconds of the samples needed before the estimation is used, defaults to 1
+    :type min_span: float
+    """
+    def __init__(self, window=512, min_samples=50, min_span=1.0):
+        if window <= 0:
+            raise ValueError('window must be strictly positive')
+        self.window = int(window)
+        self.min_samples = min_samples
+        self.min_span = min_span
+        # ticks and arrival times of the last samples, relative to the first sample
+        self.__ticks = np.zeros(self.window, dtype=np.float64)
+        self.__arrivals = np.zeros(self.window, dtype=np.float64)
+        self.resets = 0
+        self.reset()
+
+    def reset(self):
+        """Restarts the estimation (the statistics are cleared)."""
+        self.synchronized = False
+        self.count = 0
+        self.period = None
+        self.offset = None
+        self.__last_tick = None
+        self.__tick = 0
+        self.__first_arrival = None
+        self.__last_time = None
+        # running means and co-moments of the regression (Welford)
+        self.__mean_tick = 0.0
+        self.__mean_arrival = 0.0
+        self.__c_tick_arrival = 0.0
+        self.__c_tick_tick = 0.0
+        self.__intercept = None
+        # latency statistics
+        self.last_latency = None
+        self.__latency_count = 0
+        self.__latency_mean = 0.0
+        self.__latency_m2 = 0.0
+        self.__latency_min = math.inf
+        self.__latency_max = 0.0
+
+    def update(self, tick, arrival):
+        """Adds a sample and returns its sensor time.
+
+        :param tick: tick of the drone (32 bits)
+        :type tick: int
+        :param arrival: receive time of the sample (``time.monotonic()``)
+        :type arrival: float
+        :return: The sensor time of the sample (``time.monotonic()`` clock).
+        :rtype: float
+        """
+        if self.__last_tick is not None:
+            delta = tick - self.__last_tick
+            if delta < -(TICK_WRAP >> 1):
+                delta += TICK_WRAP
+            if delta < 0:
+                self.resets += 1
+                self.reset()
+        self.__last_tick = tick
+        if self.__first_arrival is None:
+            self.__first_arrival = arrival
+        else:
+            self.__tick += delta
+
+        x = float(self.__tick)
+        y = arrival - self.__first_arrival
+        self.__ticks[self.count % self.window] = x
+        self.__arrivals[self.count % self.window] = y
+        self.count += 1
+        n = self.count
+        dx = x - self.__mean_tick
+        self.__mean_tick += dx / n
+        self.__mean_arrival += (y - self.__mean_arrival) / n
+        self.__c_tick_arrival += dx * (y - self.__mean_arrival)
+        self.__c_tick_tick += dx * (x - self.__mean_tick)
+
+        if not self.synchronized:
+            if n < self.min_samples or y < self.min_span or self.__c_tick_tick <= 0:
+                return arrival
+            self.synchronized = True
+
+        self.period = self.__c_tick_arrival / self.__c_tick_tick
+        residual = y - self.period * x
+        if self.__intercept is None or n % 64 == 0:
+            # the slope changed since the last minimum: recompute it on the window
+            m = min(n, self.window)
+            self.__intercept = float(np.min(self.__arrivals[:m] - self.period * self.__ticks[:m]))
+        elif residual < self.__intercept:
+            self.__intercept = residual
+        self.offset = self.__first_arrival + self.__intercept
+
+        sensor_time = min(self.offset + self.period * x, arrival)
+        # the sensor times are increasing (the offset can decrease when a faster sample is received)
+        if self.__last_time is not None and sensor_time < self.__last_time:
+            sensor_time = self.__last_time
+        self.__last_time = sensor_time
+        self.__update_latency(arrival - sensor_time)
+        return sensor_time
+
+    def __update_latency(self, latency):
+        self.last_latency = latency
+        self.__latency_count += 1
+        delta = latency - self.__latency_mean
+        self.__latency_mean += delta / self.__latency_count
+        self.__latency_m2 += delta * (latency - self.__latency_mean)
+        if latency < self.__latency_min:
+            self.__latency_min = latency
+        if latency > self.__latency_max:
+            self.__latency_max = latency
+
+    def get_statistics(self):
+        """Returns the state of the estimation:
+
+            * ``synchronized`` : True when the sensor times are estimated from the ticks
+            * ``count`` : number of samples since the last reset
+            * ``resets`` : number of restarts of the drone clock detected
+            * ``tick_rate`` : number of ticks per second of the host clock (``None`` until synchronized)
+            * ``offset`` : host time of the tick 0 after unwrapping (s)
+            * ``latency_last``, ``latency_mean``, ``latency_min``, ``latency_max`` : delay between the sensor time and
+              the arrival time (s), relative to the fastest sample
+            * ``latency_jitter`` : standard deviation of the latency (s)
+
+        :rtype: dict
+        """
+        if self.__latency_count > 1:
+            jitter = math.sqrt(self.__latency_m2 / (self.__latency_count - 1))
+        else:
+            jitter = 0.0
+        return {'synchronized': self.synchronized,
+                'count': self.count,
+                'resets': self.resets,
+                'tick_rate': None if not self.period else 1 / self.period,
+                'offset': self.offset,
+                'latency_last': self.last_latency,
+                'latency_mean': self.__latency_mean if self.__latency_count else None,
+                'latency_min': self.__latency_min if self.__latency_count else None,
+                'latency_max': self.__latency_max if self.__latency_count else None,
+                'latency_jitter': jitter}
+
+
+if __name__ == '__main__':
+    # Accuracy and cost of the estimation on simulated ticks
+    # (run from the tello_ctrl folder with: python -m common.clock_sync)
+    import random
+    import timeit
+
+    clock = ClockSync()
+    tick_rate = 1e6 * (1 + 50e-6)      # 1MHz clock, 50ppm fast
+    start_tick = TICK_WRAP - 3000000   # wraps after 3 seconds
+    errors = []
+    for i in range(6000):
+        t = 100 + i * 0.01
+        latency = 0.002 + random.expovariate(1 / 0.005)
+        tick = int(start_tick + (t - 100) * tick_rate) % TICK_WRAP
+        sensor_time = clock.update(tick, t + latency)
+        if clock.synchronized:
+            errors.append(sensor_time - t)
+    stats = clock.get_statistics()
+    print('tick rate %.1f (true %.1f), sensor time error: mean %.2f ms, max %.2f ms (2 ms of latency are not observable)'
+          % (stats['tick_rate'], tick_rate, np.mean(errors) * 1e3, np.max(np.abs(errors)) * 1e3))
+    n = 20000
+    tick = [0]
+
+    def update():
+        tick[0] += 10000
+        clock.update(tick[0] % TICK_WRAP, 200 + tick[0] * 1e-6)
+    print('update: %.2f us' % (timeit.timeit(update, number=n) / n * 1e6))
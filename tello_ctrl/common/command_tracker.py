@@ -0,0 +1,230 @@
+import time
+import threading
+
+
+# upper bounds of the round trip time histogram bins, in seconds (the last bin collects the larger values)
+RTT_HISTOGRAM_EDGES = (0.002, 0.005, 0.010, 0.020, 0.050, 0.100, 0.200, 0.500, 1.0)
+
+
+class _PendingCommand(object):
+    def __init__(self, cmd, seq_num, buffer, retries, now):
+        self.cmd = cmd
+        self.seq_num = seq_num
+        self.buffer = buffer
+        self.retries = retries
+        self.attempts = 1
+        self.first_sent = now
+        self.last_sent = now
+
+
+class _CommandStatistics(object):
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.retransmitted = 0
+        self.lost = 0
+        self.unmatched_acks = 0
+        self.rtt_count = 0
+        self.rtt_sum = 0.0
+        self.rtt_min = None
+        self.rtt_max = None
+        self.rtt_histogram = [0] * (len(RTT_HISTOGRAM_EDGES) + 1)
+
+    def add_rtt(self, rtt):
+        self.rtt_count += 1
+        self.rtt_sum += rtt
+        if self.rtt_min is None or rtt < self.rtt_min:
+            self.rtt_min = rtt
+        if self.rtt_max is None or rtt > self.rtt_max:
+            self.rtt_max = rtt
+        for i, edge in enumerate(RTT_HISTOGRAM_EDGES):
+            if rtt <= edge:
+                self.rtt_histogram[i] += 1
+                return
+        self.rtt_histogram[-1] += 1
+
+    def as_dict(self):
+        return {'sent': self.sent,
+                'acked': self.acked,
+                'retransmitted': self.retransmitted,
+                'lost': self.lost,
+                'unmatched_acks': self.unmatched_acks,
+                'rtt_mean': self.rtt_sum / self.rtt_count if self.rtt_count > 0 else None,
+                'rtt_min': self.rtt_min,
+                'rtt_max': self.rtt_max,
+                'rtt_histogram': list(self.rtt_histogram)}
+
+
+class CommandTracker(object):
+    """Sequence numbers, acknowledgement matching and retransmission of the commands sent to the drone.
+
+    Each tracked command is stored with a copy of its packet until the drone acknowledges it. An ack is
+    matched on (command id, sequence number); if no command with this sequence number is pending, it is
+    matched with the oldest pending command with the same id. Commands that are not acknowledged within
+    ``timeout`` are sent again up to ``retries`` times, the timeout being multiplied by ``backoff`` after
+    each attempt. The round trip time is only measured for commands acknowledged at the first attempt
+    (an ack of a retransmitted command cannot be attributed to one of the attempts).
+
+    The tracker does not send anything itself: :meth:`poll` returns the packets to send again.
+
+    :param retries: default number of retransmissions of a command, defaults to 0
+    :type retries: int
+    :param timeout: time to wait for the ack before sending the command again, in seconds, defaults to 0.3
+    :type timeout: float
+    :param backoff: factor applied to the timeout after each attempt, defaults to 2
+    :type backoff: float
+    :raise ValueError: An exception is raised if a parameter is out of range.
+    """
+    def __init__(self, retries=0, timeout=0.3, backoff=2.0):
+        self.__lock = threading.Lock()
+        self.__seq_num = 0x01e4
+        self.__pending = {}
+        self.__statistics = {}
+        self.configure(retries, timeout, backoff)
+
+    def configure(self, retries=0, timeout=0.3, backoff=2.0):
+        """Changes the retransmission parameters (see the class documentation)."""
+        if retries < 0:
+            raise ValueError('retries must be positive')
+        if timeout <= 0:
+            raise ValueError('timeout must be strictly positive')
+        if backoff < 1:
+            raise ValueError('backoff must be greater or equal to 1')
+        self.retries = int(retries)
+        self.timeout = timeout
+        self.backoff = backoff
+
+    def next_seq_num(self):
+        """Returns a new sequence number (16 bits, 0 is never used as it is the sequence number of the stick command)."""
+        with self.__lock:
+            self.__seq_num = (self.__seq_num + 1) & 0xffff
+            if self.__seq_num == 0:
+                self.__seq_num = 1
+            return self.__seq_num
+
+    def __get_statistics(self, cmd):
+        statistics = self.__statistics.get(cmd)
+        if statistics is None:
+            statistics = self.__statistics[cmd] = _CommandStatistics()
+        return statistics
+
+    def register(self, cmd, seq_num, buffer, retries=None, now=None):
+        """Records a command that has just been sent.
+
+        :param cmd: command id
+        :type cmd: int
+        :param seq_num: sequence number of the packet
+        :type seq_num: int
+        :param buffer: the packet (copied, so preallocated packets can be reused)
+        :type buffer: bytes or bytearray
+        :param retries: number of retransmissions for this command, defaults to the tracker value
+        :type retries: int, optional
+        """
+        if now is None:
+            now = time.monotonic()
+        if retries is None:
+            retries = self.retries
+        with self.__lock:
+            self.__pending[(cmd, seq_num)] = _PendingCommand(cmd, seq_num, bytes(buffer), retries, now)
+            self.__get_statistics(cmd).sent += 1
+
+    def acknowledge(self, cmd, seq_num, now=None):
+        """Matches an ack received from the drone with a pending command. The acks of the sequence number 0 (packets
+        sent without being registered) are ignored.
+
+        :return: The round trip time in seconds, or ``None`` if the ack does not match a pending command or
+            if the command was retransmitted.
+        :rtype: float
+        """
+        if seq_num == 0:
+            # untracked packet (stick command, periodic video request...)
+            return None
+        if now is None:
+            now = time.monotonic()
+        with self.__lock:
+            statistics = self.__get_statistics(cmd)
+            pending = self.__pending.pop((cmd, seq_num), None)
+            if pending is None:
+                # fall back on the oldest pending command with the same id (dicts keep the insertion order)
+                for key, candidate in self.__pending.items():
+                    if candidate.cmd == cmd:
+                        pending = self.__pending.pop(key)
+                        break
+            if pending is None:
+                statistics.unmatched_acks += 1
+                return None
+            statistics.acked += 1
+            if pending.attempts > 1:
+                return None
+            rtt = now - pending.first_sent
+            statistics.add_rtt(rtt)
+            return rtt
+
+    def poll(self, now=None):
+        """Finds the commands whose ack is late. Commands with retransmissions left are returned to be sent again,
+        the others are counted as lost and forgotten.
+
+        :return: The packets to send again.
+        :rtype: list
+        """
+        if now is None:
+            now = time.monotonic()
+        resend = []
+        with self.__lock:
+            if not self.__pending:
+                return resend
+            for key, pending in list(self.__pending.items()):
+                deadline = pending.last_sent + self.timeout * self.backoff ** (pending.attempts - 1)
+                if now < deadline:
+                    continue
+                statistics = self.__get_statistics(pending.cmd)
+                if pending.attempts > pending.retries:
+                    del self.__pending[key]
+                    statistics.lost += 1
+                else:
+                    pending.attempts += 1
+                    pending.last_sent = now
+                    statistics.retransmitted += 1
+                    resend.append(pending.buffer)
+        return resend
+
+    def pending_count(self):
+        """Returns the number of commands waiting for an ack."""
+        with self.__lock:
+            return len(self.__pending)
+
+    def clear(self):
+        """Forgets the pending commands (the statistics are kept)."""
+        with self.__lock:
+            self.__pending.clear()
+
+    def get_statistics(self):
+        """Returns a dictionnary with an entry per command id. Each entry is a dictionnary containing:
+
+            * ``sent`` : number of commands sent (without the retransmissions)
+            * ``acked`` : number of commands acknowledged by the drone
+            * ``retransmitted`` : number of retransmissions
+            * ``lost`` : number of commands never acknowledged
+            * ``unmatched_acks`` : number of acks received while no command with this id was pending
+            * ``rtt_mean``, ``rtt_min``, ``rtt_max`` : round trip time in seconds (``None`` until measured)
+            * ``rtt_histogram`` : number of round trip times in each bin, the bin upper bounds being
+              :data:`RTT_HISTOGRAM_EDGES` (the last bin collects the larger values)
+
+        :rtype: dict
+        """
+        with self.__lock:
+            return {cmd: statistics.as_dict() for cmd, statistics in self.__statistics.items()}
+
+
+if __name__ == '__main__':
+    tracker = CommandTracker(retries=2, timeout=0.01)
+    for i in range(5):
+        seq_num = tracker.next_seq_num()
+        tracker.register(0x54, seq_num, b'takeoff')
+        time.sleep(0.003)
+        tracker.acknowledge(0x54, seq_num)
+    tracker.register(0x55, tracker.next_seq_num(), b'land')
+    for i in range(5):
+        time.sleep(0.02)
+        print('resend', tracker.poll())
+    print(tracker.get_statistics())
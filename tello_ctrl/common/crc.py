@@ -1,3 +1,6 @@
+import sys
+
+
 crc8table = bytearray([
     0x00, 0x5e, 0xbc, 0xe2, 0x61, 0x3f, 0xdd, 0x83,
     0xc2, 0x9c, 0x7e, 0x20, 0xa3, 0xfd, 0x1f, 0x41,
@@ -33,8 +36,8 @@ crc8table = bytearray([
     0xb6, 0xe8, 0x0a, 0x54, 0xd7, 0x89, 0x6b, 0x35])
 
 
-def crc8(buf):
-    crc = 0x77
+def crc8(buf, crc=0x77):
+    # crc can be given to continue a previous computation
     for v in buf:
         crc = crc8table[(crc ^ v) & 0xff]
     return crc
@@ -74,8 +77,123 @@ crc16table = [
     0x7bc7, 0x6a4e, 0x58d5, 0x495c, 0x3de3, 0x2c6a, 0x1ef1, 0x0f78]
 
 
-def crc16(buf):
-    crc = 0x3692
+def crc16_bytewise(buf, crc=0x3692):
+    # reference implementation (one table lookup per byte)
+    # crc can be given to continue a previous computation
     for v in buf:
         crc = crc16table[(crc ^ int(v)) & 0xff] ^ (crc >> 8)
     return crc
+
+
+def _make_crc16_word_table():
+    # crc16word_table[x] is the crc after processing two bytes when
+    # x = crc ^ (byte0 | byte1 << 8), so a 16 bits word needs a single lookup
+    table = [0] * 65536
+    for x in range(65536):
+        c = crc16table[x & 0xff]
+        table[x] = crc16table[(c ^ (x >> 8)) & 0xff] ^ (c >> 8)
+    return table
+
+crc16word_table = _make_crc16_word_table()
+
+
+def crc16(buf, crc=0x3692):
+    # Table driven crc processing 16 bits per step. The buffer is read through
+    # a memoryview so bytes, bytearray or memoryview slices are not copied.
+    # crc can be given to continue a previous computation
+    view = memoryview(buf)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    n = len(view)
+    even = n & ~1
+    if sys.byteorder == 'little':
+        table = crc16word_table
+        for w in view[:even].cast('H'):
+            crc = table[crc ^ w]
+    else:
+        even = 0
+    for v in view[even:n]:
+        crc = crc16table[(crc ^ v) & 0xff] ^ (crc >> 8)
+    return crc
+
+
+def verify(packet):
+    """Checks a packet received from the drone: start of packet, size, crc8 of the
+    header and crc16 of the whole packet.
+
+    :param packet: packet as received on the control socket
+    :type packet: bytes, bytearray or memoryview
+    :return: True if the packet is valid
+    :rtype: bool
+    """
+    view = memoryview(packet)
+    n = len(view)
+    if n < 11 or view[0] != 0xcc:
+        # too short or not a START_OF_PACKET
+        return False
+    if ((view[1] | (view[2] << 8)) >> 3) != n:
+        return False
+    if crc8(view[0:3]) != view[3]:
+        return False
+    return crc16(view[0:n-2]) == (view[n-2] | (view[n-1] << 8))
+
+
+class PacketValidator(object):
+    """Verifies inbound packets with :func:`verify` and counts the rejected ones."""
+    def __init__(self):
+        self.checked = 0
+        self.rejected = 0
+
+    def verify(self, packet):
+        self.checked += 1
+        if verify(packet):
+            return True
+        self.rejected += 1
+        return False
+
+
+if __name__ == '__main__':
+    # Benchmark of the crc16 implementations and of the packet verification
+    # (run from the tello_ctrl folder with: python -m common.crc [capture file])
+    import timeit
+    import random
+    import struct
+
+    def make_packet(cmd, payload_size):
+        # packet with the same layout as the ones sent by the drone
+        size = 9 + payload_size + 2
+        buf = bytearray(size)
+        buf[0] = 0xcc
+        struct.pack_into('<H', buf, 1, size << 3)
+        buf[3] = crc8(buf[0:3])
+        buf[4] = 0x50
+        struct.pack_into('<H', buf, 5, cmd)
+        buf[9:size-2] = bytes(random.getrandbits(8) for i in range(payload_size))
+        struct.pack_into('<H', buf, size - 2, crc16_bytewise(buf[:size-2]))
+        return bytes(buf)
+
+    # typical traffic: FLIGHT_MSG, WIFI_MSG and LOG_DATA_MSG packets
+    packets = [make_packet(0x0056, 24), make_packet(0x001a, 2), make_packet(0x1051, 290)] * 100
+    if len(sys.argv) > 1:
+        # or the control packets of a capture file (see common.capture)
+        from .capture import CaptureReader, CHANNEL_CONTROL
+        reader = CaptureReader(sys.argv[1])
+        packets = [bytes(data) for (timestamp, channel, data) in reader.packets(CHANNEL_CONTROL) if data[0] == 0xcc]
+        reader.close()
+        print('%d control packets from %s' % (len(packets), sys.argv[1]))
+    corrupted = bytearray(packets[2])
+    corrupted[100] ^= 0x01
+
+    for pkt in packets:
+        assert crc16(pkt) == crc16_bytewise(pkt)
+        assert crc16(memoryview(pkt)[3:]) == crc16_bytewise(pkt[3:])
+        assert verify(pkt) or len(sys.argv) > 1
+    assert not verify(corrupted)
+
+    n = 20
+    nbytes = sum(len(p) for p in packets) * n
+    for name, f in [('crc16_bytewise', lambda: [crc16_bytewise(p) for p in packets]),
+                    ('crc16', lambda: [crc16(p) for p in packets]),
+                    ('verify', lambda: [verify(p) for p in packets])]:
+        t = timeit.timeit(f, number=n)
+        print('%-15s: %8.0f packets/s  %6.1f MB/s' % (name, n * len(packets) / t, nbytes / t / 1e6))
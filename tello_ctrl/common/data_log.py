@@ -0,0 +1,483 @@
+"""Binary data logs.
+
+Columnar file layout (little endian):
+
+    * header : magic ``b'TELLODAT'``, version (uint16), number of columns (uint32), then for each column the length
+      of its name (uint16) and the name (utf-8)
+    * blocks : block header (magic ``b'COLS'``, number of rows (uint32)) followed by the columns of the block, each
+      column being a contiguous array of float64 values
+
+Delta file layout: a compressed stream (gzip or xz) of
+
+    * header : magic ``b'TELLODLT'``, version (uint16), number of columns (uint32) and the names as above
+    * blocks : block header (magic ``b'DLTA'``, number of rows (uint32), number of values (uint32)), the change
+      masks of the rows (one bit per column, ``numpy.packbits`` order) and the values of the changed columns
+      (float64, row by row). The first row of a file has all its columns set.
+
+The rows are sent to a background thread that groups them into blocks, so the caller only packs the row.
+"""
+import lzma
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+FILE_MAGIC = b'TELLODAT'
+FILE_VERSION = 1
+FILE_HEADER_STRUCT = struct.Struct('<8sHI')
+NAME_LENGTH_STRUCT = struct.Struct('<H')
+BLOCK_MAGIC = b'COLS'
+BLOCK_HEADER_STRUCT = struct.Struct('<4sI')
+DELTA_FILE_MAGIC = b'TELLODLT'
+DELTA_BLOCK_MAGIC = b'DLTA'
+DELTA_BLOCK_HEADER_STRUCT = struct.Struct('<4sII')
+
+
+def encode_header(magic, names):
+    """Returns the header of a data log with the columns ``names``."""
+    header = [FILE_HEADER_STRUCT.pack(magic, FILE_VERSION, len(names))]
+    for name in names:
+        encoded = name.encode('utf-8')
+        header.append(NAME_LENGTH_STRUCT.pack(len(encoded)) + encoded)
+    return b''.join(header)
+
+
+def read_header(f, magic=FILE_MAGIC):
+    """Reads the header of a data log file.
+
+    :return: The column names.
+    :rtype: [str]
+    :raise ValueError: An exception is raised if the file is not a data log file.
+    """
+    header = f.read(FILE_HEADER_STRUCT.size)
+    if len(header) < FILE_HEADER_STRUCT.size:
+        raise ValueError('%s is not a data log file' % f.name)
+    (file_magic, version, count) = FILE_HEADER_STRUCT.unpack(header)
+    if file_magic != magic or version != FILE_VERSION:
+        raise ValueError('%s is not a data log file' % f.name)
+    names = []
+    for i in range(count):
+        (length,) = NAME_LENGTH_STRUCT.unpack(f.read(NAME_LENGTH_STRUCT.size))
+        names.append(f.read(length).decode('utf-8'))
+    return names
+
+
+class _BackgroundWriter(object):
+    """Queue of packed rows written by blocks from a background thread. The subclasses implement
+    ``_write_block(rows)`` and ``_close()``.
+
+    When a block cannot be written (disk full...), the writer thread stops and the error is raised by the next
+    :meth:`write` and by :meth:`close`: the rows are no longer queued.
+    """
+    def __init__(self, names, block_rows, flush_period):
+        self.names = list(names)
+        self.row_struct = struct.Struct('<%dd' % len(self.names))
+        self.block_rows = block_rows
+        self.flush_period = flush_period
+        self.count = 0
+        # exception raised by the writer thread
+        self.error = None
+        self.__queue = queue.SimpleQueue()
+        self.__thread = threading.Thread(target=self.__writer_thread, name='data log writer', daemon=True)
+        self.__thread.start()
+
+    def write(self, values):
+        """Queues a row (one value per column).
+
+        :raise OSError: The error of the writer thread is raised if a block could not be written.
+        """
+        if self.error is not None:
+            raise self.error
+        self.__queue.put(self.row_struct.pack(*values))
+        self.count += 1
+
+    def close(self):
+        """Writes the queued rows and closes the file.
+
+        :raise OSError: The error of the writer thread is raised if a block could not be written.
+        """
+        if self.__thread is None:
+            return
+        self.__queue.put(None)
+        self.__thread.join()
+        self.__thread = None
+        try:
+            self._close()
+        finally:
+            if self.error is not None:
+                raise self.error
+
+    def __writer_thread(self):
+        rows = []
+        running = True
+        deadline = None
+        while running:
+            timeout = self.flush_period if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                row = self.__queue.get(timeout=timeout)
+            except queue.Empty:
+                row = False
+            if row is None:
+                running = False
+            elif row:
+                if not rows:
+                    deadline = time.monotonic() + self.flush_period
+                rows.append(row)
+                if len(rows) < self.block_rows and time.monotonic() < deadline:
+                    continue
+            if rows:
+                try:
+                    self._write_block(rows)
+                except Exception as ex:
+                    # reported by write() and close()
+                    self.error = ex
+                    return
+                rows = []
+                deadline = None
+
+
+class DataLogWriter(_BackgroundWriter):
+    """Writes rows of float64 values to a binary columnar data log from a background thread.
+
+    :param file_name: name of the file
+    :type file_name: str
+    :param names: names of the columns
+    :type names: [str]
+    :param mode: ``"w"`` to overwrite the file, ``"a"`` to append the rows to an existing file with the same columns, defaults to ``"w"``
+    :type mode: str
+    :param block_rows: maximum number of rows per block, defaults to 1024
+    :type block_rows: int
+    :param flush_period: the pending rows are written at least with this period in seconds, defaults to 1
+    :type flush_period: float
+    :raise ValueError: An exception is raised if the file to append to has different columns.
+    """
+    def __init__(self, file_name, names, mode='w', block_rows=1024, flush_period=1.0):
+        self.file_name = file_name
+        names = list(names)
+        if mode == 'a' and os.path.exists(file_name) and os.path.getsize(file_name) > 0:
+            with open(file_name, 'rb') as f:
+                if read_header(f) != names:
+                    raise ValueError('%s contains different columns' % file_name)
+            self.__file = open(file_name, 'ab')
+        else:
+            self.__file = open(file_name, 'wb')
+            self.__file.write(encode_header(FILE_MAGIC, names))
+        _BackgroundWriter.__init__(self, names, block_rows, flush_period)
+
+    def _close(self):
+        self.__file.close()
+
+    def _write_block(self, rows):
+        n = len(rows)
+        values = np.frombuffer(b''.join(rows), dtype='<f8').reshape(n, len(self.names))
+        self.__file.write(BLOCK_HEADER_STRUCT.pack(BLOCK_MAGIC, n))
+        # column major: each column of the block is contiguous in the file
+        self.__file.write(np.ascontiguousarray(values.T).tobytes())
+        self.__file.flush()
+
+
+class DeltaLogWriter(_BackgroundWriter):
+    """Writes rows of float64 values to compressed delta logs from a background thread: each row only stores the
+    columns that changed since the previous row, and the stream is compressed with ``zlib`` (gzip format) or ``lzma``
+    (xz format). The files are rotated by size or by duration: ``file_name`` gets a ``_000``, ``_001``... suffix, and
+    each file can be read on its own.
+
+    With ``codec="gzip"``, the compressed stream is flushed after each block, so a file is readable up to the last
+    block even if it was not closed. With ``codec="lzma"`` (better compression ratio), the compressor keeps its
+    output until the file is rotated or closed, so ``max_file_size`` applies to the uncompressed data (the files are
+    then several times smaller than ``max_file_size``).
+
+    :param file_name: name of the files (before the suffix)
+    :type file_name: str
+    :param names: names of the columns
+    :type names: [str]
+    :param codec: ``"gzip"`` or ``"lzma"``, defaults to ``"gzip"``
+    :type codec: str
+    :param max_file_size: size of the file in bytes (of the uncompressed data with ``codec="lzma"``) above which a new
+        file is started, defaults to None
+    :type max_file_size: int, optional
+    :param max_file_duration: duration in seconds above which a new file is started, defaults to None
+    :type max_file_duration: float, optional
+    :param block_rows: maximum number of rows per block, defaults to 1024
+    :type block_rows: int
+    :param flush_period: the pending rows are written at least with this period in seconds, defaults to 1
+    :type flush_period: float
+    :raise ValueError: An exception is raised if the codec is unknown.
+    """
+    def __init__(self, file_name, names, codec='gzip', max_file_size=None, max_file_duration=None,
+                 block_rows=1024, flush_period=1.0):
+        if codec != 'gzip' and codec != 'lzma':
+            raise ValueError('codec must be "gzip" or "lzma", not %s' % codec)
+        self.codec = codec
+        self.max_file_size = max_file_size
+        self.max_file_duration = max_file_duration
+        (self.__base, self.__ext) = os.path.splitext(file_name)
+        self.file_names = []
+        self.__file = None
+        self.__open(list(names))
+        _BackgroundWriter.__init__(self, names, block_rows, flush_period)
+
+    def __open(self, names):
+        file_name = '%s_%03d%s' % (self.__base, len(self.file_names), self.__ext)
+        self.file_names.append(file_name)
+        self.__file = open(file_name, 'wb')
+        if self.codec == 'gzip':
+            self.__compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        else:
+            self.__compressor = lzma.LZMACompressor()
+        self.__size = 0
+        self.__opened = time.monotonic()
+        # previous row (NaN: the first row of the file has all its columns set)
+        self.__previous = None
+        self.__write(encode_header(DELTA_FILE_MAGIC, names))
+
+    def __write(self, data, flush=False):
+        compressed = self.__compressor.compress(data)
+        if flush and self.codec == 'gzip':
+            compressed += self.__compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.__file.write(compressed)
+        # the lzma output is only known when the compressor is flushed
+        self.__size += len(data) if self.codec == 'lzma' else len(compressed)
+
+    def _close(self):
+        self.__file.write(self.__compressor.flush())
+        self.__file.close()
+
+    def _write_block(self, rows):
+        n = len(rows)
+        values = np.frombuffer(b''.join(rows), dtype='<f8').reshape(n, len(self.names))
+        if self.__previous is None:
+            previous = np.full((1, len(self.names)), np.nan)
+        else:
+            previous = self.__previous
+        # rows shifted by one (the previous row of the first one being the last row of the previous block)
+        before = np.concatenate((previous, values[:-1]))
+        changed = (values != before) & ~(np.isnan(values) & np.isnan(before))
+        if self.__previous is None:
+            changed[0] = True
+        masks = np.packbits(changed, axis=1)
+        # the selected values are in row major order
+        changed_values = values[changed]
+        self.__write(DELTA_BLOCK_HEADER_STRUCT.pack(DELTA_BLOCK_MAGIC, n, len(changed_values))
+                     + masks.tobytes() + changed_values.tobytes(), flush=True)
+        self.__file.flush()
+        self.__previous = values[-1:].copy()
+
+        if ((self.max_file_size is not None and self.__size >= self.max_file_size) or
+                (self.max_file_duration is not None and time.monotonic() - self.__opened >= self.max_file_duration)):
+            self._close()
+            self.__open(self.names)
+
+
+def read_data_log(file_name):
+    """Loads a binary data log written by :class:`DataLogWriter`.
+
+    :param file_name: name of the file
+    :type file_name: str
+    :return: A dictionnary giving the values of each column as a numpy array. When several columns have the same name
+        (e.g. the yaw sensor and the yaw control), the next ones are named ``name.1``, ``name.2``...
+    :rtype: dict
+    :raise ValueError: An exception is raised if the file is not a data log file.
+    """
+    with open(file_name, 'rb') as f:
+        names = read_header(f)
+        data = f.read()
+    ncols = len(names)
+    blocks = []
+    pos = 0
+    while pos + BLOCK_HEADER_STRUCT.size <= len(data):
+        (magic, n) = BLOCK_HEADER_STRUCT.unpack_from(data, pos)
+        pos += BLOCK_HEADER_STRUCT.size
+        if magic != BLOCK_MAGIC or pos + n * ncols * 8 > len(data):
+            # truncated file
+            break
+        blocks.append(np.frombuffer(data, dtype='<f8', count=n * ncols, offset=pos).reshape(ncols, n))
+        pos += n * ncols * 8
+    if blocks:
+        columns = np.concatenate(blocks, axis=1)
+    else:
+        columns = np.zeros((ncols, 0))
+    return _columns_dict(names, columns)
+
+
+def _columns_dict(names, columns):
+    data = {}
+    for i, name in enumerate(names):
+        key = name
+        count = 0
+        while key in data:
+            count += 1
+            key = '%s.%d' % (name, count)
+        data[key] = columns[i]
+    return data
+
+
+def _decompress(file_name):
+    # the stream can be truncated (file not closed)
+    with open(file_name, 'rb') as f:
+        compressed = f.read()
+    if compressed[:2] == b'\x1f\x8b':
+        return zlib.decompressobj(31).decompress(compressed)
+    decompressor = lzma.LZMADecompressor()
+    try:
+        return decompressor.decompress(compressed)
+    except lzma.LZMAError:
+        raise ValueError('%s is not a delta log file' % file_name)
+
+
+def read_delta_log(file_names):
+    """Loads delta logs written by :class:`DeltaLogWriter` and rebuilds the dense columns.
+
+    :param file_names: name of the file or list of the files (e.g. :attr:`DeltaLogWriter.file_names`), concatenated in this order
+    :type file_names: str or [str]
+    :return: A dictionnary giving the values of each column as a numpy array (see :func:`read_data_log`).
+    :rtype: dict
+    :raise ValueError: An exception is raised if a file is not a delta log file or if the files have different columns.
+    """
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    names = None
+    parts = []
+    for file_name in file_names:
+        data = _decompress(file_name)
+        pos = FILE_HEADER_STRUCT.size
+        if len(data) < pos:
+            raise ValueError('%s is not a delta log file' % file_name)
+        (magic, version, ncols) = FILE_HEADER_STRUCT.unpack_from(data)
+        if magic != DELTA_FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError('%s is not a delta log file' % file_name)
+        file_columns = []
+        for i in range(ncols):
+            (length,) = NAME_LENGTH_STRUCT.unpack_from(data, pos)
+            pos += NAME_LENGTH_STRUCT.size
+            file_columns.append(bytes(data[pos:pos + length]).decode('utf-8'))
+            pos += length
+        if names is None:
+            names = file_columns
+        elif names != file_columns:
+            raise ValueError('%s contains different columns' % file_name)
+
+        mask_size = (ncols + 7) // 8
+        previous = np.full(ncols, np.nan)
+        while pos + DELTA_BLOCK_HEADER_STRUCT.size <= len(data):
+            (magic, n, count) = DELTA_BLOCK_HEADER_STRUCT.unpack_from(data, pos)
+            pos += DELTA_BLOCK_HEADER_STRUCT.size
+            end = pos + n * mask_size + count * 8
+            if magic != DELTA_BLOCK_MAGIC or end > len(data):
+                # truncated file
+                break
+            masks = np.frombuffer(data, dtype=np.uint8, count=n * mask_size, offset=pos).reshape(n, mask_size)
+            changed = np.unpackbits(masks, axis=1, count=ncols).astype(bool)
+            values = np.empty((n + 1, ncols))
+            values[0] = previous
+            values[1:][changed] = np.frombuffer(data, dtype='<f8', count=count, offset=pos + n * mask_size)
+            # forward fill: each value is taken from the last row where the column changed
+            rows = np.where(changed, np.arange(1, n + 1)[:, None], 0)
+            np.maximum.accumulate(rows, axis=0, out=rows)
+            block = values[rows, np.arange(ncols)]
+            parts.append(block)
+            previous = block[-1]
+            pos = end
+
+    if names is None:
+        raise ValueError('no delta log file')
+    columns = np.concatenate(parts).T if parts else np.zeros((len(names), 0))
+    return _columns_dict(names, columns)
+
+
+def read_csv_log(file_name):
+    """Loads a csv data log written by :meth:`~tello_ctrl.tello_ctrl.start_data_logging` (the ``date`` column is
+    skipped, the header lines repeated by the append mode are ignored).
+
+    :param file_name: name of the file
+    :type file_name: str
+    :return: A dictionnary giving the values of each column as a numpy array (see :func:`read_data_log`).
+    :rtype: dict
+    :raise ValueError: An exception is raised if the file is not a csv data log file.
+    """
+    names = None
+    rows = []
+    with open(file_name, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').rstrip(';').split(';')
+            if fields[0] == 'date':
+                if names is None:
+                    names = fields[1:]
+                elif fields[1:] != names:
+                    raise ValueError('%s contains different columns' % file_name)
+            elif names is not None and len(fields) == len(names) + 1:
+                rows.append(fields[1:])
+    if names is None:
+        raise ValueError('%s is not a csv data log file' % file_name)
+    columns = np.array(rows, dtype=np.float64).reshape(len(rows), len(names)).T
+    return _columns_dict(names, columns)
+
+
+def read_log(file_name):
+    """Loads a data log whatever its format (:func:`read_data_log`, :func:`read_delta_log` or :func:`read_csv_log`,
+    chosen from the extension: ``.tlog``, ``.tlz`` or another one).
+
+    :param file_name: name of the file (or list of the files of a rotated delta log)
+    :type file_name: str or [str]
+    :return: A dictionnary giving the values of each column as a numpy array.
+    :rtype: dict
+    """
+    first = file_name if isinstance(file_name, str) else file_name[0]
+    ext = os.path.splitext(first)[1].lower()
+    if ext == '.tlz' or not isinstance(file_name, str):
+        return read_delta_log(file_name)
+    if ext == '.tlog':
+        return read_data_log(file_name)
+    return read_csv_log(file_name)
+
+
+if __name__ == '__main__':
+    # Cost of a row for the caller, csv formatting vs binary row
+    # (run from the tello_ctrl folder with: python -m common.data_log)
+    import tempfile
+    import timeit
+
+    names = ['time'] + ['value%d' % i for i in range(120)]
+    values = [float(i) for i in range(len(names))]
+    fd, file_name = tempfile.mkstemp(suffix='.tlog')
+    os.close(fd)
+    writer = DataLogWriter(file_name, names)
+    n = 20000
+    t_csv = timeit.timeit(lambda: ''.join(['%.10e;' % v for v in values]), number=n)
+    t_binary = timeit.timeit(lambda: writer.write(values), number=n)
+    writer.close()
+    data = read_data_log(file_name)
+    assert len(data['time']) == n and data['value5'][-1] == 6.0
+    print('%d columns: csv row %.1f us, binary row %.1f us' % (len(names), t_csv / n * 1e6, t_binary / n * 1e6))
+    os.remove(file_name)
+
+    # Size of a log where only a few columns change (time, position...), csv vs binary vs delta
+    import random
+    rows = []
+    for i in range(n):
+        values[0] = i * 0.01
+        for j in range(1, 9):
+            values[j] = random.random()
+        if i % 500 == 0:
+            values[20] += 1
+        rows.append(list(values))
+    csv_size = sum(len(''.join(['%.10e;' % v for v in row])) + 1 for row in rows)
+    for codec in ('gzip', 'lzma'):
+        writer = DeltaLogWriter(file_name, names, codec=codec, max_file_size=256 * 1024)
+        for row in rows:
+            writer.write(row)
+        writer.close()
+        t_read = time.perf_counter()
+        data = read_delta_log(writer.file_names)
+        t_read = time.perf_counter() - t_read
+        assert np.array_equal(data['value19'], [row[20] for row in rows])
+        delta_size = sum(os.path.getsize(name) for name in writer.file_names)
+        print('%d rows: csv %d kB, binary %d kB, delta %s %d kB in %d files (read in %.3f s)'
+              % (n, csv_size // 1024, n * len(names) * 8 // 1024, codec, delta_size // 1024,
+                 len(writer.file_names), t_read))
+        for name in writer.file_names:
+            os.remove(name)
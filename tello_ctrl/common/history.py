@@ -0,0 +1,327 @@
+import threading
+import time
+from operator import attrgetter
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """Preallocated ring buffer of rows of float64 values with a timestamp and an arrival time per row.
+
+    :param names: names of the columns
+    :type names: [str]
+    :param capacity: number of rows kept
+    :type capacity: int
+    """
+    def __init__(self, names, capacity):
+        if capacity <= 0:
+            raise ValueError('capacity must be strictly positive')
+        self.names = tuple(names)
+        self.capacity = int(capacity)
+        self.timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self.arrivals = np.zeros(self.capacity, dtype=np.float64)
+        self.values = np.zeros((self.capacity, len(self.names)), dtype=np.float64)
+        # total number of rows appended (the next row is written at count % capacity)
+        self.count = 0
+
+    def append(self, timestamp, row, arrival=None):
+        idx = self.count % self.capacity
+        self.timestamps[idx] = timestamp
+        self.arrivals[idx] = timestamp if arrival is None else arrival
+        self.values[idx] = row
+        self.count += 1
+
+    def window(self, start_time=None):
+        """Returns the slices (oldest first) of the rows whose timestamp is greater or equal to ``start_time``.
+
+        :return: A list of up to two ``slice`` objects.
+        :rtype: list
+        """
+        if self.count <= self.capacity:
+            segments = [slice(0, self.count)]
+        else:
+            idx = self.count % self.capacity
+            segments = [slice(idx, self.capacity), slice(0, idx)]
+        if start_time is None:
+            return segments
+        # the timestamps are increasing in each segment
+        for i, segment in enumerate(segments):
+            if segment.stop > segment.start and self.timestamps[segment.stop - 1] >= start_time:
+                first = segment.start + np.searchsorted(self.timestamps[segment], start_time)
+                return [slice(first, segment.stop)] + segments[i + 1:]
+        return []
+
+    def last(self, count):
+        """Returns the slices (oldest first) of the last ``count`` rows.
+
+        :return: A list of up to two ``slice`` objects.
+        :rtype: list
+        """
+        segments = self.window()
+        skip = sum(s.stop - s.start for s in segments) - count
+        while skip > 0 and segments:
+            length = segments[0].stop - segments[0].start
+            if length <= skip:
+                segments.pop(0)
+            else:
+                segments[0] = slice(segments[0].start + skip, segments[0].stop)
+            skip -= length
+        return segments
+
+    def hold(self, columns, times):
+        """Values of the requested column indices at each of the increasing ``times`` (last row received at
+        or before each time, ``nan`` before the oldest row).
+
+        :return: The values, one contiguous row per requested column.
+        :rtype: numpy.ndarray
+        """
+        n = min(self.count, self.capacity)
+        first = 0 if self.count <= self.capacity else self.count % self.capacity
+        # timestamps in the order of reception (the values are not copied)
+        timestamps = np.concatenate([self.timestamps[s] for s in self.window()]) if n > 0 else self.timestamps[:0]
+        rows = np.searchsorted(timestamps, times, side='right') - 1
+        x = self.values[(first + np.maximum(rows, 0)) % self.capacity][:, columns].T.copy()
+        x[:, rows < 0] = np.nan
+        return x
+
+    def interpolate(self, columns, timestamp):
+        """Linear interpolation of the requested column indices at ``timestamp``. Before the oldest row and after
+        the newest row, the values of this row are returned (no extrapolation).
+
+        :return: The interpolated values, or ``None`` if the buffer is empty.
+        :rtype: numpy.ndarray
+        """
+        n = min(self.count, self.capacity)
+        if n == 0:
+            return None
+        # the requested time is usually close to the newest row: walk back from it
+        after = (self.count - 1) % self.capacity
+        if self.timestamps[after] <= timestamp:
+            return self.values[after, columns]
+        for i in range(n - 1):
+            before = (after - 1) % self.capacity
+            t0 = self.timestamps[before]
+            if t0 <= timestamp:
+                t1 = self.timestamps[after]
+                w = (timestamp - t0) / (t1 - t0)
+                return (1 - w) * self.values[before, columns] + w * self.values[after, columns]
+            after = before
+        return self.values[after, columns]
+
+    def get(self, columns, start_time=None, segments=None):
+        """Copies the rows of the window (see :meth:`window`) for the requested column indices.
+
+        :param segments: slices of the rows to copy, defaults to None (the window starting at ``start_time``)
+        :type segments: list, optional
+        :return: The timestamps and the values, one contiguous row per requested column.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        return self.__get(self.timestamps, columns, start_time, segments)
+
+    def get_arrivals(self, start_time=None, segments=None):
+        """Copies the arrival times of the rows of the window (see :meth:`window`).
+
+        :rtype: numpy.ndarray
+        """
+        return self.__get(self.arrivals, [], start_time, segments)[0]
+
+    def __get(self, timestamps, columns, start_time, segments):
+        if segments is None:
+            segments = self.window(start_time)
+        n = sum(s.stop - s.start for s in segments)
+        t = np.empty(n, dtype=np.float64)
+        x = np.empty((len(columns), n), dtype=np.float64)
+        pos = 0
+        for s in segments:
+            length = s.stop - s.start
+            t[pos:pos + length] = timestamps[s]
+            x[:, pos:pos + length] = self.values[s, columns].T
+            pos += length
+        return t, x
+
+
+class TelemetryHistory(object):
+    """History of the telemetry, with a :class:`RingBuffer` per group of values decoded from the same message.
+
+    Each time a message is decoded, :meth:`append` reads the values of its group from the
+    :class:`~common.protocol.FlightData` object and stores them with the sensor time and the receive time
+    (``time.monotonic()`` clock). The memory limit is shared equally between the groups (same number of rows per
+    group).
+
+    :param groups: dictionnary giving the list of value names for each group
+    :type groups: dict
+    :param memory_limit: maximum size of the buffers in bytes, defaults to 8MB
+    :type memory_limit: int
+    :raise ValueError: An exception is raised if the memory limit is too small to store one row per group.
+    """
+    def __init__(self, groups, memory_limit=8*1024*1024):
+        row_size = sum((len(names) + 2) * 8 for names in groups.values())
+        capacity = int(memory_limit) // row_size
+        if capacity <= 0:
+            raise ValueError('memory_limit is too small (at least %d bytes)' % row_size)
+        self.memory_limit = memory_limit
+        self.__lock = threading.Lock()
+        self.__buffers = {}
+        self.__getters = {}
+        # group and column of each value name
+        self.__index = {}
+        for group, names in groups.items():
+            self.__buffers[group] = RingBuffer(names, capacity)
+            self.__getters[group] = attrgetter(*names)
+            for column, name in enumerate(names):
+                self.__index[name] = (group, column)
+
+    @property
+    def capacity(self):
+        """Number of rows kept for each group."""
+        return next(iter(self.__buffers.values())).capacity
+
+    def get_names(self):
+        """Returns the names of the values stored in the history.
+
+        :rtype: [str]
+        """
+        return list(self.__index.keys())
+
+    def append(self, group, source, timestamp=None, arrival=None):
+        """Stores the values of ``group`` read from the attributes of ``source``.
+
+        :param group: name of the group
+        :type group: str
+        :param source: object whose attributes hold the values (e.g. a :class:`~common.protocol.FlightData`)
+        :param timestamp: sensor time (``time.monotonic()`` clock), defaults to now
+        :type timestamp: float, optional
+        :param arrival: receive time (``time.monotonic()``), defaults to None (``timestamp``)
+        :type arrival: float, optional
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        row = self.__getters[group](source)
+        with self.__lock:
+            self.__buffers[group].append(timestamp, row, arrival)
+
+    def clear(self):
+        """Empties the history."""
+        with self.__lock:
+            for buffer in self.__buffers.values():
+                buffer.count = 0
+
+    def interpolate(self, names, timestamp):
+        """Returns the values of the requested names linearly interpolated at ``timestamp``
+        (see :meth:`RingBuffer.interpolate`).
+
+        :param names: names of the values
+        :type names: [str]
+        :param timestamp: time of the sample (``time.monotonic()``)
+        :type timestamp: float
+        :return: The values in the order of ``names`` (``nan`` for the groups not received yet).
+        :rtype: list
+        :raise ValueError: An exception is raised if a name is not stored in the history.
+        """
+        columns = {}
+        for i, name in enumerate(names):
+            if name not in self.__index:
+                raise ValueError('%s is not stored in the telemetry history' % name)
+            group, column = self.__index[name]
+            columns.setdefault(group, []).append((i, column))
+
+        values = [float('nan')] * len(names)
+        with self.__lock:
+            for group, group_columns in columns.items():
+                x = self.__buffers[group].interpolate([column for (i, column) in group_columns], timestamp)
+                if x is not None:
+                    for (i, column), value in zip(group_columns, x.tolist()):
+                        values[i] = value
+        return values
+
+    def get_history(self, names, seconds=None, arrival_times=False):
+        """Returns the recent values of the requested names. Only the requested window is copied.
+
+        :param names: names of the values
+        :type names: [str]
+        :param seconds: duration of the window ending now, defaults to None (whole history)
+        :type seconds: float, optional
+        :param arrival_times: if True, the receive times are returned too, defaults to False
+        :type arrival_times: bool, optional
+        :return: A dictionnary giving for each name a tuple ``(t, x)`` of numpy arrays, ``t`` being the sensor
+            times (``time.monotonic()`` clock) and ``x`` the values, or ``(t, x, arrival)`` with the receive times
+            when ``arrival_times`` is True. Names of the same group share the same ``t`` and ``arrival`` arrays.
+        :rtype: dict
+        :raise ValueError: An exception is raised if a name is not stored in the history.
+        """
+        if isinstance(names, str):
+            names = [names]
+        columns = {}
+        for name in names:
+            if name not in self.__index:
+                raise ValueError('%s is not stored in the telemetry history' % name)
+            group, column = self.__index[name]
+            columns.setdefault(group, []).append((name, column))
+
+        start_time = None if seconds is None else time.monotonic() - seconds
+        history = {}
+        with self.__lock:
+            for group, group_columns in columns.items():
+                buffer = self.__buffers[group]
+                segments = buffer.window(start_time)
+                t, x = buffer.get([column for (name, column) in group_columns], segments=segments)
+                if arrival_times:
+                    arrival = buffer.get_arrivals(segments=segments)
+                for i, (name, column) in enumerate(group_columns):
+                    history[name] = (t, x[i], arrival) if arrival_times else (t, x[i])
+        return history
+
+    def get_last(self, names, count):
+        """Returns the last ``count`` samples of the requested names in a single array. The samples are the rows of the
+        group of ``names[0]``; the values of the other groups are their last values received at the time of each sample.
+
+        :param names: names of the values
+        :type names: [str]
+        :param count: maximum number of samples
+        :type count: int
+        :return: An array of shape (number of samples, 1 + number of names), the first column being the sensor
+            time (``time.monotonic()`` clock), the oldest sample first.
+        :rtype: numpy.ndarray
+        :raise ValueError: An exception is raised if a name is not stored in the history.
+        """
+        if isinstance(names, str):
+            names = [names]
+        columns = {}
+        for i, name in enumerate(names):
+            if name not in self.__index:
+                raise ValueError('%s is not stored in the telemetry history' % name)
+            group, column = self.__index[name]
+            columns.setdefault(group, []).append((i, column))
+
+        reference = self.__index[names[0]][0] if names else next(iter(self.__buffers))
+        with self.__lock:
+            buffer = self.__buffers[reference]
+            group_columns = columns.get(reference, [])
+            t, x = buffer.get([column for (i, column) in group_columns], segments=buffer.last(count))
+            samples = np.empty((len(t), 1 + len(names)), dtype=np.float64)
+            samples[:, 0] = t
+            for j, (i, column) in enumerate(group_columns):
+                samples[:, 1 + i] = x[j]
+            for group, group_columns in columns.items():
+                if group != reference:
+                    x = self.__buffers[group].hold([column for (i, column) in group_columns], t)
+                    for j, (i, column) in enumerate(group_columns):
+                        samples[:, 1 + i] = x[j]
+        return samples
+
+
+if __name__ == '__main__':
+    history = TelemetryHistory({'a': ['x', 'y'], 'b': ['z']}, memory_limit=1024)
+
+    class Source(object):
+        pass
+    source = Source()
+    for i in range(100):
+        source.x, source.y, source.z = i, 2 * i, -i
+        history.append('a', source, timestamp=float(i))
+        history.append('b', source, timestamp=float(i))
+    print('capacity', history.capacity)
+    t, x = history.get_history(['x'])['x']
+    print(t, x)
+    print('interpolated at 97.25', history.interpolate(['x', 'z'], 97.25))
+    print('last samples', history.get_last(['x', 'z'], 3))
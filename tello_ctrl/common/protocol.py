@@ -1,5 +1,7 @@
 import datetime
+from collections import namedtuple
 from io import BytesIO
+from operator import attrgetter
 import struct
 from . import crc
 from . utils import *
@@ -80,7 +82,7 @@ class Packet(object):
             self.buf = bytearray()
             for c in cmd:
                 self.buf.append(ord(c))
-        elif isinstance(cmd, (bytearray, bytes)):
+        elif isinstance(cmd, (bytearray, bytes, memoryview)):
             self.buf = bytearray()
             self.buf[:] = cmd
         else:
@@ -132,6 +134,152 @@ class Packet(object):
         now = datetime.datetime.now()
         return datetime.datetime(now.year, now.month, now.day, hour, min, sec, millisec)
 
+
+SEQ_NUM_STRUCT = struct.Struct('<H')
+CRC16_STRUCT = struct.Struct('<H')
+
+
+class PacketTemplate(object):
+    """Preallocated command packet whose fields are patched in place.
+
+    The header of a command (size, crc8, packet type and command id) never changes, so it is
+    written once and the crc16 state after the header is cached. Building a packet only packs
+    the payload and the sequence number with ``struct.pack_into`` and runs the crc16 over these
+    bytes. The returned object exposes ``get_buffer`` so it can be sent like a :class:`Packet`.
+
+    :param cmd: command id
+    :type cmd: int
+    :param pkt_type: packet type, defaults to 0x68
+    :type pkt_type: int
+    :param payload_fmt: ``struct`` format of the payload (little endian), defaults to no payload
+    :type payload_fmt: str
+    """
+    def __init__(self, cmd, pkt_type=0x68, payload_fmt=''):
+        self.cmd = cmd
+        self.payload = struct.Struct('<' + payload_fmt)
+        size = 9 + self.payload.size + 2
+        self.buf = bytearray(size)
+        self.buf[0] = START_OF_PACKET
+        struct.pack_into('<H', self.buf, 1, size << 3)
+        self.buf[3] = crc.crc8(self.buf[0:3])
+        self.buf[4] = pkt_type
+        struct.pack_into('<H', self.buf, 5, cmd)
+        self.crc_offset = size - 2
+        # crc16 state after the constant part of the header
+        self.crc16_header = crc.crc16(self.buf[0:7])
+        self.body = memoryview(self.buf)[7:self.crc_offset]
+
+    def build(self, *values, seq_num=0):
+        buf = self.buf
+        if values:
+            self.payload.pack_into(buf, 9, *values)
+        SEQ_NUM_STRUCT.pack_into(buf, 7, seq_num)
+        CRC16_STRUCT.pack_into(buf, self.crc_offset, crc.crc16(self.body, self.crc16_header))
+        return self
+
+    def get_buffer(self):
+        return self.buf
+
+    def get_data(self):
+        return self.buf[9:self.crc_offset]
+
+
+class CommandEncoder(object):
+    """Holds one :class:`PacketTemplate` per command sent on the control path.
+
+    Each ``build_*`` method patches the corresponding template and returns it, so no packet
+    is allocated when sending. A template is reused by the next call, it must be sent before
+    building the same command again: the encoder is not thread safe, the callers sending the same
+    command from several threads must hold a lock from the build to the send.
+    """
+    def __init__(self):
+        self.templates = {
+            # 6 bytes of packed axis (4+2) followed by the time (5 int16)
+            STICK_CMD:              PacketTemplate(STICK_CMD, 0x60, 'IH5H'),
+            TAKEOFF_CMD:            PacketTemplate(TAKEOFF_CMD),
+            LAND_CMD:               PacketTemplate(LAND_CMD, 0x68, 'B'),
+            FLIP_CMD:               PacketTemplate(FLIP_CMD, 0x70, 'B'),
+            VIDEO_START_CMD:        PacketTemplate(VIDEO_START_CMD, 0x60),
+            EXPOSURE_CMD:           PacketTemplate(EXPOSURE_CMD, 0x48, 'B'),
+            VIDEO_ENCODER_RATE_CMD: PacketTemplate(VIDEO_ENCODER_RATE_CMD, 0x68, 'B'),
+        }
+        self.__stick = self.templates[STICK_CMD]
+
+    def build_stick(self, left_right, forward_backward, up_down, yaw, fast_mode, now=None, seq_num=0):
+        '''
+        11 bits (-1024 ~ +1023) x 4 axis = 44 bits
+        fast_mode takes 1 bit
+        44 bits will be packed in to 6 bytes (48 bits)
+
+                    axis4      axis3      axis2      axis1
+             |          |          |          |          |
+                 4         3         2         1         0
+        98765432109876543210987654321098765432109876543210
+         |       |       |       |       |       |       |
+             byte5   byte4   byte3   byte2   byte1   byte0
+        '''
+        axis1 = int(1024 + 660.0 * left_right) & 0x7ff
+        axis2 = int(1024 + 660.0 * forward_backward) & 0x7ff
+        axis3 = int(1024 + 660.0 * up_down) & 0x7ff
+        axis4 = int(1024 + 660.0 * yaw) & 0x7ff
+        axis5 = int(fast_mode) & 0x01
+        packed = axis1 | (axis2 << 11) | (axis3 << 22) | (axis4 << 33) | (axis5 << 44)
+
+        if now is None:
+            now = datetime.datetime.now()
+        millisec = now.microsecond // 1000
+        return self.__stick.build(packed & 0xffffffff, packed >> 32,
+                                  now.hour, now.minute, now.second,
+                                  millisec & 0xff, (millisec >> 8) & 0xff,
+                                  seq_num=seq_num)
+
+    def build_takeoff(self, seq_num=0):
+        return self.templates[TAKEOFF_CMD].build(seq_num=seq_num)
+
+    def build_land(self, seq_num=0):
+        return self.templates[LAND_CMD].build(0x00, seq_num=seq_num)
+
+    def build_flip(self, direction, seq_num=0):
+        return self.templates[FLIP_CMD].build(direction & 0xff, seq_num=seq_num)
+
+    def build_start_video(self, seq_num=0):
+        return self.templates[VIDEO_START_CMD].build(seq_num=seq_num)
+
+    def build_exposure(self, level, seq_num=0):
+        return self.templates[EXPOSURE_CMD].build(level & 0xff, seq_num=seq_num)
+
+    def build_bitrate(self, bitrate, seq_num=0):
+        return self.templates[VIDEO_ENCODER_RATE_CMD].build(bitrate & 0xff, seq_num=seq_num)
+
+
+# Decoders of the small messages sent by the drone. They receive data[9:], that is the payload followed by the
+# 2 bytes crc (the first byte of the payload is a status byte) and return the decoded value.
+ALT_LIMIT_STRUCT = struct.Struct('<H')
+ATT_LIMIT_STRUCT = struct.Struct('<f')
+
+def decode_version(payload):
+    """Firmware version as a string (e.g. '01.04.92.01')."""
+    version = bytes(payload[1:-2])
+    return version.split(b'\x00', 1)[0].decode('ascii', 'replace')
+
+def decode_alt_limit(payload):
+    """Altitude limit in meters."""
+    return ALT_LIMIT_STRUCT.unpack_from(payload, 1)[0]
+
+def decode_att_limit(payload):
+    """Attitude limit in degrees."""
+    return ATT_LIMIT_STRUCT.unpack_from(payload, 1)[0]
+
+def decode_low_bat_threshold(payload):
+    """Low battery threshold in percent."""
+    return payload[1]
+
+MESSAGE_DECODERS = {VERSION_MSG: decode_version,
+                    ALT_LIMIT_MSG: decode_alt_limit,
+                    ATT_LIMIT_MSG: decode_att_limit,
+                    LOW_BAT_THRESHOLD_MSG: decode_low_bat_threshold}
+
+
 """ Info about Fligth data decoding :
 +     // https://github.com/Kragrathea/TelloLib/blob/master/TelloLib/parsedRecSpecs.json
 +     // https://github.com/o-gs/dji-firmware-tools/blob/master/comm_dissector/wireshark/dji-mavic-flyrec-proto.lua
@@ -142,175 +290,209 @@ class Packet(object):
 
 
 
+# Precompiled layouts of the flight data (little endian, no alignment).
+# FLIGHT_MSG payload: height, north/east/ground speed, fly time, state bits, imu calibration, battery percentage,
+# battery left, fly time left, em state bits, fly mode, throw fly timer, camera state, electrical machinery state,
+# front state bits, temperature bits
+FLIGHT_MSG_STRUCT = struct.Struct('<5h3BhH7B')
+# log record header: 0x55, length, checksum, id, tick (the low byte of the tick masks the payload)
+LOG_RECORD_HEADER_STRUCT = struct.Struct('<BhBHI')
+# new mvo feedback (id 29): velocity (mm/s), position, position & velocity covariances, tof, tof uncertainty, valid bits
+MVO_RECORD_STRUCT = struct.Struct('<2x3h3f12f2fB')
+# imu attitude (id 2048): longitude, latitude, baro, acc, gyro, baro smooth, quaternion, NED velocity
+IMU_RECORD_STRUCT = struct.Struct('<ddf3f4f4f12x3f')
+# imu extended (id 2064): visual odometry velocity, position, vel, dist, rtk long/lat/alt, error flag
+IMU_EXT_RECORD_STRUCT = struct.Struct('<3f3f2fddfh')
+
+# Declared schema of the FlightData values: name, type (numpy/struct compatible name), unit and message
+# updating the value ('flight' for FLIGHT_MSG, 'mvo', 'imu' and 'imu_ext' for the log records, 'wifi' for
+# WIFI_MSG, None when the value is not decoded yet). The order is the order of the sensor list of tello_ctrl.
+SensorField = namedtuple('SensorField', ('name', 'dtype', 'unit', 'message'))
+
+FLIGHT_DATA_SCHEMA = (
+    # FLIGHT_MSG
+    SensorField('height', 'int16', 'dm', 'flight'),
+    SensorField('north_speed', 'int16', 'dm/s', 'flight'),
+    SensorField('east_speed', 'int16', 'dm/s', 'flight'),
+    SensorField('ground_speed', 'int16', 'dm/s', 'flight'),
+    SensorField('fly_time', 'int16', '0.1s', 'flight'),
+    SensorField('imu_state', 'uint8', '', 'flight'),
+    SensorField('pressure_state', 'uint8', '', 'flight'),
+    SensorField('down_visual_state', 'uint8', '', 'flight'),
+    SensorField('power_state', 'uint8', '', 'flight'),
+    SensorField('battery_state', 'uint8', '', 'flight'),
+    SensorField('gravity_state', 'uint8', '', 'flight'),
+    SensorField('wind_state', 'uint8', '', 'flight'),
+    SensorField('imu_calibration_state', 'uint8', '', 'flight'),
+    SensorField('battery_percentage', 'uint8', '%', 'flight'),
+    SensorField('drone_battery_left', 'int16', '', 'flight'),
+    SensorField('drone_fly_time_left', 'uint16', '', 'flight'),
+    SensorField('em_sky', 'uint8', '', 'flight'),
+    SensorField('em_ground', 'uint8', '', 'flight'),
+    SensorField('em_open', 'uint8', '', 'flight'),
+    SensorField('drone_hover', 'uint8', '', 'flight'),
+    SensorField('outage_recording', 'uint8', '', 'flight'),
+    SensorField('battery_low', 'uint8', '', 'flight'),
+    SensorField('battery_lower', 'uint8', '', 'flight'),
+    SensorField('factory_mode', 'uint8', '', 'flight'),
+    SensorField('fly_mode', 'uint8', '', 'flight'),
+    SensorField('throw_fly_timer', 'uint8', '', 'flight'),
+    SensorField('camera_state', 'uint8', '', 'flight'),
+    SensorField('electrical_machinery_state', 'uint8', '', 'flight'),
+    SensorField('front_in', 'uint8', '', 'flight'),
+    SensorField('front_out', 'uint8', '', 'flight'),
+    SensorField('front_lsc', 'uint8', '', 'flight'),
+    SensorField('temperature_height', 'uint8', '', 'flight'),
+    # not decoded
+    SensorField('fly_speed', 'int16', '', None),
+    SensorField('light_strength', 'uint8', '', None),
+    SensorField('smart_video_exit_mode', 'int16', '', None),
+    SensorField('wifi_disturb', 'uint8', '', None),
+    SensorField('wifi_strength', 'uint8', '', 'wifi'),
+    # new mvo feedback log record
+    SensorField('velX', 'float64', 'm/s', 'mvo'),
+    SensorField('velY', 'float64', 'm/s', 'mvo'),
+    SensorField('velZ', 'float64', 'm/s', 'mvo'),
+    SensorField('posX', 'float32', 'm', 'mvo'),
+    SensorField('posY', 'float32', 'm', 'mvo'),
+    SensorField('posZ', 'float32', 'm', 'mvo'),
+    SensorField('posUncertainty', 'float64', '', 'mvo'),
+    SensorField('posCov1', 'float32', '', 'mvo'),
+    SensorField('posCov2', 'float32', '', 'mvo'),
+    SensorField('posCov3', 'float32', '', 'mvo'),
+    SensorField('posCov4', 'float32', '', 'mvo'),
+    SensorField('posCov5', 'float32', '', 'mvo'),
+    SensorField('posCov6', 'float32', '', 'mvo'),
+    SensorField('velCov1', 'float32', '', 'mvo'),
+    SensorField('velCov2', 'float32', '', 'mvo'),
+    SensorField('velCov3', 'float32', '', 'mvo'),
+    SensorField('velCov4', 'float32', '', 'mvo'),
+    SensorField('velCov5', 'float32', '', 'mvo'),
+    SensorField('velCov6', 'float32', '', 'mvo'),
+    SensorField('tof', 'float32', 'm', 'mvo'),
+    SensorField('tofUncertainty', 'float32', '', 'mvo'),
+    SensorField('mov_valid_velX', 'bool', '', 'mvo'),
+    SensorField('mov_valid_velY', 'bool', '', 'mvo'),
+    SensorField('mov_valid_velZ', 'bool', '', 'mvo'),
+    SensorField('mov_valid_posX', 'bool', '', 'mvo'),
+    SensorField('mov_valid_posY', 'bool', '', 'mvo'),
+    SensorField('mov_valid_posZ', 'bool', '', 'mvo'),
+    # imu attitude log record (and Euler angles computed from the quaternion)
+    SensorField('longitude', 'float64', 'deg', 'imu'),
+    SensorField('latitude', 'float64', 'deg', 'imu'),
+    SensorField('baro', 'float32', 'm', 'imu'),
+    SensorField('accX', 'float32', 'g', 'imu'),
+    SensorField('accY', 'float32', 'g', 'imu'),
+    SensorField('accZ', 'float32', 'g', 'imu'),
+    SensorField('gyroX', 'float32', 'rad/s', 'imu'),
+    SensorField('gyroY', 'float32', 'rad/s', 'imu'),
+    SensorField('gyroZ', 'float32', 'rad/s', 'imu'),
+    SensorField('baro_smooth', 'float32', 'm', 'imu'),
+    SensorField('qW', 'float32', '', 'imu'),
+    SensorField('qX', 'float32', '', 'imu'),
+    SensorField('qY', 'float32', '', 'imu'),
+    SensorField('qZ', 'float32', '', 'imu'),
+    SensorField('velN', 'float32', 'm/s', 'imu'),
+    SensorField('velE', 'float32', 'm/s', 'imu'),
+    SensorField('velD', 'float32', 'm/s', 'imu'),
+    SensorField('yaw', 'float64', 'rad', 'imu'),
+    SensorField('pitch', 'float64', 'rad', 'imu'),
+    SensorField('roll', 'float64', 'rad', 'imu'),
+    # not decoded
+    SensorField('vgX', 'float64', '', None),
+    SensorField('vgY', 'float64', '', None),
+    SensorField('vgZ', 'float64', '', None),
+    # imu extended log record (imu with visual odometry)
+    SensorField('velX_VO', 'float32', 'm/s', 'imu_ext'),
+    SensorField('velY_VO', 'float32', 'm/s', 'imu_ext'),
+    SensorField('velZ_VO', 'float32', 'm/s', 'imu_ext'),
+    SensorField('posX_VO', 'float32', 'm', 'imu_ext'),
+    SensorField('posY_VO', 'float32', 'm', 'imu_ext'),
+    SensorField('posZ_VO', 'float32', 'm', 'imu_ext'),
+    SensorField('vel_VO', 'float32', 'm/s', 'imu_ext'),
+    SensorField('dist_VO', 'float32', 'm', 'imu_ext'),
+    SensorField('rtkLong_VO', 'float64', 'deg', 'imu_ext'),
+    SensorField('rtkLat_VO', 'float64', 'deg', 'imu_ext'),
+    SensorField('rtkAlt_VO', 'float32', 'm', 'imu_ext'),
+    SensorField('error_flag_VO', 'int16', '', 'imu_ext'))
+
+FLIGHT_DATA_NAMES = tuple(field.name for field in FLIGHT_DATA_SCHEMA)
+
+# FlightData values updated by each flight or log message (groups of the telemetry history)
+FLIGHT_DATA_GROUPS = {}
+for _field in FLIGHT_DATA_SCHEMA:
+    if _field.message in ('flight', 'mvo', 'imu', 'imu_ext'):
+        FLIGHT_DATA_GROUPS.setdefault(_field.message, ())
+        FLIGHT_DATA_GROUPS[_field.message] += (_field.name,)
+del _field
+
+# Packed layout of all the FlightData values (little endian, no alignment), the numpy equivalent being
+# numpy.dtype(FLIGHT_DATA_DTYPE)
+_STRUCT_CODES = {'bool': '?', 'uint8': 'B', 'int16': 'h', 'uint16': 'H', 'float32': 'f', 'float64': 'd'}
+FLIGHT_DATA_STRUCT = struct.Struct('<' + ''.join(_STRUCT_CODES[field.dtype] for field in FLIGHT_DATA_SCHEMA))
+FLIGHT_DATA_DTYPE = [(field.name, '<' + _STRUCT_CODES[field.dtype]) for field in FLIGHT_DATA_SCHEMA]
+_FLIGHT_DATA_VALUES = attrgetter(*FLIGHT_DATA_NAMES)
+
+# XOR_TABLES[k] maps each byte value x to x ^ k (for bytes.translate)
+XOR_TABLES = tuple(bytes(x ^ k for x in range(256)) for k in range(256))
+
+def _bit_table(bits):
+    # for each byte value, tuple of the selected bits (as int)
+    return tuple(tuple((value >> bit) & 0x1 for bit in bits) for value in range(256))
+
+FLIGHT_STATE_TABLE = _bit_table((0, 1, 2, 3, 4, 5, 7))
+FLIGHT_EM_TABLE = _bit_table((0, 1, 2, 3, 4, 5, 6, 7))
+FLIGHT_FRONT_TABLE = _bit_table((0, 1, 2))
+# velocity x/y/z and position x/y/z valid bits of the mvo record (bits 3 and 7 unused)
+MVO_VALID_TABLE = tuple(tuple(bool((value >> bit) & 0x1) for bit in (0, 1, 2, 4, 5, 6)) for value in range(256))
+
+
 class FlightData(object):
+    """Last values decoded from the flight and log messages. The values are declared by
+    :data:`FLIGHT_DATA_SCHEMA` and stored in slots (no instance dictionnary).
+    """
+    ID_NEW_MVO_FEEDBACK                = 29    # 
+    ID_IMU_ATTI                        = 2048  # 0x800 IMU Only
+    ID_IMU_EXT                         = 2064  # 0x810 IMU Extended
+
+    __slots__ = FLIGHT_DATA_NAMES + ('unknowns_log_msg',)
 
     def __init__(self):
-    
-        self.ID_NEW_MVO_FEEDBACK                = 29    # 
-        self.ID_IMU_ATTI                        = 2048  # 0x800 IMU Only
-        self.ID_IMU_EXT                         = 2064  # 0x810 IMU Extended
         self.unknowns_log_msg = []
+        for field in FLIGHT_DATA_SCHEMA:
+            setattr(self, field.name, False if field.dtype == 'bool' else 0)
 
-    
-    
-        self.battery_low = 0
-        self.battery_lower = 0
-        self.battery_percentage = 0
-        self.battery_state = 0
-        self.camera_state = 0
-        self.down_visual_state = 0
-        self.drone_battery_left = 0
-        self.drone_fly_time_left = 0
-        self.drone_hover = 0
-        self.em_open = 0
-        self.em_sky = 0
-        self.em_ground = 0
-        self.east_speed = 0
-        self.electrical_machinery_state = 0
-        self.factory_mode = 0
-        self.fly_mode = 0
-        self.fly_speed = 0
-        self.fly_time = 0
-        self.front_in = 0
-        self.front_lsc = 0
-        self.front_out = 0
-        self.gravity_state = 0
-        self.ground_speed = 0
-        self.height = 0
-        self.imu_calibration_state = 0
-        self.imu_state = 0
-        self.light_strength = 0
-        self.north_speed = 0
-        self.outage_recording = 0
-        self.power_state = 0
-        self.pressure_state = 0
-        self.smart_video_exit_mode = 0
-        self.temperature_height = 0
-        self.throw_fly_timer = 0
-        self.wifi_disturb = 0
-        self.wifi_strength = 0
-        self.wind_state = 0
-
-        # MVO
-        self.velX=0
-        self.velY=0
-        self.velZ=0
-        self.posX=0
-        self.posY=0
-        self.posZ=0
-        
-        self.posCov1=0
-        self.posCov2=0
-        self.posCov3=0
-        self.posCov4=0
-        self.posCov5=0
-        self.posCov6=0
-
-        self.velCov1=0
-        self.velCov2=0
-        self.velCov3=0
-        self.velCov4=0
-        self.velCov5=0
-        self.velCov6=0
-        
-        self.tof=0
-        self.tofUncertainty=0
-        
-        self.mov_valid_velX = False
-        self.mov_valid_velY = False
-        self.mov_valid_velZ = False
-        self.mov_valid_posX = False
-        self.mov_valid_posY = False
-        self.mov_valid_posZ = False
-        
-        # IMU
-        self.longitude=0
-        self.latitude=0
-        self.baro=0
-        
-        self.accX=0
-        self.accY=0
-        self.accZ=0
-        self.gyroX=0
-        self.gyroY=0
-        self.gyroZ=0
-        self.baro_smooth=0
-        self.qW=0
-        self.qX=0
-        self.qY=0
-        self.qZ=0
-        self.velN=0
-        self.velE=0
-        self.velD=0
-        
-        # IMU to Euler
-        self.yaw=0
-        self.pitch=0
-        self.roll=0
-        self.vgX=0
-        self.vgY=0
-        self.vgZ=0
-        
-        # IMU EXTENDED WITH VISUAL ODOMETRY
-        self.velX_VO=0
-        self.velY_VO=0
-        self.velZ_VO=0
-        self.posX_VO=0
-        self.posY_VO=0
-        self.posZ_VO=0
-        self.vel_VO=0
-        self.dist_V0=0
-        self.rtkLong_VO=0
-        self.rtkLat_VO=0
-        self.rtkAlt_VO=0
-        self.error_flag_VO=0 #  To DO  decoding
-        
-    def update_fly_message(self,data):
-        if len(data) < 24:
+    def values(self):
+        """Returns all the values, in the order of :data:`FLIGHT_DATA_SCHEMA`.
+
+        :rtype: tuple
+        """
+        return _FLIGHT_DATA_VALUES(self)
+
+    def pack_into(self, buffer, offset=0):
+        """Packs all the values into ``buffer`` with the layout :data:`FLIGHT_DATA_STRUCT` (a numpy array of
+        dtype ``numpy.dtype(FLIGHT_DATA_DTYPE)`` can be used as buffer).
+        """
+        FLIGHT_DATA_STRUCT.pack_into(buffer, offset, *_FLIGHT_DATA_VALUES(self))
+
+    def update_fly_message(self,data,history=None,timestamp=None):
+        if len(data) < FLIGHT_MSG_STRUCT.size:
             return
 
-        self.height = int16(data[0], data[1])
-        self.north_speed = int16(data[2], data[3])
-        self.east_speed = int16(data[4], data[5])
-        self.ground_speed = int16(data[6], data[7])
-        self.fly_time = int16(data[8], data[9])
-
-        self.imu_state = ((data[10] >> 0) & 0x1)
-        self.pressure_state = ((data[10] >> 1) & 0x1)
-        self.down_visual_state = ((data[10] >> 2) & 0x1)
-        self.power_state = ((data[10] >> 3) & 0x1)
-        self.battery_state = ((data[10] >> 4) & 0x1)
-        self.gravity_state = ((data[10] >> 5) & 0x1)
-        self.wind_state = ((data[10] >> 7) & 0x1)
-
-        self.imu_calibration_state = data[11]
-        self.battery_percentage = data[12]
-        self.drone_battery_left = int16(data[13], data[14])
-        self.drone_fly_time_left = uint16(data[15], data[16]) #vérifier int ou uint
-
-        self.em_sky = ((data[17] >> 0) & 0x1)
-        self.em_ground = ((data[17] >> 1) & 0x1)
-        self.em_open = ((data[17] >> 2) & 0x1)
-        self.drone_hover = ((data[17] >> 3) & 0x1)
-        self.outage_recording = ((data[17] >> 4) & 0x1)
-        
-        self.battery_low = ((data[17] >> 5) & 0x1)
-        self.battery_lower = ((data[17] >> 6) & 0x1)
-        self.factory_mode = ((data[17] >> 7) & 0x1)
-
-        self.fly_mode = data[18]
-        self.throw_fly_timer = data[19]
-        self.camera_state = data[20]
-        self.electrical_machinery_state = data[21]
-
-        self.front_in = ((data[22] >> 0) & 0x1)
-        self.front_out = ((data[22] >> 1) & 0x1)
-        self.front_lsc = ((data[22] >> 2) & 0x1)
-
-        self.temperature_height = ((data[23] >> 0) & 0x1)
-         
-       
-            
+        (self.height, self.north_speed, self.east_speed, self.ground_speed, self.fly_time,
+         states, self.imu_calibration_state, self.battery_percentage,
+         self.drone_battery_left, self.drone_fly_time_left,
+         em_states, self.fly_mode, self.throw_fly_timer, self.camera_state, self.electrical_machinery_state,
+         front_states, temperature_states) = FLIGHT_MSG_STRUCT.unpack_from(data)
+
+        (self.imu_state, self.pressure_state, self.down_visual_state, self.power_state,
+         self.battery_state, self.gravity_state, self.wind_state) = FLIGHT_STATE_TABLE[states]
+        (self.em_sky, self.em_ground, self.em_open, self.drone_hover, self.outage_recording,
+         self.battery_low, self.battery_lower, self.factory_mode) = FLIGHT_EM_TABLE[em_states]
+        (self.front_in, self.front_out, self.front_lsc) = FLIGHT_FRONT_TABLE[front_states]
+        self.temperature_height = temperature_states & 0x1
+        if history is not None:
+            history.append('flight', self, timestamp)
         
     def __str__(self):
         return (
@@ -324,73 +506,80 @@ class FlightData(object):
             "")
             
             
-    def update_log_message(self,data,LOGGER):
+    def update_log_message(self,data,LOGGER,history=None,timestamp=None,clock=None):
         #LOGGER.debug('*** Beging log packet processing')
-        if isinstance(data, bytearray):
-            data = str(data)
+        # data can be bytes, bytearray or a memoryview of the reception buffer
+        # clock (a common.clock_sync.ClockSync) gives the sensor time of the records from their tick
+        sensor_time = timestamp
         pos = 0
         while (pos < len(data) - 2):
             #LOGGER.debug('LogNewMvoFeedback: pos : %d' % (pos))
                
-            if (struct.unpack_from('B', data, pos+0)[0] != 0x55):
+            if data[pos] != 0x55:
                 #raise Exception('LogData: corrupted data at pos=%d, data=%s'
                 #               % (pos, byte_to_hexstring(data[pos:])))
                 return
-            length = struct.unpack_from('<h', data, pos+1)[0]
-            checksum = data[pos+3]
-            id = struct.unpack_from('<H', data, pos+4)[0]
+            if pos + LOG_RECORD_HEADER_STRUCT.size > len(data):
+                return
+            (sof, length, checksum, id, tick) = LOG_RECORD_HEADER_STRUCT.unpack_from(data, pos)
             # 4bytes data[6:9] is tick
             # last 2 bytes are CRC
             # length-12 is the byte length of payload
-            xorval = data[pos+6]
-            if isinstance(data, str):
-                payload = bytearray([ord(x) ^ ord(xorval) for x in data[pos+10:pos+10+length-12]])
-            else:
-                payload = bytearray([x ^ xorval for x in data[pos+10:pos+10+length-12]])
+            if length < 12 or pos + length > len(data):
+                # corrupted record length
+                return
+            if clock is not None and timestamp is not None:
+                sensor_time = clock.update(tick, timestamp)
+            # the payload is masked with the low byte of the tick
+            xorval = tick & 0xff
+            payload_length = length - 12
+            # unmask the whole payload at once with a translation table
+            payload = bytes(data[pos+10:pos+10+payload_length]).translate(XOR_TABLES[xorval])
 
             if id==self.ID_NEW_MVO_FEEDBACK:
                 # info from : https://github.com/bgromov/TelloSwift/blob/06cfb548de787ba373472df381ee49224d2ca89c/Sources/TelloSwiftObjC/include/Protocol.h
                 # Decoding of speed & position
                 #LOGGER.debug('LogNewMvoFeedback: length=%d %s' % (len(payload), byte_to_hexstring(payload)))
-                (self.velX, self.velY, self.velZ) = struct.unpack_from('<hhh', payload, 2)
-                self.velX /= 1000.0
-                self.velY /= 1000.0
-                self.velZ /= 1000.0
-                (self.posX, self.posY, self.posZ,self.posUncertainty) = struct.unpack_from('ffff', payload, 8)
-                (self.posCov1,self.posCov2,self.posCov3)= struct.unpack_from('fff', payload, 20)
-                (self.posCov4,self.posCov5,self.posCov6)= struct.unpack_from('fff', payload, 32)
-                (self.velCov1,self.velCov2,self.velCov3)= struct.unpack_from('fff', payload, 44)
-                (self.velCov4,self.velCov5,self.velCov6)= struct.unpack_from('fff', payload, 56)
-                
-                (self.tof,self.tofUncertainty) = struct.unpack_from('ff',payload,68);
-                self.posUncertainty*=10000
-                mov_valid_data=payload[76] # bit 4 and 8 unused
-                self.mov_valid_velX = (mov_valid_data & 1) == 1  
-                self.mov_valid_velY = (mov_valid_data & 2) == 2 
-                self.mov_valid_velZ = (mov_valid_data & 4) == 4
-                self.mov_valid_posX = (mov_valid_data & 16) == 16 
-                self.mov_valid_posY = (mov_valid_data & 32) == 32 
-                self.mov_valid_posZ = (mov_valid_data & 64) == 64
-                
+                if payload_length >= MVO_RECORD_STRUCT.size:
+                    (velX, velY, velZ,
+                     self.posX, self.posY, self.posZ,
+                     self.posCov1, self.posCov2, self.posCov3, self.posCov4, self.posCov5, self.posCov6,
+                     self.velCov1, self.velCov2, self.velCov3, self.velCov4, self.velCov5, self.velCov6,
+                     self.tof, self.tofUncertainty,
+                     mov_valid_data) = MVO_RECORD_STRUCT.unpack_from(payload)
+                    self.velX = velX / 1000.0
+                    self.velY = velY / 1000.0
+                    self.velZ = velZ / 1000.0
+                    # the uncertainty shares its bytes with the first covariance term
+                    self.posUncertainty = self.posCov1 * 10000
+                    (self.mov_valid_velX, self.mov_valid_velY, self.mov_valid_velZ,
+                     self.mov_valid_posX, self.mov_valid_posY, self.mov_valid_posZ) = MVO_VALID_TABLE[mov_valid_data]
+                    if history is not None:
+                        history.append('mvo', self, sensor_time, timestamp)
                 
                 #LOGGER.debug('LogNewMvoFeedback: velX : %.2f velY :%.2f velZ : %.2f posX : %.2f posY : %.2f posZ : %.2f' % (self.velX,self.velY,self.velZ,self.posX,self.posY,self.posZ))
                 
             elif id == self.ID_IMU_ATTI:
                 #LOGGER.debug('LogImuAtti: length=%d %s' % (len(payload), byte_to_hexstring(payload)))
-                (self.longitude,self.latitude,self.baro)= struct.unpack_from('ddf', payload, 0)
-                (self.accX, self.accY, self.accZ) = struct.unpack_from('fff', payload, 20)
-                (self.gyroX, self.gyroY, self.gyroZ,self.baro_smooth) = struct.unpack_from('ffff', payload, 32)
-                (self.qW,self.qX,self.qY, self.qZ) = struct.unpack_from('ffff', payload, 48)
-                (self.velN, self.velE, self.velD) = struct.unpack_from('fff', payload, 76)
-                self.convertAngle()
+                if payload_length >= IMU_RECORD_STRUCT.size:
+                    (self.longitude, self.latitude, self.baro,
+                     self.accX, self.accY, self.accZ,
+                     self.gyroX, self.gyroY, self.gyroZ, self.baro_smooth,
+                     self.qW, self.qX, self.qY, self.qZ,
+                     self.velN, self.velE, self.velD) = IMU_RECORD_STRUCT.unpack_from(payload)
+                    self.convertAngle()
+                    if history is not None:
+                        history.append('imu', self, sensor_time, timestamp)
             elif id == self.ID_IMU_EXT:
                 #IMU extended with visual oddometry
-                (self.velX_VO,self.velY_VO,self.velZ_VO)= struct.unpack_from('fff', payload, 0)
-                (self.posX_VO,self.posY_VO,self.posZ_VO)= struct.unpack_from('fff', payload, 12)
-                (self.vel__VO,self._dist_V0)= struct.unpack_from('ff', payload, 24)
-                (self.rtkLong_VO,self.rtkLat_VO,self.rtkAlt_VO)= struct.unpack_from('ddf', payload, 32)
-                self.error_flag_VO= struct.unpack_from('h', payload, 52)[0]#indicate if the vel & pos ar valid
-                #print('self.error_flag_VO',self.error_flag_VO)
+                if payload_length >= IMU_EXT_RECORD_STRUCT.size:
+                    (self.velX_VO, self.velY_VO, self.velZ_VO,
+                     self.posX_VO, self.posY_VO, self.posZ_VO,
+                     self.vel_VO, self.dist_VO,
+                     self.rtkLong_VO, self.rtkLat_VO, self.rtkAlt_VO,
+                     self.error_flag_VO) = IMU_EXT_RECORD_STRUCT.unpack_from(payload) # error_flag indicates if the vel & pos ar valid
+                    if history is not None:
+                        history.append('imu_ext', self, sensor_time, timestamp)
             else:
                 if not id in self.unknowns_log_msg:
                     LOGGER.debug('LogData: UNHANDLED LOG DATA: id=%5d, length=%4d' % (id, length-12))
@@ -493,3 +682,103 @@ class VideoData(object):
             loss = loss * VideoData.packets_per_frame + ((v0.h1 & 0x7f) - (v1.h1 & 0x7f) - 1)
 
         return loss
+
+
+if __name__ == '__main__':
+    # Micro benchmark of the STICK_CMD packet construction
+    # (run from the tello_ctrl folder with: python -m common.protocol)
+    import timeit
+
+    def legacy_stick_packet(left_right, forward_backward, up_down, yaw, fast_mode, now):
+        pkt = Packet(STICK_CMD, 0x60)
+        axis1 = int(1024 + 660.0 * left_right) & 0x7ff
+        axis2 = int(1024 + 660.0 * forward_backward) & 0x7ff
+        axis3 = int(1024 + 660.0 * up_down) & 0x7ff
+        axis4 = int(1024 + 660.0 * yaw) & 0x7ff
+        axis5 = int(fast_mode) & 0x01
+        packed = axis1 | (axis2 << 11) | (axis3 << 22) | (axis4 << 33) | (axis5 << 44)
+        packed_bytes = struct.pack('<Q', packed)
+        for i in range(6):
+            pkt.add_byte(byte(packed_bytes[i]))
+        pkt.add_time(now)
+        pkt.fixup()
+        return pkt
+
+    encoder = CommandEncoder()
+    now = datetime.datetime.now()
+    for sticks in [(0, 0, 0, 0, False), (0.5, -0.25, 1, -1, True), (-1, 1, 0.1, 0.3, False)]:
+        assert legacy_stick_packet(*sticks, now).get_buffer() == encoder.build_stick(*sticks, now).get_buffer()
+
+    n = 50000
+    t_legacy = timeit.timeit(lambda: legacy_stick_packet(0.5, -0.25, 1, -1, True, now), number=n)
+    t_template = timeit.timeit(lambda: encoder.build_stick(0.5, -0.25, 1, -1, True, now), number=n)
+    print('STICK_CMD packet construction (%d packets)' % n)
+    print('  Packet + fixup   : %10.0f packets/s' % (n / t_legacy))
+    print('  PacketTemplate   : %10.0f packets/s (x%.1f)' % (n / t_template, t_legacy / t_template))
+
+    # Throughput of the log records decoding (one LOG_DATA_MSG with a mvo, an imu and an imu extended record)
+    import logging
+
+    def log_record(rec_id, payload, tick):
+        header = LOG_RECORD_HEADER_STRUCT.pack(0x55, len(payload) + 12, 0, rec_id, tick)
+        return header + bytes(x ^ (tick & 0xff) for x in payload) + b'\x00\x00'
+
+    def legacy_log_message(flight_data, data):
+        # per field decoding with a list comprehension for the unmasking
+        pos = 0
+        while pos < len(data) - 2:
+            length = struct.unpack_from('<h', data, pos+1)[0]
+            id = struct.unpack_from('<H', data, pos+4)[0]
+            xorval = data[pos+6]
+            payload = bytearray([x ^ xorval for x in data[pos+10:pos+10+length-12]])
+            if id == flight_data.ID_NEW_MVO_FEEDBACK:
+                (flight_data.velX, flight_data.velY, flight_data.velZ) = struct.unpack_from('<hhh', payload, 2)
+                (flight_data.posX, flight_data.posY, flight_data.posZ, flight_data.posUncertainty) = struct.unpack_from('ffff', payload, 8)
+                (flight_data.posCov1, flight_data.posCov2, flight_data.posCov3) = struct.unpack_from('fff', payload, 20)
+                (flight_data.posCov4, flight_data.posCov5, flight_data.posCov6) = struct.unpack_from('fff', payload, 32)
+                (flight_data.velCov1, flight_data.velCov2, flight_data.velCov3) = struct.unpack_from('fff', payload, 44)
+                (flight_data.velCov4, flight_data.velCov5, flight_data.velCov6) = struct.unpack_from('fff', payload, 56)
+                (flight_data.tof, flight_data.tofUncertainty) = struct.unpack_from('ff', payload, 68)
+                mov_valid_data = payload[76]
+                flight_data.mov_valid_velX = (mov_valid_data & 1) == 1
+                flight_data.mov_valid_velY = (mov_valid_data & 2) == 2
+                flight_data.mov_valid_velZ = (mov_valid_data & 4) == 4
+                flight_data.mov_valid_posX = (mov_valid_data & 16) == 16
+                flight_data.mov_valid_posY = (mov_valid_data & 32) == 32
+                flight_data.mov_valid_posZ = (mov_valid_data & 64) == 64
+            elif id == flight_data.ID_IMU_ATTI:
+                (flight_data.longitude, flight_data.latitude, flight_data.baro) = struct.unpack_from('ddf', payload, 0)
+                (flight_data.accX, flight_data.accY, flight_data.accZ) = struct.unpack_from('fff', payload, 20)
+                (flight_data.gyroX, flight_data.gyroY, flight_data.gyroZ, flight_data.baro_smooth) = struct.unpack_from('ffff', payload, 32)
+                (flight_data.qW, flight_data.qX, flight_data.qY, flight_data.qZ) = struct.unpack_from('ffff', payload, 48)
+                (flight_data.velN, flight_data.velE, flight_data.velD) = struct.unpack_from('fff', payload, 76)
+                flight_data.convertAngle()
+            elif id == flight_data.ID_IMU_EXT:
+                (flight_data.velX_VO, flight_data.velY_VO, flight_data.velZ_VO) = struct.unpack_from('fff', payload, 0)
+                (flight_data.posX_VO, flight_data.posY_VO, flight_data.posZ_VO) = struct.unpack_from('fff', payload, 12)
+                (flight_data.vel_VO, flight_data.dist_VO) = struct.unpack_from('ff', payload, 24)
+                (flight_data.rtkLong_VO, flight_data.rtkLat_VO, flight_data.rtkAlt_VO) = struct.unpack_from('ddf', payload, 32)
+                flight_data.error_flag_VO = struct.unpack_from('h', payload, 52)[0]
+            pos += length
+
+    mvo = bytearray(80)
+    MVO_RECORD_STRUCT.pack_into(mvo, 0, 100, -200, 300, *([0.5] * 17), 0x77)
+    imu = bytearray(120)
+    IMU_RECORD_STRUCT.pack_into(imu, 0, 1.0, 2.0, *([0.1] * 8), 1.0, 0.0, 0.0, 0.0, 0.2, 0.3, 0.4)
+    imu_ext = bytearray(60)
+    IMU_EXT_RECORD_STRUCT.pack_into(imu_ext, 0, *([0.25] * 11), 3)
+    log_data = (log_record(29, mvo, 0x12345678) + log_record(2048, imu, 0x12345679)
+                + log_record(2064, imu_ext, 0x1234567a) + b'\x00\x00')
+    fly_data = FLIGHT_MSG_STRUCT.pack(120, -3, 4, 5, 60, 0xb5, 0, 87, 3800, 400, 0x53, 6, 0, 0, 0, 0x05, 1) + b'\x00\x00'
+
+    flight_data = FlightData()
+    logger = logging.getLogger('tello_ctrl')
+    view = memoryview(log_data)
+    n = 20000
+    t_legacy = timeit.timeit(lambda: legacy_log_message(flight_data, log_data), number=n)
+    t_struct = timeit.timeit(lambda: flight_data.update_log_message(view, logger), number=n)
+    t_fly = timeit.timeit(lambda: flight_data.update_fly_message(fly_data), number=n)
+    print('Log records decoding (%d records)' % (3 * n))
+    print('  per field unpack : %10.0f records/s' % (3 * n / t_legacy))
+    print('  Struct per record: %10.0f records/s (x%.1f)' % (3 * n / t_struct, t_legacy / t_struct))
+    print('FLIGHT_MSG decoding: %10.0f messages/s' % (n / t_fly))
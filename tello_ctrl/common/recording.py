@@ -0,0 +1,123 @@
+import os
+
+import av
+import numpy as np
+
+from .data_log import read_data_log, read_log
+
+
+# columns of the frame index written next to a recorded video
+FRAME_INDEX_COLUMNS = ['frame', 'stream_frame', 'video_time', 'arrival', 'decode', 'log_row', 'log_time']
+
+
+def frame_index_file_name(video_file):
+    """Returns the name of the frame index of a recorded video (``video.mkv`` -> ``video_frames.tlog``)."""
+    return os.path.splitext(video_file)[0] + '_frames.tlog'
+
+
+def _nearest(times, values):
+    # index of the nearest element of the increasing array times for each value (-1 if times is empty)
+    if len(times) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    after = np.minimum(np.searchsorted(times, values), len(times) - 1)
+    before = np.maximum(after - 1, 0)
+    return np.where(np.abs(values - times[before]) < np.abs(times[after] - values), before, after)
+
+
+class SyncedRecording(object):
+    """Random access to a video recorded with :meth:`~tello_ctrl.tello_ctrl.start_recording_video_to_file` and to the
+    data log recorded at the same time with :meth:`~tello_ctrl.tello_ctrl.start_data_logging`.
+
+    The frame index (see :func:`frame_index_file_name`) gives for each recorded frame its time in the video file, the
+    receive time of its data and its decoding time (``time.time()`` clock, as the ``time`` column of the data log), and
+    the data log row sampled at the nearest time. The frames are decoded on demand: a frame is reached by seeking to
+    the previous keyframe, and reading the frames in order only decodes each frame once.
+
+    :param video_file: name of the video file
+    :type video_file: str
+    :param data_log_file: name of the data log (csv, binary or delta format, see :func:`common.data_log.read_log`),
+        defaults to None (no telemetry)
+    :type data_log_file: str or [str], optional
+    :param index_file: name of the frame index, defaults to None (:func:`frame_index_file_name` of ``video_file``)
+    :type index_file: str, optional
+    :param video_format: format of the returned frames, ``"rgb24"`` or ``"bgr24"``, defaults to ``"rgb24"``
+    :type video_format: str
+    """
+    def __init__(self, video_file, data_log_file=None, index_file=None, video_format='rgb24'):
+        if index_file is None:
+            index_file = frame_index_file_name(video_file)
+        self.video_file = video_file
+        self.video_format = video_format
+        self.index = read_data_log(index_file)
+        self.arrival = self.index['arrival']
+        self.telemetry = None
+        self.rows = None
+        if data_log_file is not None:
+            self.telemetry = read_log(data_log_file)
+            log_time = self.telemetry['time']
+            # the row logged at log_time (the logger may have been restarted in append mode, so the row numbers are
+            # not used), or the row nearest to the arrival time when the logger was not running at that time
+            times = np.where(np.isnan(self.index['log_time']), self.arrival, self.index['log_time'])
+            self.rows = _nearest(log_time, times)
+        self.__container = None
+        self.__stream = None
+        self.__frames = None
+        # index of the next frame given by self.__frames
+        self.__next = None
+
+    def __len__(self):
+        return len(self.arrival)
+
+    def find_frame(self, timestamp):
+        """Returns the index of the frame received nearest to ``timestamp`` (``time.time()`` clock).
+
+        :rtype: int
+        """
+        return int(_nearest(self.arrival, np.array([timestamp]))[0])
+
+    def get_telemetry(self, i):
+        """Returns the data log row of the frame ``i``.
+
+        :return: A dictionnary giving the value of each column of the data log, or ``None`` if there is no data log.
+        :rtype: dict
+        """
+        if self.telemetry is None or self.rows[i] < 0:
+            return None
+        row = self.rows[i]
+        return {name: values[row] for name, values in self.telemetry.items()}
+
+    def get_frame(self, i):
+        """Returns the frame ``i`` of the video.
+
+        :return: The image (H x W x 3).
+        :rtype: numpy.ndarray
+        :raise IndexError: An exception is raised if the frame is not in the video.
+        """
+        if i < 0 or i >= len(self):
+            raise IndexError('frame %d is not in the recording' % i)
+        if self.__container is None:
+            self.__container = av.open(self.video_file)
+            self.__stream = self.__container.streams.video[0]
+        target = self.index['video_time'][i]
+        # half a frame of tolerance on the times rescaled by the container
+        tolerance = 0.5 / 30
+        if self.__next is None or i < self.__next or target - self.index['video_time'][self.__next] > 1.0:
+            self.__container.seek(int(target / self.__stream.time_base), stream=self.__stream, backward=True)
+            self.__frames = self.__container.decode(self.__stream)
+        for frame in self.__frames:
+            if frame.time is not None and frame.time >= target - tolerance:
+                self.__next = i + 1
+                return frame.to_ndarray(format=self.video_format)
+        self.__next = None
+        raise IndexError('frame %d is not in the video file' % i)
+
+    def __getitem__(self, i):
+        """Returns the frame ``i`` and its data log row (see :meth:`get_frame` and :meth:`get_telemetry`)."""
+        return self.get_frame(i), self.get_telemetry(i)
+
+    def close(self):
+        """Closes the video file."""
+        if self.__container is not None:
+            self.__container.close()
+            self.__container = None
+            self.__next = None
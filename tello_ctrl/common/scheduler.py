@@ -0,0 +1,139 @@
+import time
+import math
+
+
+class PeriodicScheduler(object):
+    """Fixed rate loop based on deadlines of the monotonic clock.
+
+    Deadlines are computed as ``first_deadline + n * period`` so the rate does not drift with the
+    time spent in the loop body. When the loop is late by one period or more, the missed deadlines
+    are counted and skipped (no burst of iterations to catch up).
+
+    :param period: time between two deadlines, in seconds
+    :type period: float
+    :raise ValueError: An exception is raised if the period is not strictly positive.
+    """
+    def __init__(self, period):
+        self.set_period(period)
+        self.reset()
+
+    def set_period(self, period):
+        if period <= 0:
+            raise ValueError('period must be strictly positive')
+        self.period = period
+
+    def reset(self):
+        """Restarts the deadlines and clears the statistics."""
+        self.next_deadline = None
+        self.last_wakeup = None
+        self.count = 0
+        self.missed = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.__lateness_sum = 0.0
+        # interval statistics (Welford's algorithm)
+        self.__interval_count = 0
+        self.__interval_mean = 0.0
+        self.__interval_m2 = 0.0
+        self.__interval_min = math.inf
+        self.__interval_max = 0.0
+
+    def wait(self, stop_event=None):
+        """Waits for the next deadline.
+
+        :param stop_event: If provided, the wait is interrupted when this event is set, defaults to None.
+        :type stop_event: threading.Event
+        :return: The lateness of the wake up relative to the deadline in seconds, or ``None`` if ``stop_event`` was set.
+        :rtype: float
+        """
+        delay = self.next_delay()
+        if delay > 0:
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    return None
+            else:
+                time.sleep(delay)
+        return self.wakeup()
+
+    def next_delay(self):
+        """Moves to the next deadline and returns the time left before it. Together with :meth:`wakeup`,
+        this allows running the deadlines from an event loop (``await asyncio.sleep(delay)``).
+
+        :return: Time to wait before the next deadline in seconds (may be negative when late).
+        :rtype: float
+        """
+        now = time.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        else:
+            self.next_deadline += self.period
+        return self.next_deadline - now
+
+    def wakeup(self):
+        """Records the wake up for the current deadline and skips the deadlines that could not be met.
+
+        :return: The lateness of the wake up relative to the deadline in seconds.
+        :rtype: float
+        """
+        now = time.monotonic()
+        lateness = now - self.next_deadline
+        if lateness >= self.period:
+            # skip the deadlines that could not be met
+            skipped = int(lateness // self.period)
+            self.missed += skipped
+            self.next_deadline += skipped * self.period
+
+        self.__update_statistics(now, lateness)
+        return lateness
+
+    def __update_statistics(self, now, lateness):
+        self.count += 1
+        self.last_lateness = lateness
+        self.__lateness_sum += lateness
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+
+        if self.last_wakeup is not None:
+            interval = now - self.last_wakeup
+            self.__interval_count += 1
+            delta = interval - self.__interval_mean
+            self.__interval_mean += delta / self.__interval_count
+            self.__interval_m2 += delta * (interval - self.__interval_mean)
+            if interval < self.__interval_min:
+                self.__interval_min = interval
+            if interval > self.__interval_max:
+                self.__interval_max = interval
+        self.last_wakeup = now
+
+    def get_statistics(self):
+        """Returns the loop timing statistics since the last :meth:`reset`:
+
+            * ``count`` : number of deadlines served
+            * ``missed`` : number of deadlines skipped because the loop was late by more than one period
+            * ``period`` : requested period (s)
+            * ``interval_mean``, ``interval_min``, ``interval_max`` : measured time between two wake ups (s)
+            * ``jitter`` : standard deviation of the time between two wake ups (s)
+            * ``lateness_mean``, ``lateness_max`` : delay between the deadline and the wake up (s)
+
+        :rtype: dict
+        """
+        if self.__interval_count > 1:
+            jitter = math.sqrt(self.__interval_m2 / (self.__interval_count - 1))
+        else:
+            jitter = 0.0
+        return {'count': self.count,
+                'missed': self.missed,
+                'period': self.period,
+                'interval_mean': self.__interval_mean,
+                'interval_min': self.__interval_min if self.__interval_count > 0 else 0.0,
+                'interval_max': self.__interval_max,
+                'jitter': jitter,
+                'lateness_mean': self.__lateness_sum / self.count if self.count > 0 else 0.0,
+                'lateness_max': self.max_lateness}
+
+
+if __name__ == '__main__':
+    scheduler = PeriodicScheduler(1 / 50)
+    for i in range(100):
+        scheduler.wait()
+    print(scheduler.get_statistics())
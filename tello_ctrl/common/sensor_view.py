@@ -0,0 +1,128 @@
+import struct
+from operator import attrgetter, itemgetter
+
+import numpy as np
+
+
+def _tuple_getter(names):
+    """Returns a function reading the attributes ``names`` of an object as a tuple (whatever the number of names)."""
+    if len(names) == 0:
+        return lambda source: ()
+    if len(names) == 1:
+        getter = attrgetter(names[0])
+        return lambda source: (getter(source),)
+    return attrgetter(*names)
+
+
+class SensorView(object):
+    """Values of a fixed list of sensors and controls. The names are resolved once, when the view is created,
+    so reading the values only costs a couple of C level calls (``operator.attrgetter``).
+
+    :param names: names of the sensors and controls, in the order of the values
+    :type names: [str]
+    :param flight_data: object holding the sensor values as attributes (a :class:`~common.protocol.FlightData`)
+    :param controls: object holding the control values as attributes
+    :param control_attributes: dictionnary giving for each control name a tuple (attribute name, scale)
+    :type control_attributes: dict
+    :param is_control: for each name, True if it is a control, defaults to None (a name is a control if it is in
+        ``control_attributes`` and is not an attribute of ``flight_data``)
+    :type is_control: [bool], optional
+    """
+    def __init__(self, names, flight_data, controls, control_attributes, is_control=None):
+        self.names = tuple(names)
+        # position of each name in the values (the first one for duplicated names)
+        self.index = {}
+        for i, name in enumerate(self.names):
+            self.index.setdefault(name, i)
+        if is_control is None:
+            is_control = [name in control_attributes and not hasattr(flight_data, name) for name in self.names]
+        sensors = [i for i in range(len(self.names)) if not is_control[i]]
+        control_names = [i for i in range(len(self.names)) if is_control[i]]
+
+        self.__flight_data = flight_data
+        self.__controls = controls
+        self.__get_sensors = _tuple_getter([self.names[i] for i in sensors])
+        self.__get_controls = _tuple_getter([control_attributes[self.names[i]][0] for i in control_names])
+        self.__scales = tuple(control_attributes[self.names[i]][1] for i in control_names)
+
+        # the values are read as sensors + controls, then put back in the order of names
+        order = sensors + control_names
+        columns = [order.index(i) for i in range(len(self.names))]
+        if columns == list(range(len(columns))):
+            self.__reorder = None
+        elif len(columns) == 1:
+            self.__reorder = lambda values: (values[columns[0]],)
+        else:
+            self.__reorder = itemgetter(*columns)
+
+        # the values are packed in place (faster than a numpy assignment from a tuple)
+        self.__struct = struct.Struct('=%dd' % len(self.names))
+        self.buffer = np.zeros(len(self.names), dtype=np.float64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def values(self):
+        """Returns the current values, with their original type (int, float or bool).
+
+        :rtype: tuple
+        """
+        values = self.__get_sensors(self.__flight_data)
+        if self.__scales:
+            values += tuple([value if scale == 1 else scale * value
+                             for scale, value in zip(self.__scales, self.__get_controls(self.__controls))])
+        if self.__reorder is not None:
+            values = self.__reorder(values)
+        return values
+
+    def read(self, out=None):
+        """Copies the current values into a float64 array.
+
+        :param out: contiguous float64 buffer receiving the values (``numpy.ndarray``, ``array.array('d')``...),
+            defaults to None (the preallocated array :attr:`buffer` of the view, which is overwritten by the next call)
+        :type out: numpy.ndarray, optional
+        :return: The buffer holding the values.
+        :rtype: numpy.ndarray
+        """
+        if out is None:
+            out = self.buffer
+        self.__struct.pack_into(out, 0, *self.values())
+        return out
+
+
+if __name__ == '__main__':
+    # Cost per call of the name lookups vs a view (run from the tello_ctrl folder with: python -m common.sensor_view)
+    import timeit
+    from .protocol import FlightData, FLIGHT_DATA_NAMES
+
+    class Controls(object):
+        def __init__(self):
+            self.left_right = 0.5
+            self.fast_mode = False
+
+    flight_data = FlightData()
+    controls = Controls()
+    sensor_list = list(FLIGHT_DATA_NAMES)
+    control_attributes = {'left_right': ('left_right', 100), 'fast_mode': ('fast_mode', 1)}
+    names = sensor_list[::2] + ['left_right', 'fast_mode']
+
+    control_list = ['left_right', 'fast_mode']
+
+    def by_name():
+        # same lookups as tello_ctrl.get_sensor_values_by_name before the views
+        data = []
+        for name in names:
+            if name in sensor_list:
+                data.append(getattr(flight_data, name))
+            elif name in control_list:
+                value = getattr(controls, name)
+                if control_list.index(name) < 1:
+                    value = value * 100
+                data.append(value)
+        return data
+
+    view = SensorView(names, flight_data, controls, control_attributes)
+    assert list(view.values()) == by_name()
+    n = 20000
+    for label, function in (('lookup by name', by_name), ('view values()', view.values), ('view read()', view.read)):
+        print('%d values, %s: %.2f us' % (len(names), label, timeit.timeit(function, number=n) / n * 1e6))
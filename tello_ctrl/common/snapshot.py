@@ -0,0 +1,93 @@
+import threading
+from collections import namedtuple
+from operator import attrgetter
+
+
+class SnapshotPublisher(object):
+    """Publishes immutable snapshots of the telemetry.
+
+    A snapshot is a named tuple holding a sequence number, the receive time (``time.monotonic()``) and the values
+    of ``names``, all read from the same decoded packet. :meth:`publish` builds a new snapshot and replaces the
+    reference :attr:`current` (a single assignment), so the readers get a consistent view without taking a lock:
+    the snapshot they hold is never modified.
+
+    There must be a single publishing thread (the reception thread).
+
+    :param names: names of the values (attributes of the published source)
+    :type names: [str]
+    :param source: object whose attributes give the values of the first snapshot (sequence number 0)
+    """
+    def __init__(self, names, source):
+        self.names = tuple(names)
+        self.snapshot_type = namedtuple('TelemetrySnapshot', ('seq_num', 'timestamp') + self.names)
+        self.__make = self.snapshot_type._make
+        self.__getter = attrgetter(*self.names)
+        self.__condition = threading.Condition()
+        self.__waiters = 0
+        self.current = self.__make((0, 0.0) + self.__getter(source))
+
+    def publish(self, source, timestamp):
+        """Publishes a snapshot of the attributes of ``source``.
+
+        :param timestamp: receive time of the packet (``time.monotonic()``)
+        :type timestamp: float
+        :return: The new snapshot.
+        """
+        snapshot = self.__make((self.current.seq_num + 1, timestamp) + self.__getter(source))
+        self.current = snapshot
+        # the waiters count is incremented before the waiters check the current snapshot, so
+        # a waiter that was not counted here will see the new snapshot
+        if self.__waiters:
+            with self.__condition:
+                self.__condition.notify_all()
+        return snapshot
+
+    def wait(self, seq_num=None, timeout=None):
+        """Waits for a snapshot newer than ``seq_num``.
+
+        :param seq_num: sequence number of the last snapshot seen, defaults to None (the current snapshot)
+        :type seq_num: int, optional
+        :param timeout: maximum waiting time in seconds, defaults to None (no timeout)
+        :type timeout: float, optional
+        :return: The first snapshot with a greater sequence number, or ``None`` on timeout.
+        """
+        if seq_num is None:
+            seq_num = self.current.seq_num
+        snapshot = self.current
+        if snapshot.seq_num > seq_num:
+            return snapshot
+        with self.__condition:
+            self.__waiters += 1
+            try:
+                if not self.__condition.wait_for(lambda: self.current.seq_num > seq_num, timeout):
+                    return None
+                return self.current
+            finally:
+                self.__waiters -= 1
+
+
+if __name__ == '__main__':
+    # Cost of a snapshot (run from the tello_ctrl folder with: python -m common.snapshot)
+    import time
+    import timeit
+    from .protocol import FlightData, FLIGHT_DATA_NAMES
+
+    flight_data = FlightData()
+    names = list(FLIGHT_DATA_NAMES)
+    publisher = SnapshotPublisher(names, flight_data)
+    n = 20000
+    t = timeit.timeit(lambda: publisher.publish(flight_data, time.monotonic()), number=n)
+    print('%d values: publish %.2f us' % (len(names), t / n * 1e6))
+
+    def publisher_thread():
+        for i in range(10):
+            time.sleep(0.01)
+            flight_data.posX = i
+            publisher.publish(flight_data, time.monotonic())
+    thread = threading.Thread(target=publisher_thread)
+    thread.start()
+    snapshot = publisher.current
+    while snapshot.posX < 9:
+        snapshot = publisher.wait(snapshot.seq_num, timeout=1)
+    thread.join()
+    print('last snapshot', snapshot.seq_num, snapshot.posX)
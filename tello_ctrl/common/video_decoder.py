@@ -0,0 +1,214 @@
+import collections
+
+import av
+
+
+# threading modes of the decoder
+THREAD_NONE = 'none'
+THREAD_SLICE = 'slice'
+THREAD_FRAME = 'frame'
+
+
+class H264Decoder(object):
+    """Decodes the H.264 frames rebuilt from the video packets with a ``av.CodecContext``. Each frame is given to the
+    decoder as a packet: there is no container to open, so the stream is not probed and a frame is decoded as soon as
+    it is received.
+
+    The data received before the first keyframe cannot be decoded: the decoder errors are counted and the data
+    are skipped.
+
+    The decoder can use several threads:
+
+        * ``"none"``: a single thread, lowest latency
+        * ``"slice"``: the slices of a frame are decoded in parallel, without latency; as the drone encodes a frame in
+          few slices, it only helps a little
+        * ``"frame"``: consecutive frames are decoded in parallel, the highest throughput, but a picture is only
+          returned once ``thread_count - 1`` more frames are given to the decoder (``thread_count - 1`` frames of
+          latency)
+
+    :param thread_type: ``"none"``, ``"slice"`` or ``"frame"``, defaults to ``"slice"`` (default of pyav)
+    :type thread_type: str
+    :param thread_count: number of threads, 0 to use one thread per core, defaults to 0
+    :type thread_count: int
+    :raise ValueError: An exception is raised if the thread type is unknown or if the thread count is negative.
+    """
+    def __init__(self, thread_type=THREAD_SLICE, thread_count=0):
+        if thread_type not in (THREAD_NONE, THREAD_SLICE, THREAD_FRAME):
+            raise ValueError('thread_type must be "none", "slice" or "frame", not %s' % thread_type)
+        if thread_count < 0:
+            raise ValueError('thread_count must be positive or zero')
+        self.thread_type = thread_type
+        self.thread_count = 1 if thread_type == THREAD_NONE else int(thread_count)
+        self.codec = self.__create_codec()
+        self.frames_in = 0
+        self.frames_out = 0
+        self.errors = 0
+        # (pts, tag) of the frames given to the decoder, in decoding order
+        self.__tags = collections.deque()
+
+    def decode(self, data, tag=None):
+        """Decodes a frame (Annex B byte stream).
+
+        The pts of the packet is the number of the frame, so a picture can be matched with its frame even when it is
+        returned later (frame threading): ``tag`` (e.g. the receive time of the frame) is given back by
+        :meth:`pop_tag` for the picture of this frame.
+
+        :param data: the frame
+        :type data: bytes
+        :param tag: value associated to the picture of this frame, defaults to None
+        :return: The decoded pictures (none, one, or several when the decoder is flushed).
+        :rtype: [av.VideoFrame]
+        """
+        packet = av.Packet(data)
+        packet.pts = self.frames_in
+        if tag is not None:
+            self.__tags.append((self.frames_in, tag))
+        self.frames_in += 1
+        try:
+            frames = self.codec.decode(packet)
+        except av.error.FFmpegError:
+            self.errors += 1
+            return []
+        self.frames_out += len(frames)
+        return frames
+
+    def pop_tag(self, picture):
+        """Returns the ``tag`` given to :meth:`decode` with the frame of ``picture`` (``None`` if there is none). The
+        pictures must be given in the order they are returned by the decoder (the tags of the frames that gave no
+        picture are discarded).
+        """
+        tags = self.__tags
+        while tags and tags[0][0] < picture.pts:
+            tags.popleft()
+        if tags and tags[0][0] == picture.pts:
+            return tags.popleft()[1]
+        return None
+
+    def flush(self):
+        """Returns the pictures kept by the decoder (``thread_count - 1`` pictures with frame threading) and restarts
+        it."""
+        try:
+            frames = self.codec.decode(None)
+        except av.error.FFmpegError:
+            frames = []
+        self.codec = self.__create_codec()
+        self.frames_out += len(frames)
+        return frames
+
+    def __create_codec(self):
+        # the threads are set before the codec is opened (at the first packet)
+        codec = av.CodecContext.create('h264', 'r')
+        codec.thread_type = self.thread_type.upper()
+        codec.thread_count = self.thread_count
+        return codec
+
+    def get_statistics(self):
+        """Returns the counters of the decoder: ``frames_in`` (frames given to the decoder), ``frames_out`` (pictures
+        decoded) and ``errors`` (frames rejected by the decoder).
+
+        :rtype: dict
+        """
+        return {'frames_in': self.frames_in, 'frames_out': self.frames_out, 'errors': self.errors}
+
+
+def read_access_units(file_name):
+    """Returns the frames of a raw H.264 file (e.g. saved from the video port), as sent by the drone.
+
+    :rtype: [bytes]
+    """
+    container = av.open(file_name, format='h264')
+    try:
+        return [bytes(packet) for packet in container.demux(video=0) if packet.size]
+    finally:
+        container.close()
+
+
+if __name__ == '__main__':
+    # Time to the first frame, container opened on the stream (as the previous decoding thread) vs codec context.
+    # The frames of a recorded stream are sent at 30 fps, starting in the middle of a group of pictures as when the
+    # video is requested to the drone.
+    # (run from the tello_ctrl folder with: python -m common.video_decoder stream.h264)
+    # With --threads, throughput and latency of the threading modes of the decoder instead:
+    # python -m common.video_decoder --threads stream.h264
+    import logging
+    import os
+    import sys
+    import threading
+    import time
+    from .video_stream import VideoStream, is_keyframe
+
+    av.logging.set_level(av.logging.PANIC)
+    frames = read_access_units(sys.argv[-1])
+    keyframes = [i for i, frame in enumerate(frames) if is_keyframe(frame)]
+    start = keyframes[0] + 1 if keyframes else 0
+    period = 1 / 30
+
+    def container_first_frame():
+        stream = VideoStream(logging.getLogger(), max_frames=len(frames))
+
+        def sender():
+            for frame in frames[start:]:
+                stream.update_raw_data(frame)
+                time.sleep(period)
+            stream.end_stream()
+        t0 = time.perf_counter()
+        threading.Thread(target=sender, daemon=True).start()
+        container = None
+        for retry in range(5):
+            try:
+                container = av.open(stream, options={'preset': 'ultrafast', 'tune': 'zerolatency '}, timeout=(5, 0.5))
+                break
+            except av.error.FFmpegError:
+                pass
+        if container is None:
+            return None
+        for picture in container.decode(video=0):
+            t = time.perf_counter() - t0
+            stream.end_stream()
+            return t
+        return None
+
+    def codec_first_frame():
+        decoder = H264Decoder()
+        t0 = time.perf_counter()
+        for frame in frames[start:]:
+            if decoder.decode(frame):
+                return time.perf_counter() - t0, decoder.errors
+            time.sleep(period)
+        return None, decoder.errors
+
+    def threads_benchmark(thread_type, thread_count):
+        # throughput: the frames are decoded as fast as possible
+        decoder = H264Decoder(thread_type, thread_count)
+        t0 = time.perf_counter()
+        for frame in frames[start:]:
+            decoder.decode(frame)
+        decoder.flush()
+        throughput = decoder.frames_out / (time.perf_counter() - t0)
+        # latency: the frames are given at 30 fps, each picture is matched with the send time of its frame
+        decoder = H264Decoder(thread_type, thread_count)
+        latencies = []
+        next_time = time.perf_counter()
+        for frame in frames[start:]:
+            for picture in decoder.decode(frame, time.perf_counter()):
+                latencies.append(time.perf_counter() - decoder.pop_tag(picture))
+            next_time += period
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+        latencies.sort()
+        return throughput, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+    if sys.argv[1] == '--threads':
+        # from the first keyframe, as when the decoder is started by the video thread
+        start = keyframes[0] if keyframes else 0
+        print('%d frames, %d cores' % (len(frames) - start, os.cpu_count()))
+        for thread_type, thread_count in ((THREAD_NONE, 1), (THREAD_SLICE, 0), (THREAD_FRAME, 2), (THREAD_FRAME, 4),
+                                          (THREAD_FRAME, 0)):
+            throughput, median, p95 = threads_benchmark(thread_type, thread_count)
+            print('%-5s %-4s threads: %6.1f frames/s, latency at 30 fps: median %5.1f ms, 95%% %5.1f ms'
+                  % (thread_type, thread_count or 'auto', throughput, median * 1e3, p95 * 1e3))
+    else:
+        t_codec, errors = codec_first_frame()
+        print('%d frames, keyframes at %s, start at frame %d' % (len(frames), keyframes[:5], start))
+        print('codec context: first frame after %.3f s (%d frames rejected)' % (t_codec, errors))
+        t_container = container_first_frame()
+        print('container    : first frame after %s' % ('%.3f s' % t_container if t_container is not None else 'never'))
@@ -0,0 +1,416 @@
+# asyncio client for the Tello drone using the low level protocol
+#
+# The tello_async object talks to the drone with asyncio datagram endpoints instead of
+# blocking threads, so a single event loop can drive several drones (or emulators).
+#
+# Author : S. Delprat, INSA Hauts-de-France
+
+import asyncio
+import datetime
+import logging
+import time
+
+from common.protocol import *
+from common.utils import *
+from common import crc
+from common import video_stream
+from common import video_decoder
+from common.snapshot import SnapshotPublisher
+from common.scheduler import PeriodicScheduler
+from tello_ctrl import tello_ctrlException
+
+
+class _ControlProtocol(asyncio.DatagramProtocol):
+    # receives the packets sent by the drone on the control port
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._process_control_datagram(data)
+
+    def error_received(self, exc):
+        self.client._transport_error(exc)
+
+
+class _VideoProtocol(asyncio.DatagramProtocol):
+    # receives the H.264 stream sent by the drone on the video port
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._process_video_datagram(data)
+
+    def error_received(self, exc):
+        self.client._transport_error(exc)
+
+
+"""The tello_async object is the asyncio counterpart of :class:`~tello_ctrl.tello_ctrl`. The control and video ports
+are served by asyncio datagram endpoints and the stick command is sent by a task of the running event loop,
+so no thread is started per drone.
+
+Telemetry and video frames are obtained with the :meth:`~tello_async.tello_async.telemetry` and
+:meth:`~tello_async.tello_async.frames` async iterators.
+
+:param ip_address: ip adress of the drone, defaults to '192.168.10.1'
+:type ip_address: str, optional
+:param port_out: port for sending command to the drone, defaults to 8889
+:type port_out: int, optional
+:param port_in: local port for receiving data send by the drone, defaults to 9000
+:type port_in: int, optional
+:param video_port: local port for receiving the video stream, defaults to 6038
+:type video_port: int, optional
+:param stick_rate: rate at which the stick command is sent to the drone in Hz, defaults to 50
+:type stick_rate: float, optional
+"""
+class tello_async(object):
+    def __init__(self, ip_address='192.168.10.1', port_out=8889, port_in=9000, video_port=6038, stick_rate=50):
+        self.__LOGGER = logging.getLogger('tello_ctrl')
+
+        self.__address_out = (ip_address, port_out)
+        self.__port_in = port_in
+        self.__video_port = video_port
+
+        if stick_rate<=0:
+            raise ValueError('stick_rate must be strictly positive')
+        self.__stick_scheduler = PeriodicScheduler(1/stick_rate)
+
+        self.__encoder = CommandEncoder()
+        self.__packet_validator = crc.PacketValidator()
+        self.__flight_data = FlightData()
+        # immutable snapshots given to the telemetry iterators (the FlightData object is updated in place)
+        self.__snapshots = SnapshotPublisher(FLIGHT_DATA_NAMES, self.__flight_data)
+        self.__wifi_strength = 0
+
+        self.__transport = None
+        self.__video_transport = None
+        self.__connected = False
+        self.__conn_ack = None
+        self.__first_log_data = None
+        self.__tasks = []
+        self.__video_task = None
+
+        # async iterators queues (and the KeyframeGate of each frame queue)
+        self.__telemetry_queues = []
+        self.__frame_queues = []
+        self.__frame_assembler = None
+
+        # current stick command
+        self.__left_right       = 0
+        self.__forward_backward = 0
+        self.__up_down          = 0
+        self.__yaw              = 0
+        self.__fast_mode        = False
+
+        # video parameters
+        self.__exposure = -9
+        self.__video_encoder_bitrate = 4
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.quit()
+
+    @property
+    def flight_data(self):
+        """This property (read-only) gives the :class:`~common.protocol.FlightData` object updated with the received telemetry."""
+        return self.__flight_data
+
+    @property
+    def is_connected(self):
+        """This property (read-only) indicates wether the connection with the drone is established."""
+        return self.__connected
+
+    async def connect(self, timeout=5):
+        """Establish the connection with the drone and wait for the first telemetry packet.
+
+        :param timeout: The timeout value for establishing the connection, in seconds. Defaults to 5 seconds if not provided.
+        :type timeout: int or float, optional
+        :raises tello_ctrlException: This exception is raised the drone does not respond within the specified timeout interval of time
+
+        """
+        loop = asyncio.get_running_loop()
+        self.__conn_ack = loop.create_future()
+        self.__first_log_data = loop.create_future()
+        self.__transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _ControlProtocol(self), local_addr=('0.0.0.0', self.__port_in))
+
+        self.__LOGGER.debug('Connecting')
+        deadline = loop.time() + timeout
+        while not self.__conn_ack.done():
+            self.__send_conn_req()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                await self.quit()
+                raise tello_ctrlException('Connection timeout')
+            try:
+                await asyncio.wait_for(asyncio.shield(self.__conn_ack), min(1.0, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+        self.__connected = True
+        self.__send_time_command()
+        self.__tasks.append(asyncio.ensure_future(self.__stick_command_task()))
+
+        # wait for the first log packet (so all the variables are available)
+        try:
+            await asyncio.wait_for(asyncio.shield(self.__first_log_data), max(deadline - loop.time(), 0.1))
+        except asyncio.TimeoutError:
+            await self.quit()
+            raise tello_ctrlException('No data received from the drone')
+        self.__LOGGER.debug('End of connection procedure')
+
+    async def quit(self):
+        """Stops the stick command, the video reception and closes the sockets."""
+        self.__connected = False
+        for task in self.__tasks:
+            task.cancel()
+        self.__tasks = []
+        await self.stop_receiving_video()
+        if self.__transport is not None:
+            self.__transport.close()
+            self.__transport = None
+        # end the async iterators
+        for queue in self.__telemetry_queues:
+            self.__put_latest(queue, None)
+
+    async def takeoff(self, blocking=True, timeout=8):
+        """Takeoff tells the drones to liftoff and start flying. When ``blocking`` is True, wait until the end of the takeoff."""
+        self.__LOGGER.info('set altitude limit 30m')
+        pkt = Packet(SET_ALT_LIMIT_CMD)
+        pkt.add_byte(0x1e)  # 30m
+        pkt.add_byte(0x00)
+        pkt.fixup()
+        self.__send_packet(pkt)
+        self.__LOGGER.info('takeoff (cmd=0x%02x)' % (TAKEOFF_CMD))
+        res = self.__send_packet(self.__encoder.build_takeoff())
+        if res and blocking:
+            # fly mode is 11 while taking off
+            await self.__wait_fly_mode(11, timeout)
+        return res
+
+    async def land(self, blocking=True, timeout=5):
+        """Land tells the drone to come in for landing. When ``blocking`` is True, wait until the end of the landing."""
+        self.__LOGGER.info('land (cmd=0x%02x)' % (LAND_CMD))
+        res = self.__send_packet(self.__encoder.build_land())
+        if res and blocking:
+            # fly mode is 12 while landing
+            await self.__wait_fly_mode(12, timeout)
+        return res
+
+    async def __wait_fly_mode(self, transient_mode, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # immediately after sending the packet, the fly_mode may be anything
+        while self.__flight_data.fly_mode != transient_mode and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        while self.__flight_data.fly_mode == transient_mode and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.__flight_data.fly_mode == transient_mode:
+            self.__LOGGER.error('Timeout while waiting the end of fly mode %d' % transient_mode)
+
+    def send_rc_control(self, left_right, forward_backward, up_down, yaw):
+        """Sets the four sticks values. All the value should be in the -100/100 range.
+        Out of range values are clipped.
+        """
+        self.__left_right       = max(-1, min(1, left_right/100))
+        self.__forward_backward = max(-1, min(1, forward_backward/100))
+        self.__up_down          = max(-1, min(1, up_down/100))
+        self.__yaw              = max(-1, min(1, yaw/100))
+
+    def set_fast_mode(self, val):
+        """Set the drone fast mode to the specified value (True/False)."""
+        if not isinstance(val, bool):
+            raise ValueError('Fast mode must be a boolean')
+        self.__fast_mode = val
+
+    def get_stick_command_statistics(self):
+        """Returns the timing statistics of the stick command task, see :meth:`~tello_ctrl.tello_ctrl.get_stick_command_statistics`."""
+        return self.__stick_scheduler.get_statistics()
+
+    def get_packet_statistics(self):
+        """Returns statistics about the packets received from the drone, see :meth:`~tello_ctrl.tello_ctrl.get_packet_statistics`."""
+        return {'checked': self.__packet_validator.checked,
+                'crc_errors': self.__packet_validator.rejected}
+
+    async def start_receiving_video(self):
+        """Requests the video stream and opens the video port. Frames are then obtained with :meth:`frames`."""
+        if self.__video_transport is not None:
+            raise tello_ctrlException('Video reception is already activated')
+        loop = asyncio.get_running_loop()
+        self.__frame_assembler = video_stream.FrameAssembler(self.__LOGGER)
+        self.__video_transport, protocol = await loop.create_datagram_endpoint(
+            lambda: _VideoProtocol(self), local_addr=('0.0.0.0', self.__video_port))
+        self.__send_packet(self.__encoder.build_exposure(self.__exposure))
+        self.__send_packet(self.__encoder.build_bitrate(self.__video_encoder_bitrate))
+        self.__send_packet(self.__encoder.build_start_video())
+        self.__video_task = asyncio.ensure_future(self.__video_refresh_task())
+
+    async def stop_receiving_video(self):
+        """Stops the video reception and ends the :meth:`frames` iterators."""
+        if self.__video_task is not None:
+            self.__video_task.cancel()
+            self.__video_task = None
+        if self.__video_transport is not None:
+            self.__video_transport.close()
+            self.__video_transport = None
+        for queue, gate in self.__frame_queues:
+            self.__put_latest(queue, None)
+
+    async def telemetry(self, queue_size=16):
+        """Async iterator over the telemetry. A snapshot of the sensors is yielded each time a flight data or log data
+        packet has been decoded: it is an immutable named tuple (see :meth:`~tello_ctrl.tello_ctrl.get_snapshot`), so
+        all its values come from the same packet even if the consumer reads it after the next packets.
+        When the consumer is late, the oldest snapshots are dropped.
+
+        :param queue_size: maximum number of pending notifications, defaults to 16.
+        :type queue_size: int
+        """
+        queue = asyncio.Queue(queue_size)
+        self.__telemetry_queues.append(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            self.__telemetry_queues.remove(queue)
+
+    async def frames(self, video_format='rgb24', raw=False, queue_size=4):
+        """Async iterator over the video frames. The video must be started with :meth:`start_receiving_video`.
+        Frames are decoded in the default executor of the event loop, so decoding does not block the loop.
+        The iterator starts at the next IDR frame (the frames received before cannot be decoded), the parameter sets
+        being put before it if needed (see :class:`common.video_stream.KeyframeGate`).
+        When the consumer is late by ``queue_size`` frames, the pending frames are dropped and the iterator restarts
+        at the next IDR frame (the next frames could not be decoded without the dropped ones).
+
+        :param video_format: ``'rgb24'`` or ``'bgr24'``, defaults to ``'rgb24'``.
+        :type video_format: str
+        :param raw: When True, the H.264 frames are yielded as bytes without decoding, defaults to False.
+        :type raw: bool
+        :param queue_size: maximum number of pending raw frames, defaults to 4.
+        :type queue_size: int
+        """
+        if video_format != 'bgr24' and video_format != 'rgb24':
+            raise ValueError('Invalid video_format, should be "bgr24" or "rgb24".')
+        loop = asyncio.get_running_loop()
+        decoder = None if raw else video_decoder.H264Decoder()
+        queue = asyncio.Queue(queue_size)
+        item = (queue, video_stream.KeyframeGate())
+        self.__frame_queues.append(item)
+        try:
+            while True:
+                data = await queue.get()
+                if data is None:
+                    return
+                if raw:
+                    yield data
+                else:
+                    for img in await loop.run_in_executor(None, self.__decode, decoder, data, video_format):
+                        yield img
+        finally:
+            self.__frame_queues.remove(item)
+
+    def __decode(self, decoder, data, video_format):
+        # the decoding errors are counted by the decoder
+        return [frame.to_ndarray(format=video_format) for frame in decoder.decode(data)]
+
+    async def __stick_command_task(self):
+        scheduler = self.__stick_scheduler
+        scheduler.reset()
+        while True:
+            delay = scheduler.next_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            scheduler.wakeup()
+            if self.__connected:
+                self.__send_packet(self.__encoder.build_stick(self.__left_right, self.__forward_backward,
+                                                              self.__up_down, self.__yaw, self.__fast_mode))
+
+    async def __video_refresh_task(self):
+        # Refresh video request every 2 seconds
+        while True:
+            await asyncio.sleep(2)
+            self.__send_packet(self.__encoder.build_start_video())
+
+    def __put_latest(self, queue, item):
+        # drop the oldest item when the consumer is late
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+    def __send_packet(self, pkt):
+        if self.__transport is None:
+            return False
+        self.__transport.sendto(pkt.get_buffer(), self.__address_out)
+        return True
+
+    def __send_conn_req(self):
+        # the video port is sent in little endian (6038 is 0x96 0x17, written 9617 in tello_ctrl)
+        port0, port1 = le16(self.__video_port)
+        buf = 'conn_req:%c%c' % (chr(port0), chr(port1))
+        return self.__send_packet(Packet(buf))
+
+    def __send_time_command(self):
+        pkt = Packet(TIME_CMD, 0x50)
+        pkt.add_byte(0)
+        pkt.add_time(datetime.datetime.now())
+        pkt.fixup()
+        return self.__send_packet(pkt)
+
+    def __send_ack_log(self, id):
+        pkt = Packet(LOG_HEADER_MSG, 0x50)
+        pkt.add_byte(0x00)
+        b0, b1 = le16(id)
+        pkt.add_byte(b0)
+        pkt.add_byte(b1)
+        pkt.fixup()
+        return self.__send_packet(pkt)
+
+    def _transport_error(self, exc):
+        self.__LOGGER.error('tello_async transport error: %s' % str(exc))
+
+    def _process_control_datagram(self, data):
+        if data[0:9] == b'conn_ack:':
+            if self.__conn_ack is not None and not self.__conn_ack.done():
+                self.__conn_ack.set_result(True)
+            return
+
+        if not self.__packet_validator.verify(data):
+            return
+
+        # slices of a memoryview do not copy the datagram
+        data = memoryview(data)
+        cmd = uint16(data[5], data[6])
+        if cmd == LOG_HEADER_MSG:
+            self.__send_ack_log(uint16(data[9], data[10]))
+        elif cmd == LOG_DATA_MSG:
+            self.__flight_data.update_log_message(data[10:], self.__LOGGER)
+            if not self.__first_log_data.done():
+                self.__first_log_data.set_result(True)
+            self.__publish_telemetry()
+        elif cmd == WIFI_MSG:
+            self.__wifi_strength = data[9]
+        elif cmd == FLIGHT_MSG:
+            self.__flight_data.update_fly_message(data[9:])
+            self.__flight_data.wifi_strength = self.__wifi_strength
+            self.__publish_telemetry()
+
+    def __publish_telemetry(self):
+        snapshot = self.__snapshots.publish(self.__flight_data, time.monotonic())
+        for queue in self.__telemetry_queues:
+            self.__put_latest(queue, snapshot)
+
+    def _process_video_datagram(self, data):
+        for frame in self.__frame_assembler.add_packet(data):
+            for queue, gate in self.__frame_queues:
+                if queue.full():
+                    # the next frames reference the dropped ones: restart at the next IDR frame
+                    while not queue.empty():
+                        queue.get_nowait()
+                    gate.reset()
+                gated = gate.process(frame)
+                if gated is not None:
+                    queue.put_nowait(gated)
@@ -19,14 +19,28 @@ import av
 import math
 import os
 import fractions
+import collections
 import cv2
+import numpy as np
+from array import array
 
 from common.protocol import *
 from common.utils import *
 from common.dispatcher import dispatcher, signal
 from common import event
 from common import video_stream
+from common import video_decoder
 from common import state
+from common import crc
+from common.scheduler import PeriodicScheduler
+from common.command_tracker import CommandTracker
+from common.history import TelemetryHistory
+from common.clock_sync import ClockSync
+from common import capture
+from common.data_log import DataLogWriter, DeltaLogWriter
+from common.recording import FRAME_INDEX_COLUMNS, frame_index_file_name
+from common.sensor_view import SensorView
+from common.snapshot import SnapshotPublisher
 
 
 
@@ -44,9 +58,13 @@ This object also provide access to all the measured values and the video.
 :type port_out: int, optional
 param port_in: port for receiving data send by the drone, defaults to 8889
 :type port_in: int, optional
+:param stick_rate: rate at which the stick command is sent to the drone in Hz, defaults to 50
+:type stick_rate: float, optional
+:param history_memory_limit: memory used by the telemetry history in bytes (0 disables the history), defaults to 8MB
+:type history_memory_limit: int, optional
 """
 class tello_ctrl(object):
-    def __init__(self, ip_address='192.168.10.1',port_out=8889, port_in=9000):
+    def __init__(self, ip_address='192.168.10.1',port_out=8889, port_in=9000, stick_rate=50, history_memory_limit=8*1024*1024):
         # timeout values
         
         # logger for debugging
@@ -64,10 +82,14 @@ class tello_ctrl(object):
         self.__DATA_LOGGER_FORMATTER = None
         self.__DATA_LOGGER_FILEHANDLER = None
         self.__DATA_LOGGER_PERIOD = -1
-        self.__DATA_LOGGER_RECORD_ALL=True    # Indicate that all the data needs to be recorded
         self.__DATA_LOGGER_SENSOR_LIST=[]     # List of sensor to be recorded
-        self.__DATA_LOGGER_IS_SENSOR=[]       # True if the corresponding sensor is in self.__sensor_list, false for self.__control_list
-        self.__DATA_LOGGER_SENSOR_IDX=[]      # Sensor index (either in self.__control_list or self.__sensor_list)
+        self.__DATA_LOGGER_BINARY=None        # DataLogWriter (or DeltaLogWriter) used by the binary formats
+        self.__DATA_LOGGER_ROW=None           # Function returning the values of a row
+        self.__DATA_LOGGER_DELAY=0            # Delay of the samples when the sensors are interpolated
+        self.__DATA_LOGGER_SCHEDULER=PeriodicScheduler(1)   # Deadlines of the samples
+        self.__DATA_LOGGER_STOP=threading.Event()
+        self.__DATA_LOGGER_THREAD=None
+        self.__DATA_LOGGER_LAST_ROW=None      # (row number, sample time on the monotonic clock) of the last row
         
         self.__port_in=port_in
         self.__address_in = (ip_address,port_in)
@@ -75,6 +97,28 @@ class tello_ctrl(object):
         
         self.__udpsize = 2000
         
+        # crc check of the received packets
+        self.__packet_validator = crc.PacketValidator()
+        
+        # received packets are dispatched on their message id
+        self.__message_handlers = {LOG_HEADER_MSG: self.__on_log_header,
+                                   LOG_DATA_MSG: self.__on_log_data,
+                                   WIFI_MSG: self.__on_wifi,
+                                   LIGHT_MSG: self.__on_light,
+                                   FLIGHT_MSG: self.__on_flight_data,
+                                   TIME_CMD: self.__on_time,
+                                   VERSION_MSG: self.__on_version,
+                                   ALT_LIMIT_MSG: self.__on_alt_limit,
+                                   ATT_LIMIT_MSG: self.__on_att_limit,
+                                   LOW_BAT_THRESHOLD_MSG: self.__on_low_bat_threshold,
+                                   TELLO_CMD_FILE_SIZE: self.__on_file_size,
+                                   TELLO_CMD_FILE_DATA: self.__on_file_data}
+        for cmd in (TAKEOFF_CMD, LAND_CMD, VIDEO_START_CMD, VIDEO_ENCODER_RATE_CMD, PALM_LAND_CMD,
+                    EXPOSURE_CMD, LOG_CONFIG_MSG, FLIP_CMD):
+            self.__message_handlers[cmd] = self.__on_ack
+        self.__user_message_handlers = {}
+        self.__message_counters = {}
+        
         # Create a dispatcher
         self.__dispatcher=dispatcher()
         
@@ -89,6 +133,10 @@ class tello_ctrl(object):
         self.EVENT_FILE_RECEIVED = event.Event('file received')
         self.EVENT_VIDEO_FRAME = event.Event('video frame')
         self.EVENT_VIDEO_DATA = event.Event('video data')
+        self.EVENT_VERSION = event.Event('version')
+        self.EVENT_ALT_LIMIT = event.Event('altitude limit')
+        self.EVENT_ATT_LIMIT = event.Event('attitude limit')
+        self.EVENT_LOW_BAT_THRESHOLD = event.Event('low battery threshold')
         
         # internal custom events
         self.__EVENT_CONN_REQ = event.Event('conn_req')
@@ -109,6 +157,22 @@ class tello_ctrl(object):
         # boolean state variables
         self.__flight_data = FlightData()
         self.__wifi_strength = 0.0
+        
+        # history of the decoded telemetry
+        self.__history = None
+        self.__receive_time = None
+        # sensor time of the log records, estimated from the drone ticks
+        self.__clock_sync = ClockSync()
+        self.set_history_memory_limit(history_memory_limit)
+        
+        # raw datagram capture
+        self.__capture = None
+        
+        # values reported by the drone (None until received)
+        self.__firmware_version = None
+        self.__alt_limit = None
+        self.__att_limit = None
+        self.__low_bat_threshold = None
 
         # buffer for file reception
         self.__file_recv={}
@@ -118,6 +182,20 @@ class tello_ctrl(object):
         self.__conected=threading.Event()
         
         
+        # preallocated packets for the commands sent on the control path
+        self.__encoder = CommandEncoder()
+        # the command templates are built and sent by the user and video threads (the stick template is only used by
+        # the stick command thread)
+        self.__command_lock = threading.Lock()
+        
+        # sequence numbers, acks and retransmissions of the commands
+        self.__command_tracker = CommandTracker()
+        
+        # stick commands are sent at a fixed rate by a dedicated thread
+        if stick_rate<=0:
+            raise ValueError('stick_rate must be strictly positive')
+        self.__stick_scheduler = PeriodicScheduler(1/stick_rate)
+        
         # current stick command
         self.__left_right          = 0
         self.__forward_backward    = 0
@@ -129,12 +207,15 @@ class tello_ctrl(object):
         # Video parameters
         self.__exposure = -9
         self.__video_encoder_bitrate = 4
-        self.__pkt_seq_num = 0x01e4
         self.__video_enabled = False
         self.__zoom = False
         self.__video_stream=None
+        self.__video_gate=video_stream.KeyframeGate()   # keeps the parameter sets between the video receptions
+        self.__last_video_stream=None      # VideoStream of the last video reception (statistics)
+        self.__frame_assembler=None        # FrameAssembler of the last video reception (loss counters)
         self.__frame=None
-        self.__stream_container = None
+        self.__video_decoder = None
+        self.__last_video_decoder = None    # H264Decoder of the last video reception (statistics)
         self.__downsample_factor = 1
         self.__video_format='rgb24'
         self.__noframe = -1
@@ -158,12 +239,26 @@ class tello_ctrl(object):
         self.__recording_enabled = False
         self.__recording_container = None
         self.__recording_stream = None
+        self.__recording_index = None       # DataLogWriter of the frame index
         
         
                     
-        """ provide the sensors index given the sensor names (we need to exclude a few attribute from the __flight_data object)"""
-        self.__sensor_list = [attr for attr in dir(self.__flight_data) if not callable(getattr(self.__flight_data, attr)) and not attr.startswith('__') and not attr.startswith('ID') and attr!='unknowns_log_msg']
+        # the sensors are declared by FLIGHT_DATA_SCHEMA
+        self.__sensor_list = list(FLIGHT_DATA_NAMES)
         self.__control_list=['left_right','forward_backward','up_down','yaw','fast_mode']
+        # index of each name in get_sensor_list() (the sensors take precedence over the controls with the
+        # same name, e.g. yaw) and attribute and scale of the controls (stick control are in the -1/1 range,
+        # -100/100 for the user)
+        self.__sensor_index={name: i+len(self.__sensor_list) for i, name in enumerate(self.__control_list)}
+        self.__sensor_index.update({name: i for i, name in enumerate(self.__sensor_list)})
+        self.__control_attributes={name: ('_tello_ctrl__'+name, 100 if i<4 else 1) for i, name in enumerate(self.__control_list)}
+        
+        # immutable snapshot of the sensors published after each decoded telemetry packet
+        self.__snapshots=SnapshotPublisher(self.__sensor_list, self.__flight_data)
+        
+        # views used by the bulk getters, by tuple of names (the least recently used one is removed above
+        # 64 lists of names)
+        self.__sensor_views=collections.OrderedDict()
         
 
         
@@ -185,6 +280,9 @@ class tello_ctrl(object):
         self.__LOGGER.debug('Starting thread')
         threading.Thread(target=self.__data_reception_thread,daemon=True).start()
         
+        # Stick command thread
+        threading.Thread(target=self.__stick_command_thread,daemon=True).start()
+        
         self.__LOGGER.debug('Connecting')
         self.__send_conn_req()
         
@@ -335,25 +433,21 @@ class tello_ctrl(object):
     def __data_reception_thread(self):
         sock = self.__sock
         self.__LOGGER.debug("Starting reception thread")
+        
+        # datagrams are received in a preallocated buffer and handed over as memoryview slices
+        # (handlers must copy what they keep after returning)
+        buffer = bytearray(self.__udpsize)
+        buffer_view = memoryview(buffer)
 
    
-        time_data_logging=time.time()
-        tStart=time.time()
         while self.__state != self.STATE_QUIT:
-            if self.__state == self.STATE_CONNECTED:
-                self.__send_stick_command()  # ignore errors
-
             try:
-                data, server = sock.recvfrom(self.__udpsize)
-                #self.__LOGGER.debug("recv: %s" % byte_to_hexstring(data))
-                self.__process_packet(data)
-                
-                now=time.time()
-               
-
-                if self.__DATA_LOGGER_PERIOD>0 and now-time_data_logging>self.__DATA_LOGGER_PERIOD:
-                    self.data_logging_request()
-                    time_data_logging=now
+                nbytes, server = sock.recvfrom_into(buffer)
+                self.__receive_time = time.monotonic()
+                if self.__capture is not None:
+                    self.__capture.write(capture.CHANNEL_CONTROL, self.__receive_time, buffer_view[:nbytes])
+                #self.__LOGGER.debug("recv: %s" % byte_to_hexstring(buffer_view[:nbytes]))
+                self.__process_packet(buffer_view[:nbytes])
                     
             except socket.timeout as ex:
                 if self.__state == self.STATE_CONNECTED:
@@ -367,50 +461,130 @@ class tello_ctrl(object):
         
         self.__LOGGER.debug('End of drone reception')
     
-   
+    def __stick_command_thread(self):
+        # The stick command is sent on monotonic deadlines so the actuation rate
+        # does not depend on the packets received from the drone
+        self.__LOGGER.debug("Starting stick command thread")
+        scheduler = self.__stick_scheduler
+        scheduler.reset()
+        while self.__state != self.STATE_QUIT:
+            scheduler.wait()
+            if self.__state == self.STATE_CONNECTED:
+                self.__send_stick_command()  # ignore errors
+                # send again the commands that were not acknowledged in time
+                for buffer in self.__command_tracker.poll():
+                    self.__send_packet(Packet(buffer))
+        
+        self.__LOGGER.debug('End of stick command thread')
+    
+    def set_stick_command_rate(self, rate):
+        """Sets the rate at which the stick command is sent to the drone. Typical values are in the 20-100 Hz range.
+        
+        :param rate: Stick command rate in Hz.
+        :type rate: float
+        :raise ValueError: An exception is raised if the rate is not strictly positive.
+        
+        """
+        if rate<=0:
+            raise ValueError('rate must be strictly positive')
+        self.__LOGGER.info('set_stick_command_rate(rate=%.1f)' % rate)
+        self.__stick_scheduler.set_period(1/rate)
+        
+    def get_packet_statistics(self):
+        """Returns statistics about the packets received from the drone on the control port.
+        The dictionnary contains:
+        
+            * ``checked`` : number of packets whose crc was checked
+            * ``crc_errors`` : number of packets rejected because of an invalid size or crc
+            * ``messages`` : dictionnary giving the number of valid packets received for each message id
+        
+        :return: The packet statistics.
+        :rtype: dict
+        
+        """
+        return {'checked': self.__packet_validator.checked,
+                'crc_errors': self.__packet_validator.rejected,
+                'messages': dict(self.__message_counters)}
+        
+    def get_stick_command_statistics(self):
+        """Returns the timing statistics of the stick command sender since the connection.
+        The dictionnary contains:
+        
+            * ``count`` : number of stick command deadlines
+            * ``missed`` : number of deadlines skipped because the sender was late by more than one period
+            * ``period`` : requested period in seconds
+            * ``interval_mean``, ``interval_min``, ``interval_max`` : measured interval between two sends in seconds
+            * ``jitter`` : standard deviation of the interval between two sends in seconds
+            * ``lateness_mean``, ``lateness_max`` : delay between the deadline and the actual send in seconds
+        
+        :return: The stick command timing statistics.
+        :rtype: dict
+        
+        """
+        return self.__stick_scheduler.get_statistics()
         
     def set_slow_mode(self):
         self.__LOGGER.info('set_slow_mode')
         self.__fast_mode = False
         
     def __send_stick_command(self):
-        pkt = Packet(STICK_CMD, 0x60)
-
-        axis1 = int(1024 + 660.0 * self.__left_right) & 0x7ff
-        axis2 = int(1024 + 660.0 * self.__forward_backward) & 0x7ff
-        axis3 = int(1024 + 660.0 * self.__up_down) & 0x7ff
-        axis4 = int(1024 + 660.0 * self.__yaw) & 0x7ff
-        axis5 = int(self.__fast_mode) & 0x01        
-
-        '''
-        11 bits (-1024 ~ +1023) x 4 axis = 44 bits
-        fast_mode takes 1 bit        
-        44 bits will be packed in to 6 bytes (48 bits)
-
-                    axis4      axis3      axis2      axis1
-             |          |          |          |          |
-                 4         3         2         1         0
-        98765432109876543210987654321098765432109876543210
-         |       |       |       |       |       |       |
-             byte5   byte4   byte3   byte2   byte1   byte0
-        '''
-        #self.__LOGGER.debug("stick command: fast=%d yalrw=%4d ud=%4d fb=%4d rol=%4d" %
-        #          (axis5, axis4, axis3, axis2, axis1))
-        packed = axis1 | (axis2 << 11) | (
-            axis3 << 22) | (axis4 << 33) | (axis5 << 44)
-        
-        packed_bytes = struct.pack('<Q', packed)
-        pkt.add_byte(byte(packed_bytes[0]))
-        pkt.add_byte(byte(packed_bytes[1]))
-        pkt.add_byte(byte(packed_bytes[2]))
-        pkt.add_byte(byte(packed_bytes[3]))
-        pkt.add_byte(byte(packed_bytes[4]))
-        pkt.add_byte(byte(packed_bytes[5]))
-        pkt.add_time()
-        pkt.fixup()
+        # the stick packet layout is documented in CommandEncoder.build_stick
+        pkt = self.__encoder.build_stick(self.__left_right, self.__forward_backward,
+                                         self.__up_down, self.__yaw, self.__fast_mode)
         #self.__LOGGER.debug("stick command: %s" % byte_to_hexstring(pkt.get_buffer()))
         return self.__send_packet(pkt)
                
+    def __send_command(self, cmd, seq_num, build, *args, retries=None):
+        # builds the command with build(*args, seq_num=seq_num), sends it and keeps it until the ack is received.
+        # The packet templates of the encoder are shared by the user and video threads: the template is locked
+        # until the packet is sent and copied by the command tracker
+        with self.__command_lock:
+            pkt = build(*args, seq_num=seq_num)
+            res = self.__send_packet(pkt)
+            if res:
+                self.__command_tracker.register(cmd, seq_num, pkt.get_buffer(), retries)
+        return res
+        
+    def __send_keep_alive(self, build, *args):
+        # sends a command repeated periodically (video request): it is not tracked, so it is neither retransmitted
+        # nor counted in the command statistics, and its sequence number 0 makes the tracker ignore its ack
+        with self.__command_lock:
+            return self.__send_packet(build(*args, seq_num=0))
+        
+    def set_command_retries(self, retries, timeout=0.3, backoff=2.0):
+        """Sets how the commands acknowledged by the drone (takeoff, land, video settings...) are sent again when the
+        ack is not received in time. Flips are never sent again. By default, the commands are not sent again.
+        
+        :param retries: Maximum number of retransmissions of a command.
+        :type retries: int
+        :param timeout: Time to wait for the ack before the first retransmission in seconds, defaults to 0.3.
+        :type timeout: float, optional
+        :param backoff: Factor applied to the timeout after each retransmission, defaults to 2.
+        :type backoff: float, optional
+        :raise ValueError: An exception is raised if a parameter is out of range.
+        
+        """
+        self.__LOGGER.info('set_command_retries(retries=%d, timeout=%.3f, backoff=%.1f)' % (retries, timeout, backoff))
+        self.__command_tracker.configure(retries, timeout, backoff)
+        
+    def get_command_statistics(self):
+        """Returns statistics about the commands acknowledged by the drone. The dictionnary has an entry per command id
+        (e.g. ``TAKEOFF_CMD``), each entry being a dictionnary containing:
+        
+            * ``sent`` : number of commands sent (without the retransmissions)
+            * ``acked`` : number of commands acknowledged by the drone
+            * ``retransmitted`` : number of retransmissions
+            * ``lost`` : number of commands never acknowledged
+            * ``unmatched_acks`` : number of acks received while no command with this id was pending
+            * ``rtt_mean``, ``rtt_min``, ``rtt_max`` : round trip time in seconds (``None`` until measured)
+            * ``rtt_histogram`` : number of round trip times in each bin of :data:`common.command_tracker.RTT_HISTOGRAM_EDGES`
+        
+        :return: The command statistics.
+        :rtype: dict
+        
+        """
+        return self.__command_tracker.get_statistics()
+        
     def __send_packet(self, pkt):
         """Send_packet is used to send a command packet to the drone."""
         try:
@@ -431,86 +605,167 @@ class tello_ctrl(object):
         if isinstance(data, str):
             data = bytearray([x for x in data])
 
-        if str(data[0:9]) == 'conn_ack:' or data[0:9] == b'conn_ack:':
-            self.__LOGGER.info('connected. (port=%2x%2x)' % (data[9], data[10]))
-            self.__LOGGER.debug('    %s' % byte_to_hexstring(data))
-            self.__publish(self.__EVENT_CONN_ACK, data)
-            return True
-
         if data[0] != START_OF_PACKET:
+            if data[0:9] == b'conn_ack:':
+                self.__LOGGER.info('connected. (port=%2x%2x)' % (data[9], data[10]))
+                self.__LOGGER.debug('    %s' % byte_to_hexstring(data))
+                self.__publish(self.__EVENT_CONN_ACK, bytes(data))
+                return True
             self.__LOGGER.info('start of packet != %02x (%02x) (ignored)' % (START_OF_PACKET, data[0]))
             self.__LOGGER.info('    %s' % byte_to_hexstring(data))
-            self.__LOGGER.info('    %s' % str(map(chr, data))[1:-1])
+            return False
+        
+        if not self.__packet_validator.verify(data):
+            self.__LOGGER.debug('data_reception_thread: invalid crc (ignored): %s' % byte_to_hexstring(data))
             return False
 
-        pkt = Packet(data)
         cmd = uint16(data[5], data[6])
+        self.__message_counters[cmd] = self.__message_counters.get(cmd, 0) + 1
         
-        if cmd == LOG_HEADER_MSG:
-            id = uint16(data[9], data[10])
-            #self.__LOGGER.info("data_reception_thread: log_header: id=%04x, '%s'" % (id, str(data[28:54])))
-            #self.__LOGGER.debug("data_reception_thread: log_header: %s" % byte_to_hexstring(data[9:]))
-            self.__send_ack_log(id)
-            #self.__publish(event=self.EVENT_LOG_HEADER, data=data[9:])
-            
-                
-        elif cmd == LOG_DATA_MSG:
-            # This is one of the most interesting message
-            self.__flight_data.update_log_message(data[10:],self.__LOGGER)
-            self.__flight_data_received = True
-            
-        elif cmd == WIFI_MSG:
-            #self.__LOGGER.debug("data_reception_thread: wifi: %s" % byte_to_hexstring(data[9:]))
-            self.__wifi_strength = data[9]
-            self.__publish(event=self.EVENT_WIFI, data=data[9:])
-       
-        elif cmd == LIGHT_MSG:
-            #self.__LOGGER.debug("data_reception_thread: light: %s" % byte_to_hexstring(data[9:]))
-            self.__publish(event=self.EVENT_LIGHT, data=data[9:])
-        
-        elif cmd == FLIGHT_MSG:
-            self.__flight_data.update_fly_message(data[9:])
-            self.__flight_data.wifi_strength = self.__wifi_strength
-            #self.__LOGGER.debug("data_reception_thread: flight data: %s" % str(self.__flight_data))
-            self.__publish(event=self.EVENT_FLIGHT_DATA, data=self.__flight_data)
-            
-        elif cmd == TIME_CMD:
-            #self.__LOGGER.debug("data_reception_thread: time data: %s" % byte_to_hexstring(data))
-            self.__publish(event=self.EVENT_TIME, data=data[7:9])
-        
-        elif cmd in (TAKEOFF_CMD, LAND_CMD, VIDEO_START_CMD, VIDEO_ENCODER_RATE_CMD, PALM_LAND_CMD,
-                     EXPOSURE_CMD, LOG_CONFIG_MSG):
-            pass
-            #self.__LOGGER.info("data_reception_thread: ack: cmd=0x%02x seq=0x%04x %s" %
-            #         (uint16(data[5], data[6]), uint16(data[7], data[8]), byte_to_hexstring(data)))
-        elif cmd == TELLO_CMD_FILE_SIZE:
-            # Drone is about to send us a file. Get ready.
-            # N.b. one of the fields in the packet is a file ID; by demuxing
-            # based on file ID we can receive multiple files at once. This
-            # code doesn't support that yet, though, so don't take one photo
-            # while another is still being received.
-            self.__LOGGER.info("data_reception_thread: file size: %s" % byte_to_hexstring(data))
-            if len(pkt.get_data()) >= 7:
-                (size, filenum) = struct.unpack('<xLH', pkt.get_data())
-                self.__LOGGER.info('      file size: num=%d bytes=%d' % (filenum, size))
-                # Initialize file download state.
-                self.__file_recv[filenum] = DownloadedFile(filenum, size)
-            else:
-                # We always seem to get two files, one with most of the payload missing.
-                # Not sure what the second one is for.
-                self.__LOGGER.warn('      file size: payload too small: %s' % byte_to_hexstring(pkt.get_data()))
-            # Ack the packet.
-            self.__send_packet(pkt)
-        elif cmd == TELLO_CMD_FILE_DATA:
-            # self.__LOGGERinfo("data_reception_thread: file data: %s" % byte_to_hexstring(data[9:21]))
-            # Drone is sending us a fragment of a file it told us to prepare
-            # for earlier.
-            self.recv_file_data(pkt.get_data())
-        else:
+        handler = self.__message_handlers.get(cmd)
+        user_handlers = self.__user_message_handlers.get(cmd)
+        if handler is None and user_handlers is None:
             self.__LOGGER.debug('data_reception_thread: unknown packet: %04x %s' % (cmd, byte_to_hexstring(data)))
             return False
-
+        
+        if handler is not None:
+            handler(data)
+        if user_handlers is not None:
+            for (user_handler, decoder) in user_handlers:
+                if decoder is None:
+                    user_handler(cmd, bytes(data[9:]))
+                else:
+                    user_handler(cmd, decoder(data[9:]))
         return True
+    
+    def __on_log_header(self, data):
+        id = uint16(data[9], data[10])
+        #self.__LOGGER.info("data_reception_thread: log_header: id=%04x, '%s'" % (id, str(data[28:54])))
+        #self.__LOGGER.debug("data_reception_thread: log_header: %s" % byte_to_hexstring(data[9:]))
+        self.__send_ack_log(id)
+        #self.__publish(event=self.EVENT_LOG_HEADER, data=data[9:])
+        
+    def __on_log_data(self, data):
+        # This is one of the most interesting message
+        self.__flight_data.update_log_message(data[10:],self.__LOGGER,self.__history,self.__receive_time,self.__clock_sync)
+        self.__snapshots.publish(self.__flight_data,self.__receive_time)
+        self.__flight_data_received = True
+        
+    def __on_wifi(self, data):
+        #self.__LOGGER.debug("data_reception_thread: wifi: %s" % byte_to_hexstring(data[9:]))
+        self.__wifi_strength = data[9]
+        self.__publish(event=self.EVENT_WIFI, data=bytes(data[9:]))
+        
+    def __on_light(self, data):
+        #self.__LOGGER.debug("data_reception_thread: light: %s" % byte_to_hexstring(data[9:]))
+        self.__publish(event=self.EVENT_LIGHT, data=bytes(data[9:]))
+        
+    def __on_flight_data(self, data):
+        self.__flight_data.update_fly_message(data[9:],self.__history,self.__receive_time)
+        # the snapshot holds the values of this packet, including the last wifi strength
+        self.__flight_data.wifi_strength = self.__wifi_strength
+        self.__snapshots.publish(self.__flight_data,self.__receive_time)
+        #self.__LOGGER.debug("data_reception_thread: flight data: %s" % str(self.__flight_data))
+        self.__publish(event=self.EVENT_FLIGHT_DATA, data=self.__flight_data)
+        
+    def __on_time(self, data):
+        #self.__LOGGER.debug("data_reception_thread: time data: %s" % byte_to_hexstring(data))
+        self.__publish(event=self.EVENT_TIME, data=bytes(data[7:9]))
+        
+    def __on_ack(self, data):
+        cmd = uint16(data[5], data[6])
+        seq_num = uint16(data[7], data[8])
+        rtt = self.__command_tracker.acknowledge(cmd, seq_num)
+        #self.__LOGGER.info("data_reception_thread: ack: cmd=0x%02x seq=0x%04x rtt=%s %s" %
+        #         (cmd, seq_num, rtt, byte_to_hexstring(data)))
+        
+    def __on_version(self, data):
+        self.__firmware_version = decode_version(data[9:])
+        self.__publish(event=self.EVENT_VERSION, data=self.__firmware_version)
+        
+    def __on_alt_limit(self, data):
+        self.__alt_limit = decode_alt_limit(data[9:])
+        self.__publish(event=self.EVENT_ALT_LIMIT, data=self.__alt_limit)
+        
+    def __on_att_limit(self, data):
+        self.__att_limit = decode_att_limit(data[9:])
+        self.__publish(event=self.EVENT_ATT_LIMIT, data=self.__att_limit)
+        
+    def __on_low_bat_threshold(self, data):
+        self.__low_bat_threshold = decode_low_bat_threshold(data[9:])
+        self.__publish(event=self.EVENT_LOW_BAT_THRESHOLD, data=self.__low_bat_threshold)
+        
+    def __on_file_size(self, data):
+        # Drone is about to send us a file. Get ready.
+        # N.b. one of the fields in the packet is a file ID; by demuxing
+        # based on file ID we can receive multiple files at once. This
+        # code doesn't support that yet, though, so don't take one photo
+        # while another is still being received.
+        self.__LOGGER.info("data_reception_thread: file size: %s" % byte_to_hexstring(data))
+        pkt = Packet(data)
+        if len(pkt.get_data()) >= 7:
+            (size, filenum) = struct.unpack('<xLH', pkt.get_data())
+            self.__LOGGER.info('      file size: num=%d bytes=%d' % (filenum, size))
+            # Initialize file download state.
+            self.__file_recv[filenum] = DownloadedFile(filenum, size)
+        else:
+            # We always seem to get two files, one with most of the payload missing.
+            # Not sure what the second one is for.
+            self.__LOGGER.warn('      file size: payload too small: %s' % byte_to_hexstring(pkt.get_data()))
+        # Ack the packet.
+        self.__send_packet(pkt)
+        
+    def __on_file_data(self, data):
+        # self.__LOGGERinfo("data_reception_thread: file data: %s" % byte_to_hexstring(data[9:21]))
+        # Drone is sending us a fragment of a file it told us to prepare
+        # for earlier.
+        pkt = Packet(data)
+        self.recv_file_data(pkt.get_data())
+        
+    def register_message_handler(self, cmd, handler, decoder=None):
+        """Registers a handler for the packets with the message id ``cmd`` (see the ``*_MSG`` constants of
+        :mod:`common.protocol`). The handler is called from the reception thread as ``handler(cmd, value)``, after
+        the built-in processing of the message, if any. Several handlers can be registered for the same message id.
+        
+        :param cmd: Message id.
+        :type cmd: int
+        :param handler: Function called when a packet with this message id is received.
+        :type handler: callable
+        :param decoder: Function that converts the payload of the packet (the bytes after the sequence number) into ``value``.
+            If None, the decoder of :data:`common.protocol.MESSAGE_DECODERS` is used when available, otherwise ``value`` is the raw payload (bytes).
+        :type decoder: callable, optional
+        
+        """
+        if not callable(handler):
+            raise ValueError('handler must be callable')
+        if decoder is None:
+            decoder = MESSAGE_DECODERS.get(cmd)
+        self.__LOGGER.info('register_message_handler(cmd=0x%04x)' % cmd)
+        # the table is replaced (not modified) so the reception thread never sees a partial update
+        user_message_handlers = dict(self.__user_message_handlers)
+        user_message_handlers[cmd] = user_message_handlers.get(cmd, ()) + ((handler, decoder),)
+        self.__user_message_handlers = user_message_handlers
+        
+    def unregister_message_handler(self, cmd, handler):
+        """Removes a handler registered with :meth:`register_message_handler`.
+        
+        :param cmd: Message id.
+        :type cmd: int
+        :param handler: The handler to remove.
+        :type handler: callable
+        :raise ValueError: An exception is raised if the handler is not registered for this message id.
+        
+        """
+        handlers = self.__user_message_handlers.get(cmd, ())
+        remaining = tuple((h, d) for (h, d) in handlers if h != handler)
+        if len(remaining) == len(handlers):
+            raise ValueError('handler is not registered for message 0x%04x' % cmd)
+        user_message_handlers = dict(self.__user_message_handlers)
+        if remaining:
+            user_message_handlers[cmd] = remaining
+        else:
+            del user_message_handlers[cmd]
+        self.__user_message_handlers = user_message_handlers
         
     def takeoff(self, blocking=True, timeout=8):
         """Takeoff tells the drones to liftoff and start flying."""
@@ -518,11 +773,11 @@ class tello_ctrl(object):
         pkt = Packet(SET_ALT_LIMIT_CMD)
         pkt.add_byte(0x1e)  # 30m
         pkt.add_byte(0x00)
+        pkt.fixup(self.__command_tracker.next_seq_num())
         self.__send_packet(pkt)
-        self.__LOGGER.info('takeoff (cmd=0x%02x seq=0x%04x)' % (TAKEOFF_CMD, self.__pkt_seq_num))
-        pkt = Packet(TAKEOFF_CMD)
-        pkt.fixup()
-        res=self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('takeoff (cmd=0x%02x seq=0x%04x)' % (TAKEOFF_CMD, seq_num))
+        res=self.__send_command(TAKEOFF_CMD, seq_num, self.__encoder.build_takeoff)
         if res and blocking:
             # wait for take off: as the command takes time to be executed, 
             # fly mode may be 6 for a while
@@ -559,11 +814,9 @@ class tello_ctrl(object):
   
     def land(self, blocking = True,timeout=5):
         """Land tells the drone to come in for landing."""
-        self.__LOGGER.info('land (cmd=0x%02x seq=0x%04x)' % (LAND_CMD, self.__pkt_seq_num))
-        pkt = Packet(LAND_CMD)
-        pkt.add_byte(0x00)
-        pkt.fixup()
-        res= self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('land (cmd=0x%02x seq=0x%04x)' % (LAND_CMD, seq_num))
+        res= self.__send_command(LAND_CMD, seq_num, self.__encoder.build_land)
         
         if res and blocking:
             # wait for fly mode to be 12 (immediately after sending the packet,
@@ -649,15 +902,7 @@ class tello_ctrl(object):
         if not isinstance(sensor_names,(list,tuple)):
             sensor_names=[sensor_names]
 
-        index=[]
-        for name in sensor_names: 
-            if name in self.__sensor_list :
-                index.append(self.__sensor_list.index(name))
-            elif name in self.__control_list:
-                index.append(self.__control_list.index(name)+len(self.__sensor_list))
-            else:
-                index.append(-1)
-        return  index
+        return [self.__sensor_index.get(name, -1) for name in sensor_names]
         
     def get_sensor_list(self):
         """Returns the list of all available sensors (it also contains stick control values).
@@ -668,6 +913,214 @@ class tello_ctrl(object):
         """
         return self.__sensor_list + self.__control_list
         
+    def get_sensor_schema(self):
+        """Returns the description of the sensors and controls, in the order of :meth:`~tello_ctrl.tello_ctrl.get_sensor_list`.
+        Each entry is a named tuple ``(name, dtype, unit, message)``: ``dtype`` is the type of the value (a numpy type name),
+        ``unit`` its unit (empty when unknown) and ``message`` the message updating the value (``'flight'``, ``'mvo'``, ``'imu'``,
+        ``'imu_ext'``, ``None`` if the value is not decoded, ``'control'`` for the controls).
+        
+        :return: The list of sensor descriptions.
+        :rtype: [SensorField]
+        
+        """
+        return list(FLIGHT_DATA_SCHEMA) + [SensorField('left_right', 'float64', '%', 'control'),
+                                           SensorField('forward_backward', 'float64', '%', 'control'),
+                                           SensorField('up_down', 'float64', '%', 'control'),
+                                           SensorField('yaw', 'float64', '%', 'control'),
+                                           SensorField('fast_mode', 'bool', '', 'control')]
+        
+    def get_sensor_record(self, out=None):
+        """Returns the last snapshot of the sensors (see :meth:`~tello_ctrl.tello_ctrl.get_snapshot`) as a numpy structured array
+        of one element, the fields having the types of :meth:`~tello_ctrl.tello_ctrl.get_sensor_schema`. The values are packed
+        in a single call into the array, e.g. ``record['posX'][0]``. The controls are not included.
+        
+        :param out: Array receiving the values (``numpy.zeros(1, dtype=FLIGHT_DATA_DTYPE)``), defaults to None (a new array).
+        :type out: numpy.ndarray, optional
+        :return: The structured array.
+        :rtype: numpy.ndarray
+        
+        """
+        if out is None:
+            out=np.zeros(1, dtype=FLIGHT_DATA_DTYPE)
+        # the snapshot starts with its sequence number and timestamp, then the sensors in the schema order
+        FLIGHT_DATA_STRUCT.pack_into(out, 0, *self.__snapshots.current[2:])
+        return out
+        
+    def make_sensor_view(self, names=[]):
+        """Creates a view on a fixed list of sensors (or controls). The names are resolved once, so reading the
+        values of the view is much faster than calling :meth:`~tello_ctrl.tello_ctrl.get_sensor_values_by_name`
+        repeatedly with the same names:
+        
+            * ``view.values()`` returns a tuple of the current values
+            * ``view.read(out=None)`` copies the current values into a float64 array, either ``out`` or an array
+              preallocated by the view (returned, and overwritten by the next call)
+            * ``view.index`` gives the position of each name in the values
+        
+        The views stay valid until the object is destroyed.
+        
+        :param names: List of sensor names, defaults to ``[]`` (all the known values).
+        :type names: [str]
+        :return: The view.
+        :rtype: :class:`common.sensor_view.SensorView`
+        :raise ValueError: An exception if raised if sensor or control name is not valid. 
+        
+        """
+        if not isinstance(names,(list,tuple)):
+            names=[names]
+        if len(names)==0:
+            names=self.get_sensor_list()
+        return self.__make_sensor_view(names)
+        
+    def __make_sensor_view(self, names):
+        all_names=self.get_sensor_list()
+        if list(names)==all_names:
+            # the names of the controls shared with a sensor are resolved by their position
+            is_control=[i>=len(self.__sensor_list) for i in range(len(all_names))]
+        else:
+            is_control=[]
+            for name in names:
+                if name not in self.__sensor_index:
+                    raise ValueError('%s is not a valid sensor or control name'%(name))
+                is_control.append(self.__sensor_index[name]>=len(self.__sensor_list))
+        return SensorView(names, self.__flight_data, self, self.__control_attributes, is_control)
+        
+    def get_sensor_values_array(self, names=[], array_type='numpy', copy=True):
+        """Sends the requested sensor (or control) values as a float64 buffer, which Matlab converts in a single
+        transfer (``double(...)``), instead of a list of mixed int/float/bool values. The names are resolved once
+        for each list of names (see :meth:`~tello_ctrl.tello_ctrl.make_sensor_view`); the views of the last 64 lists
+        of names are kept.
+        
+        :param names: List of sensor names, defaults to ``[]`` (all the known values, in the order of :meth:`~tello_ctrl.tello_ctrl.get_sensor_list`).
+        :type names: [str]
+        :param array_type: ``"numpy"`` for a ``numpy.ndarray`` or ``"array"`` for an ``array.array('d')``, defaults to ``"numpy"``.
+        :type array_type: str
+        :param copy: ``array_type="numpy"`` only: if False, the values are written in the preallocated buffer of the view, which is overwritten by the next call with the same names (no allocation, e.g. when Matlab converts the result immediately), defaults to True.
+        :type copy: bool
+        :return: The sensor values.
+        :rtype: numpy.ndarray or array.array
+        :raise ValueError: An exception if raised if sensor or control name or the array type is not valid.
+        
+        """
+        if not isinstance(names,(list,tuple)):
+            names=[names]
+        key=tuple(names)
+        views=self.__sensor_views
+        view=views.get(key)
+        if view is None:
+            view=self.make_sensor_view(list(names))
+            if len(views)>=64:
+                views.popitem(last=False)
+            views[key]=view
+        else:
+            views.move_to_end(key)
+        if array_type=='numpy':
+            return view.read(np.empty(len(view)) if copy else None)
+        elif array_type=='array':
+            return array('d', view.values())
+        raise ValueError('array_type must be "numpy" or "array", not %s.' % (array_type))
+        
+    def get_last_samples(self, names, count, array_type='numpy'):
+        """Returns the last ``count`` samples of the requested sensors, taken from the telemetry history (see
+        :meth:`~tello_ctrl.tello_ctrl.get_history`), as a single float64 buffer. A sample is taken each time the message
+        updating the first sensor is received; the other sensors are given their last value received at this time.
+        
+        With ``array_type="numpy"``, the result is an array of shape (number of samples, 1 + number of names), the first
+        column being the receive time (``time.monotonic()``), the oldest sample first. With ``array_type="array"``, the
+        same values are flattened row by row in an ``array.array('d')``.
+        
+        :param names: List of sensor names.
+        :type names: [str]
+        :param count: Maximum number of samples.
+        :type count: int
+        :param array_type: ``"numpy"`` or ``"array"``, defaults to ``"numpy"``.
+        :type array_type: str
+        :return: The samples.
+        :rtype: numpy.ndarray or array.array
+        :raise tello_ctrlException: An exception is raised if the history is disabled.
+        :raise ValueError: An exception is raised if a sensor is not stored in the history or if the array type is not valid.
+        
+        """
+        if array_type!='numpy' and array_type!='array':
+            raise ValueError('array_type must be "numpy" or "array", not %s.' % (array_type))
+        if self.__history is None:
+            raise tello_ctrlException('The telemetry history is disabled')
+        samples=self.__history.get_last(names, count)
+        if array_type=='array':
+            return array('d', samples.tobytes())
+        return samples
+        
+    def __get_sensor_value(self, idx):
+        # idx is the index in get_sensor_list()
+        if idx<len(self.__sensor_list):
+            return getattr(self.__flight_data,self.__sensor_list[idx])
+        (attribute, scale)=self.__control_attributes[self.__control_list[idx-len(self.__sensor_list)]]
+        val=getattr(self,attribute)
+        if scale!=1:
+            val=val*scale
+        return val
+        
+    def set_history_memory_limit(self, memory_limit):
+        """Sets the memory used by the telemetry history. The history is cleared.
+        
+        :param memory_limit: Memory used by the history in bytes, 0 disables the history.
+        :type memory_limit: int
+        :raise ValueError: An exception is raised if the memory limit is negative or too small to store one sample.
+        
+        """
+        if memory_limit<0:
+            raise ValueError('memory_limit must be positive')
+        if memory_limit==0:
+            self.__history = None
+        else:
+            self.__history = TelemetryHistory(FLIGHT_DATA_GROUPS, memory_limit)
+        
+    def get_history(self, names, seconds=None, arrival_times=False):
+        """Returns the recent values of the requested sensors, as received from the drone (one value per received
+        message, e.g. ``height`` comes from the flight messages and ``posX`` from the log messages).
+        The history keeps the last samples within the memory limit set by the ``history_memory_limit`` parameter of
+        the constructor or by :meth:`~tello_ctrl.tello_ctrl.set_history_memory_limit`.
+        
+        The samples of the log messages are timestamped with their sensor time, estimated from the tick of the drone
+        (see :meth:`~tello_ctrl.tello_ctrl.get_clock_statistics`). The flight messages do not carry a tick: their time
+        is the receive time.
+        
+        :param names: List of sensor names.
+        :type names: [str]
+        :param seconds: Duration of the requested window (ending now) in seconds, defaults to None (the whole history).
+        :type seconds: float, optional
+        :param arrival_times: If True, the receive times are returned too, defaults to False.
+        :type arrival_times: bool, optional
+        :return: A dictionnary giving for each name a tuple ``(t, x)`` of numpy arrays: ``t`` is the sensor time
+            (``time.monotonic()`` clock) and ``x`` the sensor values, or ``(t, x, arrival)`` with the receive times
+            when ``arrival_times`` is True.
+        :rtype: dict
+        :raise tello_ctrlException: An exception is raised if the history is disabled.
+        :raise ValueError: An exception is raised if a sensor is not stored in the history.
+        
+        """
+        if self.__history is None:
+            raise tello_ctrlException('The telemetry history is disabled')
+        return self.__history.get_history(names, seconds, arrival_times)
+        
+    def get_clock_statistics(self):
+        """Returns the state of the synchronization of the drone clock with the host clock. The ticks of the
+        log records are converted to the host clock (``time.monotonic()``) by an online estimation of the offset and
+        of the drift of the drone clock; the latency is the delay between the sensor time and the receive time of the
+        records, measured relatively to the fastest record (the constant part of the latency cannot be observed):
+        
+            * ``synchronized`` : True when the sensor times are estimated (after about one second of log messages)
+            * ``count`` : number of log records since the last reset
+            * ``resets`` : number of restarts of the drone clock detected
+            * ``tick_rate`` : number of drone ticks per second
+            * ``offset`` : host time of the first tick (s)
+            * ``latency_last``, ``latency_mean``, ``latency_min``, ``latency_max``, ``latency_jitter`` : latency statistics (s)
+        
+        :return: A dictionnary with the statistics.
+        :rtype: dict
+        
+        """
+        return self.__clock_sync.get_statistics()
+        
     def get_sensor_values_by_index(self,idx=[]):
         """Sends the requested sensor values. The index ``idx`` refers to the position in the list send by :meth:`~tello_ctrl.tello_ctrl.get_sensor_list`.
         
@@ -680,35 +1133,26 @@ class tello_ctrl(object):
         
        
         
-        data=[]
+        # in the sensor list, we have first the sensor, then the control
+        count=len(self.__sensor_list)+len(self.__control_list)
         if idx==[]:
-            idx=[i for i in range(len(self.__sensor_list)+len(self.__control_list))]
+            return [self.__get_sensor_value(i) for i in range(count)]
             
         if not isinstance(idx,(list,tuple)):
             idx=[idx]
             
+        data=[]
         for i in idx:
-            j=i-len(self.__sensor_list) # index in self.__control_list 
-            if i<0 or (i-len(self.__sensor_list)>=len(self.__control_list)):
-                raise ValueError('idx must be comprised between 0 and %d'%(len(self.__sensor_list)+len(self.__control_list)-1))
-            elif i<len(self.__sensor_list):
-                val=getattr(self.__flight_data,self.__sensor_list[i])
-                data.append(val)
-                
-            elif j<len(self.__control_list):
-                # in the sensor list, we have first the sensor, then the control
-                val=getattr(self,"_tello_ctrl"+'__'+self.__control_list[j])
-                if j<4:
-                    # stick control are in the -1/1 range, -100/100 for the user
-                    val=val*100  
-               
-                data.append(val)
+            if i<0 or i>=count:
+                raise ValueError('idx must be comprised between 0 and %d'%(count-1))
+            data.append(self.__get_sensor_value(i))
         
         return data
     
     def get_sensor_values_by_name(self,names=[]):
         """Sends the requested sensor (or control) values.
         The list of sensor and control signal names can be retrived using :meth:`~tello_ctrl.tello_ctrl.get_sensor_list`.
+        When the same names are read repeatedly, a view created by :meth:`~tello_ctrl.tello_ctrl.make_sensor_view` is much faster.
         
         :param names: List of sensor names, defaults to ``[]`` (send all the known values).
         :type names: [str]
@@ -720,29 +1164,56 @@ class tello_ctrl(object):
         if not isinstance(names,(list,tuple)):
             names=[names]
             
-        data=[]
         if names==[]:
-            # all the values
-            names=self.get_sensor_list()
+            # all the values (by index, as the yaw control has the same name as the yaw sensor)
+            return self.get_sensor_values_by_index()
             
-       
+        data=[]
         for name in names:
-            if name in self.__sensor_list :
-                val=getattr(self.__flight_data,name)
-                data.append(val)
-
-            elif name in self.__control_list:
-                val=getattr(self,"_tello_ctrl"+'__'+name)
-                idx=self.__control_list.index(name)
-                if idx<4:
-                    # stick control are in the -1/1 range, -100/100 for the user
-                    val=val*100  
-                data.append(val)
-            else:
+            idx=self.__sensor_index.get(name)
+            if idx is None:
                 raise ValueError('%s is not a valid sensor or control name'%(name))
+            data.append(self.__get_sensor_value(idx))
         
         return data
         
+    def get_snapshot(self):
+        """Returns the last snapshot of the sensors. A snapshot is an immutable named tuple containing the values of all the
+        sensors of :meth:`~tello_ctrl.tello_ctrl.get_sensor_list` (without the controls) after a telemetry packet was decoded,
+        so all its values come from the same packet, e.g. ``snapshot.posX`` and ``snapshot.posY``. It also contains:
+        
+            * ``seq_num`` : sequence number of the snapshot, incremented for each decoded telemetry packet (0 before the first packet)
+            * ``timestamp`` : receive time of the packet (``time.monotonic()``)
+        
+        Reading the snapshot does not take any lock.
+        
+        :return: The last snapshot.
+        :rtype: namedtuple
+        
+        """
+        return self.__snapshots.current
+        
+    def wait_for_snapshot(self, seq_num=None, timeout=None):
+        """Waits for a snapshot newer than ``seq_num`` (see :meth:`~tello_ctrl.tello_ctrl.get_snapshot`). Waiting on the sequence
+        number of the last snapshot processed ensures that no snapshot is processed twice:
+        
+        .. code-block:: python
+        
+            snapshot = drone.get_snapshot()
+            while True:
+                snapshot = drone.wait_for_snapshot(snapshot.seq_num, timeout=1)
+                ...
+        
+        :param seq_num: Sequence number of the last snapshot seen, defaults to None (the current snapshot).
+        :type seq_num: int, optional
+        :param timeout: Maximum waiting time in seconds, defaults to None (no timeout).
+        :type timeout: float, optional
+        :return: The first snapshot with a greater sequence number, or ``None`` on timeout.
+        :rtype: namedtuple
+        
+        """
+        return self.__snapshots.wait(seq_num, timeout)
+        
     def get_battery(self):
         """Returns the battery percentage.
         
@@ -760,9 +1231,10 @@ class tello_ctrl(object):
         
         """
         
-        return [self.__flight_data.velX,
-                self.__flight_data.velY,
-                self.__flight_data.velZ]
+        snapshot=self.__snapshots.current
+        return [snapshot.velX,
+                snapshot.velY,
+                snapshot.velZ]
         
         
     
@@ -773,9 +1245,10 @@ class tello_ctrl(object):
         :rtype: [float,float,float]
         
         """
-        return [self.__flight_data.accX,
-                self.__flight_data.accY,
-                self.__flight_data.accZ]
+        snapshot=self.__snapshots.current
+        return [snapshot.accX,
+                snapshot.accY,
+                snapshot.accZ]
                 
     def get_gyros(self):
         """Returns the drone rotational velocities in the drone frame. 
@@ -784,9 +1257,10 @@ class tello_ctrl(object):
         :rtype: [float,float,float]
         
         """
-        return [self.__flight_data.gyroX,
-                self.__flight_data.gyroY,
-                self.__flight_data.gyroZ]
+        snapshot=self.__snapshots.current
+        return [snapshot.gyroX,
+                snapshot.gyroY,
+                snapshot.gyroZ]
                 
     def get_ground_velocity(self):
         """Returns the drone ground velocities in the earth frame. It is not sure in which conditions these values are provided by the drone.
@@ -795,9 +1269,10 @@ class tello_ctrl(object):
         :rtype: [float,float,float]
         
         """
-        return [self.__flight_data.velN,
-                self.__flight_data.velE,
-                self.__flight_data.velD]
+        snapshot=self.__snapshots.current
+        return [snapshot.velN,
+                snapshot.velE,
+                snapshot.velD]
                 
     def get_euler_angle(self):
         """Returns the drone Euler angles.
@@ -806,9 +1281,10 @@ class tello_ctrl(object):
         :rtype: [float,float,roll]
         
         """
-        return [self.__flight_data.yaw,
-                self.__flight_data.pitch,
-                self.__flight_data.roll]
+        snapshot=self.__snapshots.current
+        return [snapshot.yaw,
+                snapshot.pitch,
+                snapshot.roll]
              
     def get_control(self):
         """Returns the actual`` `control values`.` They corresponds to the 4 sticks `left_right`,
@@ -829,10 +1305,11 @@ class tello_ctrl(object):
         :rtype: [float,float,float,float]
         
         """
-        return [self.__flight_data.posX,
-                self.__flight_data.posY,
-                self.__flight_data.posZ,
-                self.__flight_data.tof]
+        snapshot=self.__snapshots.current
+        return [snapshot.posX,
+                snapshot.posY,
+                snapshot.posZ,
+                snapshot.tof]
                
     def get_mvo_pos_valid(self):
         """This property is true when the MVO (Monocular Visual Odometry) position is reliable.
@@ -841,7 +1318,8 @@ class tello_ctrl(object):
         :rtype: bool
         
         """
-        return  self.mov_valid_posX and self.mov_valid_posY and self.mov_valid_posZ
+        snapshot=self.__snapshots.current
+        return  snapshot.mov_valid_posX and snapshot.mov_valid_posY and snapshot.mov_valid_posZ
     
                 
     def get_mvo_vel_valid(self):
@@ -851,15 +1329,17 @@ class tello_ctrl(object):
         :rtype: bool
         
         """
-        return  self.mov_valid_velX and self.mov_valid_velY and self.mov_valid_velZ
+        snapshot=self.__snapshots.current
+        return  snapshot.mov_valid_velX and snapshot.mov_valid_velY and snapshot.mov_valid_velZ
     
         
     def __send_time_command(self):
-        self.__LOGGER.info('send_time (cmd=0x%02x seq=0x%04x)' % (TIME_CMD, self.__pkt_seq_num))
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('send_time (cmd=0x%02x seq=0x%04x)' % (TIME_CMD, seq_num))
         pkt = Packet(TIME_CMD, 0x50)
         pkt.add_byte(0)
         pkt.add_time()
-        pkt.fixup()
+        pkt.fixup(seq_num)
         return self.__send_packet(pkt)
     
     def quit(self):
@@ -868,6 +1348,12 @@ class tello_ctrl(object):
         if self.__recording_enabled:
             self.stop_recording_to_file()
             
+        if self.__capture is not None:
+            self.stop_capture()
+            
+        if self.__DATA_LOGGER_FILEHANDLER is not None or self.__DATA_LOGGER_BINARY is not None:
+            self.stop_data_logging()
+            
         if self.__video_enabled:
             self.stop_receiving_video()
             
@@ -1019,67 +1505,51 @@ class tello_ctrl(object):
 
     def flip_forward(self):
         """flip_forward tells the drone to perform a forwards flip"""
-        self.__LOGGER.info('flip_forward (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipFront)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_forward (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipFront, retries=0)
 
     def flip_back(self):
         """flip_back tells the drone to perform a backwards flip"""
-        self.__LOGGER.info('flip_back (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipBack)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_back (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipBack, retries=0)
 
     def flip_right(self):
         """flip_right tells the drone to perform a right flip"""
-        self.__LOGGER.info('flip_right (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipRight)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_right (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipRight, retries=0)
 
     def flip_left(self):
         """flip_left tells the drone to perform a left flip"""
-        self.__LOGGER.info('flip_left (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipLeft)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_left (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipLeft, retries=0)
 
     def flip_forwardleft(self):
         """flip_forwardleft tells the drone to perform a forwards left flip"""
-        self.__LOGGER.info('flip_forwardleft (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipForwardLeft)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_forwardleft (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipForwardLeft, retries=0)
 
     def flip_backleft(self):
         """flip_backleft tells the drone to perform a backwards left flip"""
-        self.__LOGGER.info('flip_backleft (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipBackLeft)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_backleft (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipBackLeft, retries=0)
 
     def flip_forwardright(self):
         """flip_forwardright tells the drone to perform a forwards right flip"""
-        self.__LOGGER.info('flip_forwardright (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipForwardRight)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_forwardright (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipForwardRight, retries=0)
 
     def flip_backright(self):
         """flip_backleft tells the drone to perform a backwards right flip"""
-        self.__LOGGER.info('flip_backright (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, self.__pkt_seq_num))
-        pkt = Packet(FLIP_CMD, 0x70)
-        pkt.add_byte(FlipBackRight)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('flip_backright (cmd=0x%02x seq=0x%04x)' % (FLIP_CMD, seq_num))
+        return self.__send_command(FLIP_CMD, seq_num, self.__encoder.build_flip, FlipBackRight, retries=0)
         
         
     def __fix_range(self, val, min=-1.0, max=1.0):
@@ -1164,10 +1634,11 @@ class tello_ctrl(object):
  
     def __get_alt_limit(self):
         """..."""
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.info('get altitude limit (cmd=0x%02x seq=0x%04x)' % (
-            ALT_LIMIT_MSG, self.__pkt_seq_num))
+            ALT_LIMIT_MSG, seq_num))
         pkt = Packet(ALT_LIMIT_MSG)
-        pkt.fixup()
+        pkt.fixup(seq_num)
         return self.__send_packet(pkt)
     
    
@@ -1178,41 +1649,45 @@ class tello_ctrl(object):
         :type limit: int
         
         """
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.info('set altitude limit=%s (cmd=0x%02x seq=0x%04x)' % (
-            int(limit), SET_ALT_LIMIT_CMD, self.__pkt_seq_num))
+            int(limit), SET_ALT_LIMIT_CMD, seq_num))
         pkt = Packet(SET_ALT_LIMIT_CMD)
         pkt.add_byte(int(limit))
         pkt.add_byte(0x00)
-        pkt.fixup()        
+        pkt.fixup(seq_num)        
         self.__send_packet(pkt)
         self.__get_alt_limit()
 
     def __get_att_limit(self):
         ''' ... '''
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.debug('get attitude limit (cmd=0x%02x seq=0x%04x)' % (
-            ATT_LIMIT_MSG, self.__pkt_seq_num))
+            ATT_LIMIT_MSG, seq_num))
         pkt = Packet(ATT_LIMIT_MSG)
-        pkt.fixup()
+        pkt.fixup(seq_num)
         return self.__send_packet(pkt)
         
     def __set_att_limit(self, limit):
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.info('set attitude limit=%s (cmd=0x%02x seq=0x%04x)' % (
-            int(limit), ATT_LIMIT_CMD, self.__pkt_seq_num))
+            int(limit), ATT_LIMIT_CMD, seq_num))
         pkt = Packet(ATT_LIMIT_CMD)
         pkt.add_byte(0x00)        
         pkt.add_byte(0x00)
         pkt.add_byte( int(float_to_hex(float(limit))[4:6], 16) ) # 'attitude limit' formatted in float of 4 bytes
         pkt.add_byte(0x41)
-        pkt.fixup()
+        pkt.fixup(seq_num)
         self.__send_packet(pkt)
-        self.get_att_limit()
+        self.__get_att_limit()
         
     def __get_low_bat_threshold(self):
         ''' ... '''
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.debug('get low battery threshold (cmd=0x%02x seq=0x%04x)' % (
-            LOW_BAT_THRESHOLD_MSG, self.__pkt_seq_num))
+            LOW_BAT_THRESHOLD_MSG, seq_num))
         pkt = Packet(LOW_BAT_THRESHOLD_MSG)
-        pkt.fixup()
+        pkt.fixup(seq_num)
         return self.__send_packet(pkt)
         
     def set_low_bat_threshold(self, threshold):
@@ -1223,24 +1698,60 @@ class tello_ctrl(object):
         
         """
         
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.info('set low battery threshold=%s (cmd=0x%02x seq=0x%04x)' % (
-            int(threshold), LOW_BAT_THRESHOLD_CMD, self.__pkt_seq_num))
+            int(threshold), LOW_BAT_THRESHOLD_CMD, seq_num))
         pkt = Packet(LOW_BAT_THRESHOLD_CMD)
         pkt.add_byte(int(threshold))
-        pkt.fixup()        
+        pkt.fixup(seq_num)        
         self.__send_packet(pkt)
-        self.get_low_bat_threshold()
+        self.__get_low_bat_threshold()
+
+    def get_alt_limit(self):
+        """Returns the altitude limit reported by the drone (updated after :meth:`set_alt_limit`).
+        
+        :return: Altitude limit in meters, None if the drone has not reported it yet.
+        :rtype: int
+        
+        """
+        return self.__alt_limit
+        
+    def get_att_limit(self):
+        """Returns the attitude limit reported by the drone.
+        
+        :return: Attitude limit in degrees, None if the drone has not reported it yet.
+        :rtype: float
+        
+        """
+        return self.__att_limit
+        
+    def get_low_bat_threshold(self):
+        """Returns the low battery threshold reported by the drone (updated after :meth:`set_low_bat_threshold`).
+        
+        :return: Low battery threshold (0-100), None if the drone has not reported it yet.
+        :rtype: int
+        
+        """
+        return self.__low_bat_threshold
+        
+    def get_firmware_version(self):
+        """Returns the firmware version reported by the drone.
+        
+        :return: Firmware version (e.g. '01.04.92.01'), None if the drone has not reported it yet.
+        :rtype: str
+        
+        """
+        return self.__firmware_version
 
     
     def __send_start_video(self):
-        pkt = Packet(VIDEO_START_CMD, 0x60)
-        pkt.fixup()
-        return self.__send_packet(pkt)
+        seq_num = self.__command_tracker.next_seq_num()
+        return self.__send_command(VIDEO_START_CMD, seq_num, self.__encoder.build_start_video)
 
-    def __send_video_mode(self, mode):
+    def __send_video_mode(self, mode, seq_num):
         pkt = Packet(VIDEO_MODE_CMD)
         pkt.add_byte(mode)
-        pkt.fixup()
+        pkt.fixup(seq_num)
         return self.__send_packet(pkt)
 
     def get_zoom_state(self):
@@ -1269,10 +1780,11 @@ class tello_ctrl(object):
         if self.__recording_enabled and zoom != self.__zoom:
             raise tello_ctrlException('You cannot change zoom setting while recording')
         
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.info('set video mode zoom=%s (cmd=0x%02x seq=0x%04x)' % (
-            zoom, VIDEO_START_CMD, self.__pkt_seq_num))
+            zoom, VIDEO_START_CMD, seq_num))
         self.__zoom = zoom
-        return self.__send_video_mode(int(zoom))
+        return self.__send_video_mode(int(zoom), seq_num)
         
     def get_video_exposure(self):
         """Get the video exposure. Values are in the -9..9 range.
@@ -1299,34 +1811,64 @@ class tello_ctrl(object):
         level=val+9
         
             
-        self.__LOGGER.info('set exposure (cmd=0x%02x seq=0x%04x)' % (EXPOSURE_CMD, self.__pkt_seq_num))
+        seq_num = self.__command_tracker.next_seq_num()
+        self.__LOGGER.info('set exposure (cmd=0x%02x seq=0x%04x)' % (EXPOSURE_CMD, seq_num))
         self.__exposure = level
-        self.__send_exposure()
+        self.__send_exposure(seq_num)
         
     
-    def __send_exposure(self):
-        pkt = Packet(EXPOSURE_CMD, 0x48)
-        pkt.add_byte(self.__exposure)
-        pkt.fixup()
-        return self.__send_packet(pkt)
-
-    def __send_video_encoder_bitrate(self):
-        pkt = Packet(VIDEO_ENCODER_RATE_CMD, 0x68)
-        pkt.add_byte(self.__video_encoder_bitrate)
-        pkt.fixup()
-        return self.__send_packet(pkt)
-
-    def start_receiving_video(self,downsample_factor=1, timeout=15,  video_format='rgb24'):
+    def __send_exposure(self, seq_num=None):
+        if seq_num is None:
+            seq_num = self.__command_tracker.next_seq_num()
+        return self.__send_command(EXPOSURE_CMD, seq_num, self.__encoder.build_exposure, self.__exposure)
+
+    def __send_video_encoder_bitrate(self, seq_num=None):
+        if seq_num is None:
+            seq_num = self.__command_tracker.next_seq_num()
+        return self.__send_command(VIDEO_ENCODER_RATE_CMD, seq_num,
+                                   self.__encoder.build_bitrate, self.__video_encoder_bitrate)
+
+    def start_receiving_video(self,downsample_factor=1, timeout=15,  video_format='rgb24', buffer_frames=8, buffer_policy='drop_oldest', partial_frames='drop', decoder_threads='slice', decoder_thread_count=0):
         """Request video from the drone. It is mandatory to call :meth:`~tello_ctrl.tello_ctrl.start_receiving_video` before accessing the frame with :meth:`~tello_ctrl.tello_ctrl.get_frame`.
-        Due to the Tello drone limitations and the pyav video decoder , it can takes a significant amount of time before being able to get an image from. So please use a ``time_out`` greater than 10 seconds.
+        The frames are decoded as soon as they are received, but the first image can only be decoded from a keyframe, so it may take a few seconds before getting the first image.
         
         :param downsample_factor: Allows to downsample the image height&width by the specified factor, defaults to 1.
         :type downsample_factor: integer
         :param time_out: Maximum amount of time allowed to receive the first frame, defaults to 15 seconds.
+        :param buffer_frames: Maximum number of received frames waiting for the decoder, defaults to 8.
+        :type buffer_frames: int
+        :param buffer_policy: Handling of the frames received when the decoder is late by ``buffer_frames`` frames, defaults to ``"drop_oldest"``:
+        
+            * ``"block"``: the video reception waits for the decoder (the packets are kept by the socket buffer)
+            * ``"drop_oldest"``: the oldest frames are dropped up to the next keyframe
+            * ``"drop_newest"``: the received frames are dropped until the next keyframe
+            
+            The counters of the received and dropped frames are given by :meth:`~tello_ctrl.tello_ctrl.get_video_statistics`.
+        :type buffer_policy: str
+        :param partial_frames: Handling of the frames with missing packets (lost on the link), defaults to ``"drop"``:
+        
+            * ``"drop"``: the frame is discarded, the next frames are decoded with a missing reference (artifacts until the next keyframe)
+            * ``"forward"``: the packets received are given to the decoder (lowest latency, more artifacts)
+            * ``"wait_idr"``: the frame and the next ones are discarded until the next keyframe (no artifacts, but the image is frozen until the next keyframe)
+            
+            The counters of the lost packets and frames are given by :meth:`~tello_ctrl.tello_ctrl.get_video_statistics`.
+        :type partial_frames: str
+        :param decoder_threads: Threading of the H.264 decoder, defaults to ``"slice"``:
+        
+            * ``"none"``: a single thread, lowest latency
+            * ``"slice"``: the slices of a frame are decoded in parallel, without added latency (the drone encodes a frame in few slices, so the gain is small)
+            * ``"frame"``: consecutive frames are decoded in parallel, highest throughput, but each image is delayed by ``decoder_thread_count - 1`` frames
+            
+        :type decoder_threads: str
+        :param decoder_thread_count: Number of decoder threads, 0 for one thread per core, defaults to 0.
+        :type decoder_thread_count: int
         :raise tello_ctrlException: An exception is raised if the video is already started.
         :raise tello_ctrlException: An exception is raised if no frame is received within the ``time_out`` perdiod.
         :raise ValueError: An exception is raised if ``downsample_factor`` is not greater or equal to one
         :raise ValueError: An exception is raised if the video_format is not 'rgb24' or 'bgr24'.
+        :raise ValueError: An exception is raised if buffer_frames is not strictly positive or if buffer_policy is not valid.
+        :raise ValueError: An exception is raised if partial_frames is not "drop", "forward" or "wait_idr".
+        :raise ValueError: An exception is raised if decoder_threads is not "none", "slice" or "frame", or if decoder_thread_count is negative.
 
         """
         
@@ -1338,6 +1880,11 @@ class tello_ctrl(object):
         
         if video_format != 'bgr24' and video_format != 'rgb24':
             raise ValueError('Invalid video_format, should be "bgr24" or "rgb24".')
+        
+        stream = video_stream.VideoStream(self.__LOGGER, buffer_frames, buffer_policy)
+        # rebuilds the frames from the video packets
+        assembler = video_stream.FrameAssembler(self.__LOGGER, policy=partial_frames)
+        decoder = video_decoder.H264Decoder(decoder_threads, decoder_thread_count)
             
         self.__video_format=video_format
       
@@ -1350,7 +1897,14 @@ class tello_ctrl(object):
         res = self.__send_start_video()
         
         self.__LOGGER.debug('  => create video stream')
-        self.__video_stream = video_stream.VideoStream(self.__LOGGER)
+        self.__video_stream = stream
+        self.__last_video_stream = stream
+        self.__frame_assembler = assembler
+        self.__video_decoder = decoder
+        self.__last_video_decoder = decoder
+        # the decoding starts at the next IDR frame
+        self.__video_gate.reset()
+        self.__video_gate.frames_dropped = 0
 
         self.__first_raw_frame_received=False
         
@@ -1370,6 +1924,41 @@ class tello_ctrl(object):
         else:
             self.__LOGGER.info('  => First frame received')
 
+    def get_video_statistics(self):
+        """Returns the counters of the frames received by the video reception (see the ``buffer_frames`` and
+        ``buffer_policy`` parameters of :meth:`~tello_ctrl.tello_ctrl.start_receiving_video`), for the current or the
+        last video reception:
+        
+            * ``packets_received``, ``packets_lost`` : video packets received and lost (the packets of the frames of which no packet was received are not counted)
+            * ``frames_complete``, ``frames_incomplete`` : frames received with all their packets, with missing packets
+            * ``frames_forwarded`` : incomplete frames given to the decoder (``partial_frames="forward"``)
+            * ``partial_frames_dropped`` : frames discarded by the ``partial_frames`` policy
+            * ``frames_lost`` : frames of which no packet was received
+            * ``frames_received``, ``bytes_received`` : frames rebuilt from the received packets
+            * ``frames_dropped``, ``bytes_dropped`` : frames dropped before the decoder
+            * ``frames_buffered``, ``bytes_buffered`` : frames waiting for the decoder
+            * ``max_bytes_buffered`` : maximum of ``bytes_buffered``
+            * ``blocked_time`` : time spent by the video reception waiting for the decoder (s)
+            * ``frames_skipped`` : frames dropped before the parameter sets and the first IDR frame (not decoded)
+            * ``frames_decoded`` : images decoded
+            * ``decoder_errors`` : frames rejected by the decoder (e.g. the frames received before the first keyframe)
+        
+        :return: A dictionnary with the counters, or ``None`` if the video was never received.
+        :rtype: dict
+        
+        """
+        if self.__last_video_stream is None:
+            return None
+        statistics=self.__last_video_stream.get_statistics()
+        decoder=self.__last_video_decoder
+        losses=self.__frame_assembler.get_statistics()
+        losses['partial_frames_dropped']=losses.pop('frames_dropped')
+        statistics.update(losses)
+        statistics['frames_skipped']=self.__video_gate.frames_dropped
+        statistics['frames_decoded']=0 if decoder is None else decoder.frames_out
+        statistics['decoder_errors']=0 if decoder is None else decoder.errors
+        return statistics
+
     @property
     def is_receiving_video(self):
         """This property (read-only) indicated wether or not the drone is sending video to the base.
@@ -1393,11 +1982,11 @@ class tello_ctrl(object):
     def stop_receiving_video(self,timeout=5):
         """Stops the video receiption. from the drone. If the video is being recorded, then the recording is also stopped.
         
-        :param timeout: Maximum time allowed to closed the video container used to decode the drone video stream, defaults to 5 seconds.
+        :param timeout: Maximum time allowed to stop the threads receiving and decoding the drone video stream, defaults to 5 seconds.
         :type timeout: int
         :param video_format: `rgb24` or `bgr24`` to indicate the order or the R, G, B plane. cv2 uses bgr24.
         :raise tello_ctrlException: An exception is raised if the video receiption was not started.
-        :raise tello_ctrlException: An exception is raised if the video container is not closed within the ``time_out`` period.
+        :raise tello_ctrlException: An exception is raised if the video threads are not stopped within the ``time_out`` period.
         """
         
         if self.__recording_enabled:
@@ -1411,13 +2000,13 @@ class tello_ctrl(object):
         # Stop receiving video
         self.__video_enabled = False
         tStart = now = time.time()
-        while (self.__stream_container is not None or  self.__video_stream is not None) and (now-tStart<timeout):
+        while (self.__video_decoder is not None or  self.__video_stream is not None) and (now-tStart<timeout):
             time.sleep(0.05)
             now=time.time()
         
-        if (now-tStart>=timeout) and (self.__stream_container is not None or  self.__video_stream is not None):
-            if self.__stream_container is not None:
-                self.__LOGGER.error('self.__stream_container is not None:')
+        if (now-tStart>=timeout) and (self.__video_decoder is not None or  self.__video_stream is not None):
+            if self.__video_decoder is not None:
+                self.__LOGGER.error('self.__video_decoder is not None:')
             else:
                 self.__LOGGER.error('self.__video_stream is not None:')
             
@@ -1436,17 +2025,11 @@ class tello_ctrl(object):
         self.__LOGGER.debug('video_thread : socket open')
         
         
-        prev_video_data = None
-        prev_ts = None
-        history = []
+        assembler = self.__frame_assembler
         
-        #  1st byte is slice number
-        #  2nd byte, 7 bits is packet number within that frame, 8 bits is end of slice
-        frame_no = 0 # counter
-        prev_slice_no       = None
-        prev_packet_no      = None
-        prec_packet_is_last = None
-        slice_data=bytes()
+        # datagrams are received in a preallocated buffer
+        buffer = bytearray(self.__udpsize)
+        buffer_view = memoryview(buffer)
         
         self.__LOGGER.debug('video_thread : self.__video_enabled : %r',(self.__video_enabled))
         self.__LOGGER.debug('video_thread : self.__first_raw_frame_received : %r',(self.__first_raw_frame_received))
@@ -1454,72 +2037,35 @@ class tello_ctrl(object):
         try:
             while self.__video_enabled:
                 try:
-                    data, server = sock.recvfrom(self.__udpsize)
+                    nbytes, server = sock.recvfrom_into(buffer)
+                    arrival=time.monotonic()
+                    if self.__capture is not None:
+                        self.__capture.write(capture.CHANNEL_VIDEO, arrival, buffer_view[:nbytes])
                     now=time.time()
                     
-                    # extext slice & packet data
-                    curr_slice_no  = data[0]
-                    curr_packet_no = data[1] & 0x7F  # 7 bits
-                    curr_packet_is_last= (data[1] & 0x80) == 0x80 # 8th bit = last packet
-                    
-                    #self.__LOGGER.debug('Slice : %d packet : %d last : %r' % (curr_slice_no,curr_packet_no,curr_packet_is_last))
-                    #self.__LOGGER.info('Raw bytes %d %d' % (data[0],data[1]))
-                    
-                    # check if data is valid
-                    if prev_slice_no == None:
-                        # first packet in the first frame
-                        packet_ok = curr_packet_no==0
-                        prev_packet_no = (curr_packet_no - 1) & 0xFF
-                        #self.__LOGGER.info('    => First packet first frame')   
-                    else:
-                        # any packet
-                        # packet is valid if it is a new packet
-                        packet_ok = ( (curr_slice_no==prev_slice_no) and (curr_packet_no==prev_packet_no+1) ) \
-                                    or (curr_slice_no!=prev_slice_no) and (curr_packet_no==0)
-                    
-                    if packet_ok:
-                        # packet is valid, accumulate slice data
-                        #self.__LOGGER.info("    => packet correct")
-                        prev_slice_no       = curr_slice_no
-                        prev_packet_no      = curr_packet_no
-                        prev_packet_is_last = curr_packet_is_last
-                        slice_data+=data[2:]
-                        
-                        
-                        if curr_packet_is_last:
-                            # send frame to the decoder
-                            if self.__video_stream is not None:
-                                self.__video_stream.update_raw_data(slice_data)
-                            slice_data=bytes()
-                            if frame_no==0:
-                                # Indicate that the decoding thread can start
-                                self.__first_raw_frame_received=True
-                                self.__LOGGER.debug('First raw frame received')
-                            frame_no+=1
-                        
-                    else:
-                        self.__LOGGER.debug("    => invalid packet")
-                        if prev_slice_no is not None:
-                            self.__LOGGER.debug('Previous: Slice : %d packet : %d last : %r' % (prev_slice_no,prev_packet_no,prev_packet_is_last))
-                        self.__LOGGER.debug('Current: Slice : %d packet : %d last : %r' % (curr_slice_no,curr_packet_no,curr_packet_is_last))
-                        self.__LOGGER.debug('Current: Raw bytes %d %d' % (data[0],data[1]))
-                        if prev_slice_no is not None:
-                            self.__LOGGER.debug('Prev   : Slice : %d packet : %d ' % (prev_slice_no,prev_packet_no))
-       
-                        # discard all the data as the current packet is not correct
-                        slice_data=bytes()
+                    for frame in assembler.add_packet(buffer_view[:nbytes]):
+                        frame = self.__video_gate.process(frame)
+                        if frame is None:
+                            continue
+                        # send frame to the decoder
+                        if self.__video_stream is not None:
+                            self.__video_stream.update_raw_data(frame, arrival)
+                        if not self.__first_raw_frame_received:
+                            # Indicate that the decoding thread can start
+                            self.__first_raw_frame_received=True
+                            self.__LOGGER.debug('First raw frame received')
                         
                     # Refresh video request every 2 seconds
                     if  now-time_video_refresh>2:
-                        self.__send_start_video()
+                        self.__send_keep_alive(self.__encoder.build_start_video)
                         time_video_refresh=now
                         self.__LOGGER.debug('*** __data_reception_thread: __send_start_video')
                     
                 except socket.timeout as ex:
                     self.__LOGGER.error('video recv: timeout')
-                    self.__send_exposure()
-                    self.__send_video_encoder_bitrate()
-                    self.__send_start_video()
+                    self.__send_keep_alive(self.__encoder.build_exposure, self.__exposure)
+                    self.__send_keep_alive(self.__encoder.build_bitrate, self.__video_encoder_bitrate)
+                    self.__send_keep_alive(self.__encoder.build_start_video)
                     data = None
                 
                     
@@ -1536,105 +2082,121 @@ class tello_ctrl(object):
             
 
     def __video_decoding_thread(self):
-        """ This thread is responsible to decode the h.264 stream using pyav.
+        """ This thread is responsible to decode the h.264 frames using a pyav codec context.
             It also send frame to the pyav encoder to record a video file. """
         
-        # set py av logging to something low to avoid invalid PPS message at connection
-        av.logging.set_level(logging.CRITICAL)
-        logging.getLogger("libav").setLevel(logging.CRITICAL)
-
-        self.__LOGGER.debug('Video decoding thread : Wait for the first raw frame')
-        while not self.__first_raw_frame_received and self.__video_enabled:
-            time.sleep(0.1)
-        
-        if not self.__video_enabled:
-            self.__LOGGER.error('Video decoding thread : video_decoding_thread while recording is not enabled => thread is stopped')
-            return
-            
-        # Try to open the video stream populated by the video thread
-        self.__LOGGER.debug('Opening stream_container')
-        self.__stream_container =  None
-        retry = 5
-        while self.__stream_container is None and 0 < retry and self.__video_enabled:
-            retry -= 1
-            try:
-                self.__stream_container =  av.open(self.__video_stream,options={'preset':'ultrafast','tune':'zerolatency '},timeout=(5,0.5))
-            except av.AVError as ave:
-                # py av will receive incomplete frame (PPS is missing) so it will complain
-                # after a few trials it will be ok. So this is logged as debug
-                log_exeception(ave,self.__LOGGER,"DEBUG")
-                self.__LOGGER.debug('======> retry')
-                
-                
-        # Check if stream container was opened 
-        if self.__stream_container is None and self.__video_enabled:
-            raise tello_ctrlException('Impossible to retrieve video stream using pyav')
-        elif not self.__video_enabled:
-            # For some reason decoding is not needed due to the delay taken by the stream opening
-            self.__stream_container.close()
-            self.__LOGGER.error('video_decoding_thread : __video_enabled is not enabled => thread is stopped')
-            return    
+        # the frames received before the parameter sets and the first IDR frame are dropped by the video
+        # thread, so the decoder errors are real errors
+        av.logging.set_level(av.logging.ERROR)
 
+        # the frames rebuilt by the video thread are decoded one by one (no container to open)
+        stream=self.__video_stream
+        decoder=self.__video_decoder
         self.__LOGGER.info('Video decoding start now')
         frame_no=0
         
         while self.__video_enabled :
             try:
-                self.__LOGGER.info('try decoding')
-                for raw_frame in self.__stream_container.decode(video=0):
-                    start_time = time.time()
-                    
-                    self.__condition.acquire()     
-                    #self.__frame = cv2.cvtColor(np.array(frame.to_image()), cv2.COLOR_RGB2BGR)
-                    self.__frame = raw_frame.to_ndarray(format=self.__video_format)
-                    self.__noframe = frame_no
-
-                    # resize if needed
-                    if self.__downsample_factor>1:
-                        # compute resize (the image size may change depeding on the zoom factor or for edu on which camera is used)
-                        new_width = int(self.__frame.shape[1] / self.__downsample_factor)  
-                        new_height = int(self.__frame.shape[0] / self.__downsample_factor) 
-
-                        # Downsample the image
-                        self.__frame = cv2.resize(self.__frame, (new_width, new_height))
-                        
-                    frame_copy=self.__frame.copy() # create a copy so we can free the ressource for other threads
-                    self.__condition.notifyAll()
-                    self.__condition.release() 
-                    
-                    # display live view
-                    if self.__live_video:
-                        # CV2 works with BGR image, but the frame is RGB, we need to convert
-                        print('refresh')
-                        cv2.imshow(self.__live_view_windows_name,  cv2.cvtColor(frame_copy, cv2.COLOR_RGB2BGR))
-                        # force CV2 to refresh the image
-                        cv2.waitKey(1)
-                    
-                    # record if needed
-                    if (self.__recording_enabled and 
-                        self.__recording_container is not None and
-                        frame_no%(1+self.__recording_info['frame_skip'])==0):
-                        # We need to record frame
-                        # Add pts (NB: self.__recording_stream.time_base changes after a few frame)
-                        frame_time=frame_no/30 # Theoretical time in seconds
-                        newframe = av.VideoFrame.from_ndarray(frame_copy, format=self.__video_format)
-                        newframe.pts=round(frame_time/self.__recording_stream.time_base)
-                        newframe.time_base=self.__recording_stream.time_base
-                        
-                        for packet in self.__recording_stream.encode(newframe):
-                            self.__recording_container.mux(packet)
+                item=stream.read_frame(timeout=0.5)
+                if item is None:
+                    continue
+                data, frame_arrival = item
+                # the receive time follows the frame in the decoder (the picture of a frame is returned later with
+                # frame threading)
+                for raw_frame in decoder.decode(data, frame_arrival):
+                    self.__on_decoded_frame(raw_frame, frame_no, decoder.pop_tag(raw_frame))
                     frame_no+=1
             except Exception as e:
                 # error, stop recording
                 self.__LOGGER.error('Error during frame encoding');
                 log_exeception(e,self.__LOGGER)
            
+        # the last pictures kept by the decoder (frame threading) are displayed and recorded
+        try:
+            for raw_frame in decoder.flush():
+                self.__on_decoded_frame(raw_frame, frame_no, decoder.pop_tag(raw_frame))
+                frame_no+=1
+        except Exception as e:
+            self.__LOGGER.error('Error during frame encoding');
+            log_exeception(e,self.__LOGGER)
         self.__LOGGER.info('Cleaning before end of video decoding thread');     
         self.__close_recording_container()        
-        self.__stream_container.close()
-        self.__stream_container=None           
+        self.__video_decoder=None
         
         
+    def __on_decoded_frame(self, raw_frame, frame_no, frame_arrival):
+        # makes the picture available to get_frame, displays and records it
+        self.__condition.acquire()     
+        #self.__frame = cv2.cvtColor(np.array(frame.to_image()), cv2.COLOR_RGB2BGR)
+        self.__frame = raw_frame.to_ndarray(format=self.__video_format)
+        self.__noframe = frame_no
+        frame_decode=time.monotonic()
+
+        # resize if needed
+        if self.__downsample_factor>1:
+            # compute resize (the image size may change depeding on the zoom factor or for edu on which camera is used)
+            new_width = int(self.__frame.shape[1] / self.__downsample_factor)  
+            new_height = int(self.__frame.shape[0] / self.__downsample_factor) 
+
+            # Downsample the image
+            self.__frame = cv2.resize(self.__frame, (new_width, new_height))
+            
+        frame_copy=self.__frame.copy() # create a copy so we can free the ressource for other threads
+        self.__condition.notifyAll()
+        self.__condition.release() 
+        
+        # display live view
+        if self.__live_video:
+            # CV2 works with BGR image, but the frame is RGB, we need to convert
+            print('refresh')
+            cv2.imshow(self.__live_view_windows_name,  cv2.cvtColor(frame_copy, cv2.COLOR_RGB2BGR))
+            # force CV2 to refresh the image
+            cv2.waitKey(1)
+        
+        # record if needed
+        if (self.__recording_enabled and 
+            self.__recording_container is not None and
+            frame_no%(1+self.__recording_info['frame_skip'])==0):
+            # We need to record frame
+            # Add pts (NB: self.__recording_stream.time_base changes after a few frame)
+            frame_time=frame_no/30 # Theoretical time in seconds
+            newframe = av.VideoFrame.from_ndarray(frame_copy, format=self.__video_format)
+            newframe.pts=round(frame_time/self.__recording_stream.time_base)
+            newframe.time_base=self.__recording_stream.time_base
+            
+            for packet in self.__recording_stream.encode(newframe):
+                self.__recording_container.mux(packet)
+            index=self.__recording_index
+            if index is not None:
+                try:
+                    self.__write_frame_index(index, frame_no, frame_time, frame_arrival, frame_decode)
+                except OSError as ex:
+                    # the video is still recorded without its frame index
+                    self.__LOGGER.error('Error while writing the frame index, index stopped: %s' % str(ex))
+                    self.__recording_index=None
+        
+    def __write_frame_index(self, index, frame_no, frame_time, arrival, decode):
+        # row of the frame index: times on the wall clock (as the time column of the data log)
+        offset=self.__recording_info['wall_clock_offset']
+        if arrival is None:
+            arrival=decode
+        # row of the data log sampled nearest to the arrival time of the frame
+        last=self.__DATA_LOGGER_LAST_ROW
+        if last is None:
+            log_row, log_time = -1, math.nan
+        else:
+            log_row, log_time = last
+            period=self.__DATA_LOGGER_PERIOD
+            if period>0:
+                # the next rows are sampled on the period (the next one may not be logged yet)
+                steps=max(-log_row, min(1, round((arrival-log_time)/period)))
+                log_row+=steps
+                log_time+=steps*period
+            log_time+=offset
+        index.write((self.__recording_info['frame_count'], frame_no, frame_time,
+                                      arrival+offset, decode+offset, log_row, log_time))
+        self.__recording_info['frame_count']+=1
+        
     def __close_recording_container(self):
         # flush
         if  self.__recording_container is not None:
@@ -1643,7 +2205,12 @@ class tello_ctrl(object):
             packet=self.__recording_stream.encode(None)
             self.__recording_container.mux(packet) 
             self.__recording_container.close()
+            self.__recording_container = None
             self.__recording_enabled = False
+        if self.__recording_index is not None:
+            index = self.__recording_index
+            self.__recording_index = None
+            index.close()
         self.__recording_enabled = False
          
         
@@ -1717,13 +2284,14 @@ class tello_ctrl(object):
         if bitrate<0 or bitrate>5:
             raise ValueError('Invalid bitrate (should be in the 0..5 range)')
             
+        seq_num = self.__command_tracker.next_seq_num()
         self.__LOGGER.info('set video encoder rate (cmd=0x%02x seq=%04x)' %
-                 (VIDEO_ENCODER_RATE_CMD, self.__pkt_seq_num))
+                 (VIDEO_ENCODER_RATE_CMD, seq_num))
         self.video_encoder_bitrate = rate
-        return self.__send_video_encoder_bitrate()
+        return self.__send_video_encoder_bitrate(seq_num)
 
 
-    def start_recording_video_to_file(self,file_name, frame_skip=0):
+    def start_recording_video_to_file(self,file_name, frame_skip=0, frame_index=True):
         """Starts recording the video to the specified file. The video should be already started using :meth:`~tello_ctrl.tello_ctrl.start_receiving_video`.
         The Tello Drone sends the video at a nominal 30 FPS rate. It is possible to skip some frame by indicating a positive ``frame_skip`` value. 
         It is not possible to change the zoom state while recording a video.
@@ -1731,10 +2299,18 @@ class tello_ctrl(object):
         The video is encoded using the ``pyav`` library (which uses FFMPEG under the hood). It will save the H.264 stream send by the drone into a container (video file). 
         MKV files are working well, but other may also work. 
         
+        The time of the frames in the file is their theoretical time (30 FPS). With ``frame_index=True``, a frame index is
+        saved next to the video file (``video_frames.tlog`` for ``video.mkv``): it gives for each recorded frame its time in
+        the video file, the receive and decoding times (``time.time()`` clock) and the row of the data log (see
+        :meth:`~tello_ctrl.tello_ctrl.start_data_logging`) sampled at the nearest time. The video and the data log are then
+        accessed frame by frame with :class:`common.recording.SyncedRecording`.
+        
         :param file_name: File used to save the video. If folders are specified and do not exist, they are created. If the file exist, it is overwritten.
         :type file_name: str
         :param frame_skip: Only one frame every ``frame_skip`` will be saved in the video file. It defaults to 0 (all the frames are kept).
         :type frame_skip: int
+        :param frame_index: If True, the frame index is saved, defaults to True.
+        :type frame_index: bool, optional
         :raise tello_ctrlException: An exception is raised if the video is not started yet using :meth:`~tello_ctrl.tello_ctrl.start_receiving_video`.
         :raise tello_ctrlException: An exception is raised if a video is alrady being recorded.
         :raise ValueError: An exception is raised if frame_skip is not positive or null.
@@ -1766,13 +2342,16 @@ class tello_ctrl(object):
             os.makedirs(directory) 
 
         # Store data for the thread
-        self.__recording_info={'file_name':file_name,'frame_skip':frame_skip}
+        self.__recording_info={'file_name':file_name,'frame_skip':frame_skip,
+                               'frame_count':0,'wall_clock_offset':time.time()-time.monotonic()}
+        if frame_index:
+            self.__recording_index=DataLogWriter(frame_index_file_name(file_name), FRAME_INDEX_COLUMNS)
         
         # create the container : specify fps & image size
         fps = 30 / (1+frame_skip)
         
         self.__recording_container = av.open(file_name,"w")
-        self.__recording_stream = self.__recording_container.add_stream("libx264", str(fps))
+        self.__recording_stream = self.__recording_container.add_stream("libx264", fractions.Fraction(30,1+frame_skip))
         self.__recording_stream.time_base = fractions.Fraction(1+frame_skip,30)
         
         if self.__zoom:
@@ -1802,7 +2381,40 @@ class tello_ctrl(object):
         self.__LOGGER.info('Video recording stopped')
 
 
-    def start_data_logging(self, file_name, sampling_time=0.1, mode='w', sensor_list=[]):
+    def start_capture(self, file_name):
+        """Starts saving all the raw datagrams received on the control and video ports, with their receive time, to a
+        capture file. The capture can be decoded offline with :func:`common.capture.decode_capture` or read with
+        :class:`common.capture.CaptureReader`.
+        
+        :param file_name: File used to save the datagrams (overwritten). If folders are specified and do not exist, they are created.
+        :type file_name: str
+        :raise tello_ctrlException: An exception is raised if the capture is already started.
+        
+        """
+        if self.__capture is not None:
+            raise tello_ctrlException('Capture is already started. Use stop_capture first')
+            
+        directory = os.path.dirname(file_name)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+            
+        self.__capture = capture.CaptureWriter(file_name)
+        self.__LOGGER.info('Capture started into file %s' % file_name)
+        
+    def stop_capture(self):
+        """Stops the capture started with :meth:`~tello_ctrl.tello_ctrl.start_capture` and closes the file.
+        
+        :raise tello_ctrlException: An exception is raised if the capture was not started.
+        
+        """
+        if self.__capture is None:
+            raise tello_ctrlException('Capture is not started. Use start_capture first')
+        writer = self.__capture
+        self.__capture = None
+        writer.close()
+        self.__LOGGER.info('Capture stopped (%d datagrams)' % writer.count)
+        
+    def start_data_logging(self, file_name, sampling_time=0.1, mode='w', sensor_list=[], file_format='csv', interpolation_delay=None, max_file_size=None, max_file_duration=None):
         """Starts logging received data to the specified CSV file with a specified ``sampling_time``. 
         When sampling time is negative, the data are not logged automatically but only when :meth:`~tello_ctrl.tello_ctrl.data_logging_request` is called.
         The ``mode`` parameter can take 2 values:
@@ -1810,22 +2422,62 @@ class tello_ctrl(object):
             * ``"w"``: overwrite the file if it already exists.
             * ``"a"``: append new line if the file already exists.
         
+        The samples are taken by a dedicated thread on deadlines of the monotonic clock, so they are uniformly spaced
+        whatever the packets received from the drone. The ``time`` column is the deadline converted to the wall clock
+        and the last column ``lateness`` is the delay (in seconds) between the deadline and the actual sample. The timing
+        statistics are given by :meth:`~tello_ctrl.tello_ctrl.get_data_logging_statistics`.
+        
+        When ``interpolation_delay`` is set, the sensors stored in the telemetry history (see :meth:`~tello_ctrl.tello_ctrl.get_history`)
+        are linearly interpolated at the sample time instead of holding their last received value. As the values received after
+        the sample time are needed, the samples are taken ``interpolation_delay`` seconds in the past (the ``time`` column accounts for it).
+        
+        With ``file_format="binary"``, the data are saved in a binary columnar file written by a background thread,
+        which avoids formatting the values in the reception thread. The file can be loaded with
+        :func:`common.data_log.read_data_log`; its first column ``time`` is the time of the sample (``time.time()`` clock).
+        
+        With ``file_format="delta"``, each row only stores the values that changed since the previous row and the file is
+        compressed (gzip). The log is split in several files (``file_name`` followed by ``_000``, ``_001``...) when
+        ``max_file_size`` or ``max_file_duration`` is reached. The files are loaded with :func:`common.data_log.read_delta_log`.
+        
         :param file_name: File used to save the data. If folders are specified and do not exist, they are created.
         :type file_name: str
         :param sampling_time: interval of time between two record in the log file.
         :type sampling_time: float
         :param sensor_list: List of sensor to be recorded, default to [] (all the available sensors). Available sensors can be obtained using :meth:`~tello_ctrl.tello_ctrl.get_sensor_list`
         :type sensor_list: [str]
-        :raise tello_ctrlException: An exception is raised if the logger is already started.
-        :raise ValueError: An exception is raised if mode is not ``"a"`` or ``"w"``.
+        :param file_format: ``"csv"``, ``"binary"`` or ``"delta"``, defaults to ``"csv"``. Without extension, the file name is completed with ``.CSV``, ``.tlog`` or ``.tlz``.
+        :type file_format: str
+        :param interpolation_delay: Delay of the samples in seconds when the sensors are interpolated, defaults to None (no interpolation).
+        :type interpolation_delay: float, optional
+        :param max_file_size: ``"delta"`` format only, size in bytes above which a new file is started, defaults to None (no limit).
+        :type max_file_size: int, optional
+        :param max_file_duration: ``"delta"`` format only, duration in seconds above which a new file is started, defaults to None (no limit).
+        :type max_file_duration: float, optional
+        :raise tello_ctrlException: An exception is raised if the logger is already started or if interpolation is requested while the telemetry history is disabled.
+        :raise ValueError: An exception is raised if mode is not ``"a"`` or ``"w"``, if file_format is not ``"csv"``, ``"binary"`` or ``"delta"``, if interpolation_delay is negative or if a file rotation is requested for another format than ``"delta"`` or if mode ``"a"`` is used with ``"delta"``.
         
         """
         
-        if self.__DATA_LOGGER_FILEHANDLER is not None:
+        if self.__DATA_LOGGER_FILEHANDLER is not None or self.__DATA_LOGGER_BINARY is not None:
             raise tello_ctrlException('Data are already logged. Use stop_data_logging first')
         
         if mode!='w' and mode!='a':
             raise ValueError('mode must be "a" or "w", not %s.' % (mode))
+        
+        if file_format!='csv' and file_format!='binary' and file_format!='delta':
+            raise ValueError('file_format must be "csv", "binary" or "delta", not %s.' % (file_format))
+        
+        if file_format=='delta' and mode!='w':
+            raise ValueError('file_format "delta" only supports mode "w"')
+        
+        if (max_file_size is not None or max_file_duration is not None) and file_format!='delta':
+            raise ValueError('The files can only be rotated with file_format "delta"')
+        
+        if interpolation_delay is not None:
+            if interpolation_delay<0:
+                raise ValueError('interpolation_delay must be positive')
+            if self.__history is None:
+                raise tello_ctrlException('The telemetry history is disabled, the sensors cannot be interpolated')
             
         directory = os.path.dirname(file_name)
         if directory != '' and not os.path.exists(directory):
@@ -1834,123 +2486,164 @@ class tello_ctrl(object):
         # check extension
         base, ext = os.path.splitext(file_name)
         if not ext:
-           file_name=file_name+'.CSV'
+           file_name=file_name+{'csv':'.CSV', 'binary':'.tlog', 'delta':'.tlz'}[file_format]
            
         if sensor_list==[]:
             self.__DATA_LOGGER_SENSOR_LIST=self.__sensor_list + self.__control_list
-            self.__DATA_LOGGER_RECORD_ALL=True
-            self.__DATA_LOGGER_IS_SENSOR=[]  # Not used
-            self.__DATA_LOGGER_SENSOR_IDX=[] # Not used
         else:
             # check that the provided list is correct
-            self.__DATA_LOGGER_IS_SENSOR=[]
-            self.__DATA_LOGGER_SENSOR_IDX=[]
             for sensor in sensor_list:
-                if sensor in self.__sensor_list:
-                    self.__DATA_LOGGER_IS_SENSOR.append(True)
-                    self.__DATA_LOGGER_SENSOR_IDX.append(self.__sensor_list.index(sensor))
-                elif sensor in self.__control_list:
-                    self.__DATA_LOGGER_IS_SENSOR.append(False)
-                    self.__DATA_LOGGER_SENSOR_IDX.append(self.__control_list.index(sensor))
-                else:
+                if sensor not in self.__sensor_list and sensor not in self.__control_list:
                     raise ValueError('The requested sensor "%s" does not exists.' % (sensor))
-            self.__DATA_LOGGER_SENSOR_LIST=sensor_list
-            self.__DATA_LOGGER_RECORD_ALL=False
-
+            self.__DATA_LOGGER_SENSOR_LIST=list(sensor_list)
+        self.__DATA_LOGGER_ROW=self.__data_logging_row(self.__DATA_LOGGER_SENSOR_LIST, interpolation_delay)
+        self.__DATA_LOGGER_DELAY=0 if interpolation_delay is None else interpolation_delay
+
+        if file_format=='binary':
+            self.__DATA_LOGGER_BINARY=DataLogWriter(file_name, ['time']+self.__DATA_LOGGER_SENSOR_LIST+['lateness'], mode=mode)
+        elif file_format=='delta':
+            self.__DATA_LOGGER_BINARY=DeltaLogWriter(file_name, ['time']+self.__DATA_LOGGER_SENSOR_LIST+['lateness'],
+                max_file_size=max_file_size, max_file_duration=max_file_duration)
+        else:
+            self.__DATA_LOGGER_FILEHANDLER =  logging.FileHandler(file_name,mode=mode)
+            
+            # Use a format such that we can write the header without the date
+            self.__DATA_LOGGER_FORMATTER=logging.Formatter('%(message)s')
+    
+            self.__DATA_LOGGER_FILEHANDLER.setFormatter(self.__DATA_LOGGER_FORMATTER)
+            
+            self.__DATA_LOGGER.addHandler(self.__DATA_LOGGER_FILEHANDLER)
+            self.__DATA_LOGGER_FILEHANDLER.setLevel(logging.INFO)
+    
+            # write header of the csv file
+            data_str='date;time;'
+            for sensor in self.__DATA_LOGGER_SENSOR_LIST:
+                data_str+='%s;'%(sensor)
+            data_str+='lateness;'
+            
+            self.__DATA_LOGGER.info(data_str)
+     
+            # Mofidy the formater to autoamtically include the exact time of logging
+            self.__DATA_LOGGER_FORMATTER=logging.Formatter('%(asctime)s;%(message)s')
+            self.__DATA_LOGGER_FILEHANDLER.setFormatter(self.__DATA_LOGGER_FORMATTER)
             
-        self.__DATA_LOGGER_FILEHANDLER =  logging.FileHandler(file_name,mode=mode)
-        
-        # Use a format such that we can write the header without the date
-        self.__DATA_LOGGER_FORMATTER=logging.Formatter('%(message)s')
-
-        self.__DATA_LOGGER_FILEHANDLER.setFormatter(self.__DATA_LOGGER_FORMATTER)
-        
-        self.__DATA_LOGGER.addHandler(self.__DATA_LOGGER_FILEHANDLER)
-        self.__DATA_LOGGER_FILEHANDLER.setLevel(logging.INFO)
         self.__DATA_LOGGER_PERIOD = sampling_time
+        self.__DATA_LOGGER_LAST_ROW=None
+        if sampling_time>0:
+            self.__DATA_LOGGER_SCHEDULER.set_period(sampling_time)
+            self.__DATA_LOGGER_STOP.clear()
+            self.__DATA_LOGGER_THREAD=threading.Thread(target=self.__data_logging_thread, name='data logger', daemon=True)
+            self.__DATA_LOGGER_THREAD.start()
         self.__LOGGER.info('Data logger started into file %s with sampling time %.2f and mode "%s"' % (file_name,sampling_time,mode))
 
-
-
-        # write header of the csv file
-        data_str='date;time;'
-        if self.__DATA_LOGGER_RECORD_ALL:
-            # part 1 sensor data
-            for i in range (len(self.__sensor_list)):
-                data_str+='%s;'%(self.__sensor_list[i])
-            # part 2 : control values
-            for i in range(len(self.__control_list)):
-                data_str+='%s;'%(self.__control_list[i])
-        else:
-            # Only some sensors
-            for sensor in sensor_list:
-                data_str+='%s;'%(sensor)
-        
+    def __data_logging_row(self, sensor_list, interpolation_delay):
+        # Returns a function giving the values of a row, in the order of sensor_list
+        view=self.__make_sensor_view(sensor_list)
+        
+        # sensors taken from the telemetry history when interpolating
+        interpolated=[]
+        if interpolation_delay is not None:
+            names=self.__history.get_names()
+            interpolated=[name for name in sensor_list if name in names]
+        interpolated_idx=[view.index[name] for name in interpolated]
+        
+        def row(timestamp):
+            values=view.values()
+            history=self.__history
+            if interpolated and history is not None:
+                values=list(values)
+                for i, value in zip(interpolated_idx, history.interpolate(interpolated, timestamp)):
+                    values[i]=value
+                values=tuple(values)
+            return values
+        return row
+        
+    def __data_logging_thread(self):
+        # The samples are taken on monotonic deadlines so they are uniformly spaced whatever the packets received
+        self.__LOGGER.debug("Starting data logging thread")
+        scheduler=self.__DATA_LOGGER_SCHEDULER
+        scheduler.reset()
+        wall_clock_offset=time.time()-time.monotonic()
+        while True:
+            if scheduler.wait(self.__DATA_LOGGER_STOP) is None:
+                break
+            # when the logger was late, wait() moved the deadline past the skipped samples: the lateness of the row
+            # is measured from this deadline (not from the first missed one) so that time+lateness is the sample time
+            deadline=scheduler.next_deadline
+            lateness=scheduler.last_wakeup-deadline
+            try:
+                self.__log_sample(deadline-self.__DATA_LOGGER_DELAY, wall_clock_offset, lateness)
+            except OSError as ex:
+                # the file can no longer be written (binary formats): the error is raised again by stop_data_logging
+                self.__LOGGER.error('data_logging_thread: the data log cannot be written, logging stopped: %s' % str(ex))
+                show_exception(ex)
+                break
+            except Exception as ex:
+                self.__LOGGER.error('data_logging_thread: %s' % str(ex))
+                show_exception(ex)
+        self.__LOGGER.debug('End of data logging thread')
+        
+    def __log_sample(self, timestamp, wall_clock_offset, lateness):
+        # timestamp is the sample time on the monotonic clock
+        values=self.__DATA_LOGGER_ROW(timestamp)
+        last=self.__DATA_LOGGER_LAST_ROW
+        self.__DATA_LOGGER_LAST_ROW=(0 if last is None else last[0]+1, timestamp)
+        writer=self.__DATA_LOGGER_BINARY
+        if writer is not None:
+            # binary format: the row is only packed here, the file is written by the writer thread
+            writer.write((timestamp+wall_clock_offset,)+values+(lateness,))
+            return
+        data_str='{0:.3f};'.format(timestamp+wall_clock_offset)+''.join(['%.10e;' % value for value in values])+'%.10e;' % lateness
         self.__DATA_LOGGER.info(data_str)
- 
-        # Mofidy the formater to autoamtically include the exact time of logging
-        self.__DATA_LOGGER_FORMATTER=logging.Formatter('%(asctime)s;%(message)s')
-        self.__DATA_LOGGER_FILEHANDLER.setFormatter(self.__DATA_LOGGER_FORMATTER)
-
+        
+    def get_data_logging_statistics(self):
+        """Returns the timing statistics of the data logger samples since :meth:`~tello_ctrl.tello_ctrl.start_data_logging`
+        (when the sampling time is positive). The dictionnary has the same entries as :meth:`~tello_ctrl.tello_ctrl.get_stick_command_statistics`,
+        ``missed`` being the number of samples skipped because the logger was late by more than one sampling period.
+        
+        :return: The data logger timing statistics.
+        :rtype: dict
+        
+        """
+        return self.__DATA_LOGGER_SCHEDULER.get_statistics()
+        
     def stop_data_logging(self):
         """Stops the data logger.
         
         :raise tello_ctrlException: An exception is raised if the data logger was not previously started using :meth:`~tello_ctrl.tello_ctrl.start_data_logging`.
+        :raise OSError: An exception is raised if the binary or delta data log could not be written (e.g. disk full). The rows received after the error are lost.
         
         """
-        if self.__DATA_LOGGER_FILEHANDLER is  None: 
+        if self.__DATA_LOGGER_FILEHANDLER is None and self.__DATA_LOGGER_BINARY is None: 
             raise tello_ctrlException('Data logger is not logged yet. Use start_data_logging first')
-        self.__DATA_LOGGER.removeHandler(self.__DATA_LOGGER_FILEHANDLER)
-        
-        self.__DATA_LOGGER_FILEHANDLER = None
         self.__DATA_LOGGER_PERIOD = -1
+        if self.__DATA_LOGGER_THREAD is not None:
+            self.__DATA_LOGGER_STOP.set()
+            self.__DATA_LOGGER_THREAD.join()
+            self.__DATA_LOGGER_THREAD=None
+        self.__DATA_LOGGER_LAST_ROW=None
+        if self.__DATA_LOGGER_BINARY is not None:
+            # the writer thread saves the queued rows before closing the file
+            writer=self.__DATA_LOGGER_BINARY
+            self.__DATA_LOGGER_BINARY=None
+            writer.close()
+        else:
+            self.__DATA_LOGGER.removeHandler(self.__DATA_LOGGER_FILEHANDLER)
+            self.__DATA_LOGGER_FILEHANDLER = None
         self.__LOGGER.info('Data logger stopped')
         
     def data_logging_request(self):
-        """Manually log the data in the log file.
+        """Manually log the data in the log file. The ``lateness`` column of these samples is 0.
         
         :raise tello_ctrlException: An exception is raised if the data logger was not previously started using :meth:`~tello_ctrl.tello_ctrl.start_data_logging`.
         
         """
         
         # log data upon request
-        if  self.__DATA_LOGGER_FILEHANDLER is None:
+        if self.__DATA_LOGGER_FILEHANDLER is None and self.__DATA_LOGGER_BINARY is None:
             raise tello_ctrlException('Data logger is not started yet. Use start_data_logging first')
-
-        data_str='{0:.3f};'.format(time.time())
-        
-        
-        if self.__DATA_LOGGER_RECORD_ALL:
-            # Record all the data
-            # part 1 sensor data
-            for i in range (len(self.__sensor_list)):
-                data_str+='%.10e;'%(getattr(self.__flight_data,self.__sensor_list[i]))
-                
-            # part 2 : control values
-            for i in range(len(self.__control_list)):
-                if i<4:
-                    # controls values needs to be shifted in the -100/100 range
-                    data_str+='%.10e;'%(100*getattr(self,"_tello_ctrl"+'__'+self.__control_list[i]))
-                else:
-                    data_str+='%.10e;'%(getattr(self,"_tello_ctrl"+'__'+self.__control_list[i]))
-                
-        else:
-            # Record some data in the order of self.__DATA_LOGGER_SENSOR_LIST
-            for i in range(len(self.__DATA_LOGGER_SENSOR_LIST)):
-                idx=self.__DATA_LOGGER_SENSOR_IDX[i]
-                if self.__DATA_LOGGER_IS_SENSOR[i]:
-                   # Current sensor is in self.__sensor_list
-                   data_str+='%.10e;'%(getattr(self.__flight_data,self.__sensor_list[idx]))
-                else:
-                    # Current sensor is in self.__control_list
-                    if idx<4:
-                        # controls values needs to be shifted in the -100/100 range
-                        data_str+='%.10e;'%(100*getattr(self,"_tello_ctrl"+'__'+self.__control_list[idx]))
-                    else:
-                        data_str+='%.10e;'%(getattr(self,"_tello_ctrl"+'__'+self.__control_list[idx]))
-        
-        # Add data to the recorder
-        self.__DATA_LOGGER.info(data_str)
+        now=time.monotonic()
+        self.__log_sample(now-self.__DATA_LOGGER_DELAY, time.time()-now, 0.0)
 
     def __start_live_video(self, position=None, size=None, stay_on_top=False):
         """ not working yet as cv2 crashes when called within a thread"""
@@ -1978,4 +2671,19 @@ class tello_ctrl(object):
         cv2.destroyWindow(self.__live_view_windows_name)
 
 
-
+if __name__ == '__main__':
+    # Cost per call of the list getter compared with the bulk getters (python tello_ctrl.py, no drone needed)
+    import timeit
+    drone = tello_ctrl()
+    names = drone.get_sensor_list()
+    subset = ['posX', 'posY', 'posZ', 'yaw', 'pitch', 'roll', 'height']
+    n = 20000
+    for label, selection in (('all the sensors', []), ('7 sensors', subset)):
+        count = len(drone.get_sensor_values_by_name(selection))
+        print('%s (%d values)' % (label, count))
+        for getter, call in (('get_sensor_values_by_name', lambda: drone.get_sensor_values_by_name(selection)),
+                             ('get_sensor_values_array numpy', lambda: drone.get_sensor_values_array(selection)),
+                             ('get_sensor_values_array no copy', lambda: drone.get_sensor_values_array(selection, copy=False)),
+                             ('get_sensor_values_array array', lambda: drone.get_sensor_values_array(selection, 'array'))):
+            print('  %-32s: %6.2f us' % (getter, timeit.timeit(call, number=n) / n * 1e6))
+    drone.quit()